@@ -0,0 +1,349 @@
+"""Module containing the functions used to analyze the restructured data.
+
+All the series of one gas are stacked into a (sources, years) matrix, with NaN for the years a source
+does not report, so that the statistics of every source are computed in one vectorised step.
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import analytic_tools.utilities as ut
+from analytic_tools.cache import load_series
+from analytic_tools.progress import progress
+
+
+def source_from_filename(name: str) -> str:
+    """Name of the source of a src_[source]_[gas_formula].csv file, e.g. oil_and_gass for src_oil_and_gass_CO2.csv"""
+    stem = name.split(".", 1)[0]
+    source = stem.rsplit("_", 1)[0]
+    return source[len("src_"):] if source.startswith("src_") else source
+
+
+def load_gas_series(gas_dir: str | Path) -> tuple[list[str], "np.ndarray", "np.ndarray"]:
+    """Read every src_[source]_[gas_formula].csv file in gas_dir, compressed or not, into one matrix.
+
+    Parameters:
+        - gas_dir (str or pathlib.Path) : Path to a gas_[gas_formula] directory
+
+    Returns:
+        - (List[str]) : Names of the sources, sorted
+        - (numpy.ndarray) : The sorted union of the years reported by the sources
+        - (numpy.ndarray) : Matrix of shape (sources, years) with the emissions, NaN where a source does not report a year
+    """
+    gas_dir = Path(gas_dir)
+    if not gas_dir.is_dir():
+        raise NotADirectoryError(f"{gas_dir} is not a directory")
+
+    files = sorted(file for file in gas_dir.iterdir() if file.is_file() and ut.is_csv_name(file.name))
+    return load_files_series(files)
+
+
+def load_files_series(
+    files: list[Path], names: list[str] | None = None, years: tuple[int, int] | None = None
+) -> tuple[list[str], "np.ndarray", "np.ndarray"]:
+    """Read the .csv files of one gas into one matrix, see load_gas_series.
+
+    Parameters:
+        - files (List[pathlib.Path]) : Paths to the .csv files
+        - names (List[str] or None) : The src_[source]_[gas_formula].csv name of every file, default to the names of the files
+        - years (tuple[int, int] or None) : If given, only the rows of the first to the last year are read
+
+    Returns:
+        - (List[str]) : Names of the sources, in the order of files
+        - (numpy.ndarray) : The sorted union of the years reported by the sources
+        - (numpy.ndarray) : Matrix of shape (sources, years) with the emissions, NaN where a source does not report a year
+    """
+    import numpy as np
+
+    names = names if names is not None else [file.name for file in files]
+    sources = [source_from_filename(name) for name in names]
+    series = [load_series(file) for file in files]
+    if years is not None:
+        series = [data[(data[:, 0] >= years[0]) & (data[:, 0] <= years[1])] for data in series]
+    return (sources, *stack_series(series))
+
+
+def stack_series(series: list["np.ndarray"]) -> tuple["np.ndarray", "np.ndarray"]:
+    """Stack series over the union of their years.
+
+    Parameters:
+        - series (List[numpy.ndarray]) : Arrays of shape (years, 2) with the year in the first column and the emission in the second
+
+    Returns:
+        - (numpy.ndarray) : The sorted union of the years of the series
+        - (numpy.ndarray) : Matrix of shape (series, years) with the emissions, NaN where a series does not report a year
+    """
+    import numpy as np
+
+    years = np.unique(np.concatenate([data[:, 0] for data in series])) if series else np.empty(0)
+    values = np.full((len(series), years.size), np.nan)
+    for row, data in enumerate(series):
+        values[row, np.searchsorted(years, data[:, 0])] = data[:, 1]
+    return years, values
+
+
+def load_pollution_series(
+    by_gas_dir: str | Path, selection: ut.Selection | None = None
+) -> tuple[list[tuple[str, str]], "np.ndarray", "np.ndarray"]:
+    """Read the series of every gas and source of by_gas_dir into one matrix, see load_gas_series.
+
+    Parameters:
+        - by_gas_dir (str or pathlib.Path) : Path to the pollution_data_restructured/by_gas directory
+        - selection (utilities.Selection or None) : If given, only the selected gases and years are read
+
+    Returns:
+        - (List[tuple[str, str]]) : The (gas, source) of every series, sorted
+        - (numpy.ndarray) : The sorted union of the years reported by the series
+        - (numpy.ndarray) : Matrix of shape (series, years) with the emissions, NaN where a series does not report a year
+    """
+    by_gas_dir = Path(by_gas_dir)
+    if not by_gas_dir.is_dir():
+        raise NotADirectoryError(f"{by_gas_dir} is not a directory")
+
+    keys, files = [], []
+    for gas_dir in sorted(by_gas_dir.iterdir()):
+        gas = gas_dir.name[len("gas_"):]
+        if not gas_dir.is_dir() or (selection is not None and not selection.match_gas(gas)):
+            continue
+        for file in sorted(gas_dir.iterdir()):
+            if file.is_file() and ut.is_csv_name(file.name):
+                keys.append((gas, source_from_filename(file.name)))
+                files.append(file)
+    _, years, values = load_files_series(files, years=selection.years if selection is not None else None)
+    return keys, years, values
+
+
+def fit_trends(
+    years: "np.ndarray", values: "np.ndarray", degree: int = 1, forecast: "np.ndarray | list[int]" = ()
+) -> dict:
+    """Fit a least squares polynomial trend to every row of values at once, using only the years each row reports.
+       Rows reporting the same years share one Vandermonde matrix and are solved by a single lstsq call,
+       so that the usual case of series covering the same years takes one call for all of them.
+
+    Parameters:
+        - years (numpy.ndarray) : The years, of shape (years,)
+        - values (numpy.ndarray) : The emissions, of shape (series, years), NaN where missing
+        - degree (int) : Degree of the polynomials, default to one (linear trends)
+        - forecast (numpy.ndarray or List[int]) : Years to project the trends to, default to none
+
+    Returns:
+        - (dict) : The fit with keys: slope (derivative of each trend at the last year of its series, per year),
+                   fitted (the trends at years, of shape (series, years)), residuals (values minus fitted, NaN where missing),
+                   rmse (root mean square of the residuals of each series) and projections (the trends at forecast,
+                   of shape (series, forecast)). Series with no more reported years than degree get NaN
+    """
+    import numpy as np
+
+    if not isinstance(degree, int) or isinstance(degree, bool):
+        raise TypeError(f"degree is of type {type(degree)}, expected int")
+    if degree < 0:
+        raise ValueError(f"degree must be at least 0, but got {degree}")
+
+    years = np.asarray(years, dtype=float)
+    values = np.asarray(values, dtype=float).reshape(-1, years.size)
+    forecast = np.asarray(forecast, dtype=float)
+
+    # Centered and scaled years keep the Vandermonde matrix well conditioned, where the powers of 2000 would not be
+    center = years.mean() if years.size else 0.0
+    scale = max(np.ptp(years) / 2, 1.0) if years.size else 1.0
+    vander = np.vander((years - center) / scale, degree + 1, increasing=True)
+
+    reported = ~np.isnan(values)
+    coefficients = np.full((values.shape[0], degree + 1), np.nan)
+    if values.shape[0]:
+        patterns, inverse = np.unique(reported, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for index, pattern in enumerate(patterns):
+            if pattern.sum() <= degree:
+                continue
+            rows = inverse == index
+            # Every row of the group is one right-hand side of the same least squares problem
+            solution = np.linalg.lstsq(vander[pattern], values[rows][:, pattern].T, rcond=None)[0]
+            coefficients[rows] = solution.T
+
+    fitted = coefficients @ vander.T
+    residuals = np.where(reported, values - fitted, np.nan)
+    counts = reported.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rmse = np.sqrt(np.square(np.where(reported, residuals, 0.0)).sum(axis=1) / counts)
+
+    # Derivative of the polynomial at the last reported year of each series
+    if years.size:
+        last = years[years.size - 1 - np.argmax(reported[:, ::-1], axis=1)]
+    else:
+        last = np.full(values.shape[0], center)
+    x_last = (last - center) / scale
+    powers = np.arange(1, degree + 1)
+    slope = (coefficients[:, 1:] * powers * x_last[:, np.newaxis] ** (powers - 1)).sum(axis=1) / scale
+    slope = np.where(np.isnan(coefficients[:, 0]), np.nan, slope)
+
+    projections = coefficients @ np.vander((forecast - center) / scale, degree + 1, increasing=True).T
+    return {"slope": slope, "fitted": fitted, "residuals": residuals, "rmse": rmse, "projections": projections}
+
+
+def fit_pollution_trends(
+    by_gas_dir: str | Path,
+    degree: int = 1,
+    forecast: list[int] | tuple[int, ...] = (),
+    selection: ut.Selection | None = None,
+) -> dict:
+    """Fit a polynomial trend to the series of every gas and source of by_gas_dir at once, see fit_trends.
+
+    Parameters:
+        - by_gas_dir (str or pathlib.Path) : Path to the pollution_data_restructured/by_gas directory
+        - degree (int) : Degree of the polynomials, default to one (linear trends)
+        - forecast (List[int]) : Years to project the trends to, default to none
+        - selection (utilities.Selection or None) : If given, only the selected gases and years are fitted
+
+    Returns:
+        - (dict) : The trends, with keys: degree, years, forecast years and per gas, mapping each gas to each of its sources
+                   to its slope (per year, at its last year), rmse, projections (one per forecast year) and residuals (per year)
+    """
+    keys, years, values = load_pollution_series(by_gas_dir, selection)
+    fit = fit_trends(years, values, degree=degree, forecast=forecast)
+
+    per_gas: dict[str, dict] = {}
+    for row, (gas, source) in enumerate(keys):
+        per_gas.setdefault(gas, {})[source] = {
+            "slope": fit["slope"][row],
+            "rmse": fit["rmse"][row],
+            "projections": fit["projections"][row],
+            "residuals": fit["residuals"][row],
+        }
+    return _to_json({"degree": degree, "years": years.astype(int), "forecast years": list(forecast), "per gas": per_gas})
+
+
+def summarize_gas(sources: list[str], years: "np.ndarray", values: "np.ndarray") -> dict:
+    """Compute the summary statistics of the series of one gas, as returned by load_gas_series.
+
+    Parameters:
+        - sources (List[str]) : Names of the sources
+        - years (numpy.ndarray) : The years, of shape (years,)
+        - values (numpy.ndarray) : The emissions, of shape (sources, years), NaN where missing
+
+    Returns:
+        - (dict) : The summary with keys: years, sources, total (all sources per year), cumulative total,
+                   and per source, mapping each source to its min, max, mean, sum, cumulative (per year),
+                   trend slope (least squares, per year) and share (of the total per year)
+    """
+    import numpy as np
+
+    missing = np.isnan(values)
+    filled = np.where(missing, 0.0, values)
+    counts = (~missing).sum(axis=1)
+
+    total = filled.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = filled.sum(axis=1) / counts
+        minimum = np.where(counts > 0, np.where(missing, np.inf, values).min(axis=1, initial=np.inf), np.nan)
+        maximum = np.where(counts > 0, np.where(missing, -np.inf, values).max(axis=1, initial=-np.inf), np.nan)
+
+        # Least squares slope of every source at once, using only the years each source reports
+        x = np.where(missing, 0.0, years[np.newaxis, :])
+        x_mean = x.sum(axis=1) / counts
+        dx = np.where(missing, 0.0, years[np.newaxis, :] - x_mean[:, np.newaxis])
+        dy = np.where(missing, 0.0, values - mean[:, np.newaxis])
+        slope = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+
+        share = np.where(missing, np.nan, filled / total[np.newaxis, :])
+
+    cumulative = np.where(missing, np.nan, np.cumsum(filled, axis=1))
+
+    per_source = {}
+    for i, source in enumerate(sources):
+        per_source[source] = {
+            "min": minimum[i],
+            "max": maximum[i],
+            "mean": mean[i],
+            "sum": filled[i].sum(),
+            "cumulative": cumulative[i],
+            "trend slope": slope[i],
+            "share": share[i],
+        }
+
+    return _to_json(
+        {
+            "years": years.astype(int),
+            "sources": sources,
+            "total": total,
+            "cumulative total": np.cumsum(total),
+            "per source": per_source,
+        }
+    )
+
+
+def _to_json(obj):
+    """Convert numpy arrays and scalars in obj to lists and floats, with None for NaN and infinities"""
+    import numpy as np
+
+    if isinstance(obj, dict):
+        return {key: _to_json(val) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_json(val) for val in obj]
+    if isinstance(obj, np.ndarray):
+        return _to_json(obj.tolist())
+    if isinstance(obj, (float, np.floating)):
+        return float(obj) if np.isfinite(obj) else None
+    if isinstance(obj, np.integer):
+        return int(obj)
+    return obj
+
+
+def write_gas_summary(gas_dir: str | Path) -> Path:
+    """Compute the summary statistics of a gas_[gas_formula] directory and write them to its summary.json file.
+
+    Parameters:
+        - gas_dir (str or pathlib.Path) : Path to a gas_[gas_formula] directory
+
+    Returns:
+        - (pathlib.Path) : Path to the written summary.json file
+    """
+    gas_dir = Path(gas_dir)
+    summary = {"gas": gas_dir.name.split("_", 1)[-1], **summarize_gas(*load_gas_series(gas_dir))}
+    summary_path = gas_dir / ut.SUMMARY_NAME
+    with ut.atomic_write(summary_path, "w") as file:
+        file.write(json.dumps(summary, indent=1))
+    # Renaming the summary into place modified gas_dir, which summarize_pollution_data compares it with
+    os.utime(summary_path)
+    return summary_path
+
+
+def summarize_pollution_data(
+    by_gas_dir: str | Path, incremental: bool = False, selection: ut.Selection | None = None
+) -> dict[str, int]:
+    """Write a summary.json file with the summary statistics (see summarize_gas) to every gas_[gas_formula]
+       directory in by_gas_dir, so that its consumers do not have to parse every .csv file again.
+
+    Parameters:
+        - by_gas_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/by_gas directory
+        - incremental (bool) : If True, skip the gases whose summary.json is newer than all of their .csv files
+        - selection (utilities.Selection or None) : If given, only the selected gases are summarized
+
+    Returns:
+        - (Dict[str, int]) : Number of summaries written and skipped, with keys: summarized, skipped
+    """
+    if not isinstance(by_gas_dir, (str, Path)):
+        raise TypeError(f"by_gas_dir is of type {type(by_gas_dir)}, expected str or Path")
+
+    by_gas_dir = Path(by_gas_dir)
+    if not by_gas_dir.is_dir():
+        raise NotADirectoryError(f"{by_gas_dir} is not a directory")
+
+    res = {"summarized": 0, "skipped": 0}
+    progress.stage("summarize")
+    for gas_dir in sorted(by_gas_dir.iterdir()):
+        if not gas_dir.is_dir():
+            continue
+        if selection is not None and not selection.match_gas(gas_dir.name[len("gas_"):]):
+            continue
+        files = [file for file in gas_dir.iterdir() if ut.is_csv_name(file.name)]
+        # gas_dir is a source too, so that a removed or renamed .csv file makes the summary stale
+        if incremental and ut.is_up_to_date(gas_dir / ut.SUMMARY_NAME, [gas_dir, *files]):
+            res["skipped"] += 1
+        else:
+            write_gas_summary(gas_dir)
+            res["summarized"] += 1
+            progress.add(files=1)
+    return res
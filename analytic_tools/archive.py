@@ -0,0 +1,447 @@
+"""Module containing the support for pollution_data snapshots bundled as .zip or .tar[.gz|.bz2|.xz] archives.
+
+The members of an archive are classified with the same rules as the files of a pollution_data directory,
+so that the diagnostics are computed from the index of the archive alone, and only the gas .csv files are
+read, streamed directly into pollution_data_restructured/by_gas without extracting the rest of the archive.
+Tar archives are read as a stream, so even compressed ones are only decompressed once.
+"""
+from __future__ import annotations
+
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Iterator
+
+import analytic_tools.utilities as ut
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+@dataclass(frozen=True)
+class ArchiveMember:
+    """A member of an archive.
+
+    Parameters:
+        - name (str) : Path of the member inside the archive, with "/" as separator and no trailing "/"
+        - is_dir (bool) : True if the member is a directory
+        - is_file (bool) : True if the member is a regular file, which can be read
+        - size (int) : Size of the member in bytes, once uncompressed
+        - mtime (float) : Modification time of the member, in seconds since the epoch
+    """
+
+    name: str
+    is_dir: bool
+    is_file: bool
+    size: int
+    mtime: float
+
+    @property
+    def path(self) -> PurePosixPath:
+        return PurePosixPath(self.name)
+
+
+def is_archive(path: str | Path) -> bool:
+    """Check if path points to an existing file with the extension of a supported archive"""
+    if not isinstance(path, (str, Path)):
+        return False
+    path = Path(path)
+    return path.name.lower().endswith(ARCHIVE_SUFFIXES) and path.is_file()
+
+
+def archive_stem(path: str | Path) -> str:
+    """Name of the archive pointed to by path without its extension, e.g. pollution_data for pollution_data.tar.gz"""
+    name = Path(path).name
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def iter_members(archive: str | Path) -> Iterator[tuple[ArchiveMember, Callable[[], BinaryIO]]]:
+    """Stream the members of the archive pointed to by archive, in the order they are stored.
+
+    Parameters:
+        - archive (str or pathlib.Path) : Path to a .zip or .tar[.gz|.bz2|.xz] archive
+
+    Returns:
+        - (Iterator[tuple[ArchiveMember, Callable]]) : Every member, with a function opening its contents.
+                        For tar archives, the contents can only be read before moving on to the next member
+    """
+    archive = Path(archive)
+    if archive.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as zip_file:
+            # The member list of a zip archive is read from its central directory, without reading the members
+            for info in zip_file.infolist():
+                is_dir = info.is_dir()
+                member = ArchiveMember(
+                    name=info.filename.rstrip("/"),
+                    is_dir=is_dir,
+                    is_file=not is_dir,
+                    size=info.file_size,
+                    mtime=_zip_mtime(info),
+                )
+                yield member, lambda info=info: zip_file.open(info)
+    else:
+        with tarfile.open(archive, mode="r|*") as tar_file:
+            for info in tar_file:
+                member = ArchiveMember(
+                    name=info.name.rstrip("/"),
+                    is_dir=info.isdir(),
+                    is_file=info.isfile(),
+                    size=info.size,
+                    mtime=float(info.mtime),
+                )
+                yield member, lambda info=info: tar_file.extractfile(info)
+
+
+def _zip_mtime(info: zipfile.ZipInfo) -> float:
+    """Modification time of a zip member, which is stored as local time"""
+    return time.mktime((*info.date_time, 0, 0, -1))
+
+
+def _selected(parts: tuple[str, ...], policy: ut.TraversalPolicy) -> bool:
+    """Check if a member whose path has the components parts is reached by a walk following policy"""
+    if any(policy.ignores(part) for part in parts):
+        return False
+    # Files at depth d are listed by a walk that descends d - 1 levels
+    return policy.max_depth is None or len(parts) - 1 <= policy.max_depth
+
+
+def build_archive_tree(archive: str | Path, policy: ut.TraversalPolicy | None = None) -> ut.DirNode:
+    """Build the rollup tree (see utilities.build_rollup_tree) of the archive pointed to by archive from its
+       member list, without extracting anything. Directories that are only implied by the paths of their members are included.
+
+    Parameters:
+        - archive (str or pathlib.Path) : Path to a .zip or .tar[.gz|.bz2|.xz] archive
+        - policy (utilities.TraversalPolicy or None) : The members to leave out, by their ignore patterns and depth
+
+    Returns:
+        - (utilities.DirNode) : The root of the tree, named after the archive without its extension
+    """
+    policy = policy or ut.TraversalPolicy()
+    root = ut.DirNode(archive_stem(archive))
+    nodes = {(): root}
+    files: dict[tuple[str, ...], int] = {}
+
+    def directory(parts: tuple[str, ...]) -> ut.DirNode:
+        node = nodes.get(parts)
+        if node is None:
+            node = nodes[parts] = ut.DirNode(parts[-1])
+            directory(parts[:-1]).children.append(node)
+        return node
+
+    for member, _ in iter_members(archive):
+        parts = tuple(part for part in member.path.parts if part not in ("", "."))
+        if not parts or not _selected(parts, policy):
+            continue
+        if member.is_dir:
+            directory(parts)
+        else:
+            # A member stored twice is counted once, like the file it is extracted to
+            files[parts] = member.size
+
+    for parts, size in files.items():
+        node = directory(parts[:-1])
+        node.files.append(parts[-1])
+        node.count_file(parts[-1], size)
+
+    order = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node.files.sort()
+        node.children.sort(key=lambda child: child.name)
+        node.dir_count = len(node.children)
+        order.append(node)
+        stack.extend(node.children)
+    ut.add_subtree_totals(order)
+    return root
+
+
+def restructure_archive(
+    archive: str | Path,
+    dest_dir: str | Path,
+    incremental: bool = False,
+    store_dir: str | Path | None = None,
+    validate: bool = False,
+    selection: ut.Selection | None = None,
+    policy: ut.TraversalPolicy | None = None,
+    sink: ArchiveSink | None = None,
+    keep_compressed: bool = False,
+) -> dict:
+    """Stream the gas .csv members of the archive pointed to by archive into gas_[gas_formula] directories in dest_dir,
+       like restructure_pollution_data does for a pollution_data directory. No other member is read.
+
+    Parameters:
+        - archive (str or pathlib.Path) : Path to a .zip or .tar[.gz|.bz2|.xz] archive of a pollution_data directory
+        - dest_dir (str or pathlib.Path) : Path to the pollution_data_restructured/by_gas directory
+        - incremental (bool) : If True, members whose copy is at least as new (and, without a range of years, of the same size) are skipped
+        - store_dir (str, pathlib.Path or None) : Content-addressed store the copies are linked to, see utilities.store_file
+        - validate (bool) : If True, validate the members while they are extracted and leave the invalid ones out
+        - selection (utilities.Selection or None) : The gases, sources and years to extract, default to all of them
+        - policy (utilities.TraversalPolicy or None) : The members to leave out, default to those in utilities.DEFAULT_IGNORE
+        - sink (ArchiveSink or None) : If given, the copies are written to this archive, under the directory dest_dir inside it
+        - keep_compressed (bool) : If True, compressed members (e.g. CO2.csv.gz) keep their compression in dest_dir,
+                                   instead of being decompressed into plain .csv copies
+
+    Returns:
+        - (dict) : The report of restructure_pollution_data, where errors are keyed by the name of the member in the archive
+
+    Raises:
+        - ValueError : If a sink is given and a file is stored twice, with its preferred variant coming last (see
+                       utilities.preferred_variants), since the member already written cannot be replaced
+    """
+    dest_dir = Path(dest_dir) if sink is None else PurePosixPath(dest_dir)
+    policy = policy or ut.TraversalPolicy(ignore=ut.DEFAULT_IGNORE)
+    years = selection.years if selection is not None else None
+
+    res = ut.new_restructure_report(store=store_dir is not None, validate=validate)
+
+    # Of a file stored several times, plain and compressed, one variant is copied (see utilities.preferred_variants).
+    # The members are streamed, so a preferred variant coming after another one replaces its copy and its outcome
+    chosen: dict[tuple[str, str], tuple[str, Path | PurePosixPath]] = {}
+    outcomes: dict[tuple[str, str], tuple | None] = {}
+
+    for member, open_member in iter_members(archive):
+        path = member.path
+        if not (member.is_file and ut.is_restructured_source(path.parts, selection) and _selected(path.parts, policy)):
+            continue
+
+        key = (path.parent.as_posix(), ut.split_compression(path.name)[0])
+        previous = chosen.get(key)
+        if previous is not None:
+            if ut.variant_rank(path.name) >= ut.variant_rank(previous[0]):
+                continue
+            if sink is not None:
+                raise ValueError(
+                    f"{archive} holds {path.parent / previous[0]} before {member.name}, a variant of the same file, "
+                    "which cannot be replaced in the archive written. Remove one of them"
+                )
+
+        gas_dir = dest_dir / f"gas_{ut.gas_formula(path.name)}"
+        dest_file_path = gas_dir / ut.restructured_name(path, keep_compressed)
+        src_compression = ut.split_compression(path.name)[1]
+        compression = src_compression if keep_compressed else ""
+        chosen[key] = (path.name, dest_file_path)
+
+        if sink is not None:
+            with open_member() as member_file, sink.open(dest_file_path.as_posix(), member.mtime) as entry:
+                with ut.open_csv(member_file, compression=src_compression) as src_file:
+                    errors = ut.copy_gas_stream(src_file, entry, validate, years, compression)
+                if errors:
+                    entry.discard()
+            outcomes[key] = (member.name, errors, 0, True)
+            continue
+
+        gas_dir.mkdir(exist_ok=True)
+        # Decompressed copies and copies with filtered years differ in size from their member. The copy of a variant
+        # replaced in this run is not up to date, whatever its time
+        same_size = years is None and compression == src_compression
+        # What a copy linked into the store is made from, see utilities.record_link
+        source = {
+            "path": f"{Path(archive).absolute()}/{member.name}",
+            "size": member.size,
+            "mtime": member.mtime,
+            "years": list(years) if years is not None else None,
+            "compression": compression,
+        }
+        incremental_check = incremental and previous is None
+        if store_dir is not None:
+            # A link has the time of the stored contents, which may have been stored from another member
+            up_to_date = incremental_check and ut.is_link_up_to_date(store_dir, dest_file_path, source)
+        else:
+            up_to_date = incremental_check and _is_up_to_date(dest_file_path, member, same_size=same_size)
+        if up_to_date:
+            outcomes[key] = None
+            continue
+
+        if store_dir is None:
+            # Renamed over dest_file_path once complete, see utilities.temporary_path
+            tmp_path = ut.temporary_path(dest_file_path)
+        else:
+            # The copy to store keeps the name of the copy, so that store_file can tell its compression,
+            # in a directory of its own next to the temporary files of store_file
+            Path(store_dir).mkdir(parents=True, exist_ok=True)
+            tmp_path = Path(tempfile.mkdtemp(dir=store_dir, prefix=".tmp_")) / dest_file_path.name
+        try:
+            with open_member() as member_file, ut.open_csv(member_file, compression=src_compression) as src_file:
+                errors = ut.copy_gas_stream(src_file, tmp_path, validate, years, compression)
+            # The copy keeps the time of the member, like shutil.copy2 does for files, for incremental runs
+            os.utime(tmp_path, (member.mtime, member.mtime))
+
+            # Invalid members are left out of by_gas
+            size, is_new = 0, True
+            if not errors and store_dir is None:
+                # A link into a content-addressed store used by an earlier run is replaced, never written through
+                os.replace(tmp_path, dest_file_path)
+            elif not errors:
+                stored, is_new = ut.store_file(tmp_path, store_dir)
+                ut.link_file(stored, dest_file_path)
+                ut.record_link(store_dir, dest_file_path, stored, source)
+                size = stored.stat().st_size
+            outcomes[key] = (member.name, errors, size, is_new)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            if store_dir is not None:
+                tmp_path.parent.rmdir()
+
+    for outcome in outcomes.values():
+        if outcome is None:
+            res["skipped"] += 1
+        else:
+            ut.add_copy_outcome(res, *outcome)
+
+    if sink is None:
+        # Copies of other variants of the same members would count them twice, see restructure_pollution_data
+        copy_names: dict[Path, set[str]] = {}
+        for _, dest_file_path in chosen.values():
+            copy_names.setdefault(dest_file_path.parent, set()).add(dest_file_path.name)
+        for gas_dir, names in copy_names.items():
+            for name in ut.stale_variants(os.listdir(gas_dir), names):
+                (gas_dir / name).unlink()
+
+    return res
+
+
+class ArchiveSink:
+    """A single .zip or .tar[.gz|.bz2|.xz] archive that output files are written to as members, instead of as files
+    in a directory tree. The archive is written sequentially, and is only moved in place by close, so an interrupted
+    run never leaves a truncated archive behind. Members can be added from several threads.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the archive, whose extension gives its type, see ARCHIVE_SUFFIXES
+        - compress (bool) : If True, zip members are deflated. The compression of a tar archive is given by its extension
+    """
+
+    def __init__(self, path: str | Path, compress: bool = True) -> None:
+        self.path = Path(path)
+        name = self.path.name.lower()
+        if not name.endswith(ARCHIVE_SUFFIXES):
+            raise ValueError(f"{self.path} does not have the extension of an archive, expected one of {', '.join(ARCHIVE_SUFFIXES)}")
+        self._tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self._lock = threading.Lock()
+        self.members: list[str] = []
+        if name.endswith(".zip"):
+            self._zip = zipfile.ZipFile(self._tmp_path, "w", zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+            self._tar = None
+        else:
+            compression = {".gz": "gz", ".tgz": "gz", ".bz2": "bz2", ".tbz2": "bz2", ".xz": "xz", ".txz": "xz"}
+            mode = compression.get(os.path.splitext(name)[1], "")
+            # Stream mode writes the archive strictly sequentially
+            self._tar = tarfile.open(str(self._tmp_path), f"w|{mode}")
+            self._zip = None
+
+    def add_file(self, name: str, path: str | Path) -> None:
+        """Add the file pointed to by path as the member called name"""
+        with self._lock:
+            if self._zip is not None:
+                self._zip.write(path, name)
+            else:
+                self._tar.add(str(path), arcname=name)
+            self.members.append(name)
+
+    def open(self, name: str, mtime: float | None = None) -> SinkEntry:
+        """Open a new member called name for writing, see SinkEntry.
+        The contents are spooled, and only added to the archive once the entry is closed"""
+        return SinkEntry(self, name, time.time() if mtime is None else mtime)
+
+    def _add_spooled(self, name: str, spool, size: int, mtime: float) -> None:
+        spool.seek(0)
+        with self._lock:
+            if self._zip is not None:
+                info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+                info.compress_type = self._zip.compression
+                with self._zip.open(info, "w") as member:
+                    ut.copy_stream_chunked(spool, member)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = mtime
+                self._tar.addfile(info, spool)
+            self.members.append(name)
+
+    def close(self) -> None:
+        """Finish the archive and move it to path"""
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Stop writing and remove the unfinished archive"""
+        try:
+            if self._zip is not None:
+                self._zip.close()
+            else:
+                self._tar.close()
+        finally:
+            if self._tmp_path.exists():
+                self._tmp_path.unlink()
+
+    def __enter__(self) -> ArchiveSink:
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SinkEntry(io.RawIOBase):
+    """A member of an ArchiveSink being written, as a writable binary file object. Its contents are kept in
+    memory up to CHUNK_SIZE bytes, and in a temporary file beyond that, until the entry is closed and added to the archive.
+    An entry that is discarded, or closed by an exception in a with statement, is not added.
+    """
+
+    def __init__(self, sink: ArchiveSink, name: str, mtime: float) -> None:
+        super().__init__()
+        self._sink = sink
+        self.name = name
+        self._mtime = mtime
+        self._spool = tempfile.SpooledTemporaryFile(max_size=ut.CHUNK_SIZE)
+        self._size = 0
+        self._discarded = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._spool.write(data)
+        self._size += len(data)
+        return len(data)
+
+    def discard(self) -> None:
+        """Leave this entry out of the archive"""
+        self._discarded = True
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                if not self._discarded:
+                    self._sink._add_spooled(self.name, self._spool, self._size, self._mtime)
+            finally:
+                self._spool.close()
+        super().close()
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is not None:
+            self.discard()
+        self.close()
+
+
+def _is_up_to_date(dest: Path, member: ArchiveMember, same_size: bool) -> bool:
+    """Check if dest is at least as new as member, and of the same size if same_size"""
+    try:
+        stat = dest.stat()
+    except FileNotFoundError:
+        return False
+    return ut.copy_is_up_to_date(member.mtime, member.size, stat.st_mtime, stat.st_size, same_size)
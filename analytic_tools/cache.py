@@ -0,0 +1,115 @@
+"""Module containing the process-wide cache of parsed gas .csv files.
+
+Parsing a .csv file with np.loadtxt is far more expensive than a stat call, so every loader goes through
+load_series, which returns the parsed array from the cache as long as the size and modification time of
+the file are unchanged. The cache is bounded by the memory of the arrays it holds, and evicts the least
+recently used arrays first.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import analytic_tools.utilities as ut
+
+# Default memory budget of the process-wide cache
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class SeriesCache:
+    """A least recently used cache of parsed .csv files, keyed by (path, size, mtime_ns).
+    The cached arrays are read-only, since they are shared by every caller.
+
+    Parameters:
+        - max_bytes (int) : Maximum total size of the cached arrays, default to DEFAULT_MAX_BYTES
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must be non-negative, but got {max_bytes}")
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[int, int, "np.ndarray"]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def load(self, path: str | Path) -> "np.ndarray":
+        """Return the contents of the .csv file pointed to by path, without its header row, as a 2D array.
+
+        Parameters:
+            - path (str or pathlib.Path) : Path to the .csv file, which may be compressed (see utilities.COMPRESSED_SUFFIXES)
+
+        Returns:
+            - (numpy.ndarray) : Read-only array of shape (rows, columns)
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                size, mtime_ns, data = entry
+                if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return data
+                # The file changed since it was cached
+                self._remove(key)
+                self._stats["invalidations"] += 1
+            self._stats["misses"] += 1
+
+        # Parsed outside the lock, so that other threads can use the cache meanwhile
+        data = _parse(key)
+        data.setflags(write=False)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if data.nbytes <= self.max_bytes:
+                self._entries[key] = (stat.st_size, stat.st_mtime_ns, data)
+                self._bytes += data.nbytes
+                while self._bytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+                    self._stats["evictions"] += 1
+        return data
+
+    def _remove(self, key: str) -> None:
+        _, _, data = self._entries.pop(key)
+        self._bytes -= data.nbytes
+
+    def stats(self) -> dict[str, int]:
+        """Statistics of the cache, with keys: hits, misses, evictions, invalidations, entries and bytes"""
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._bytes}
+
+    def clear(self) -> None:
+        """Remove every array from the cache and reset its statistics"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._stats = dict.fromkeys(self._stats, 0)
+
+
+def _parse(path: str) -> "np.ndarray":
+    """Parse a .csv file with a header row into a 2D array, decompressing a .csv.gz or .csv.zst file as it is parsed"""
+    import numpy as np
+
+    with ut.open_csv(path) as file:
+        return np.loadtxt(file, delimiter=",", skiprows=1, ndmin=2)
+
+
+# The cache shared by all the loaders of this process
+series_cache = SeriesCache()
+
+
+def load_series(path: str | Path) -> "np.ndarray":
+    """Return the parsed contents of the .csv file pointed to by path, from the process-wide cache.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the .csv file
+
+    Returns:
+        - (numpy.ndarray) : Read-only array of shape (rows, columns), the year in the first column
+    """
+    return series_cache.load(path)
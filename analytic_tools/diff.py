@@ -0,0 +1,275 @@
+"""Module containing the comparison of two snapshots of pollution_data, e.g. yesterday's and today's.
+
+Each snapshot is described by a manifest with the path, size, modification time and hash of every gas .csv file,
+sorted by path, so that the two manifests are compared in one merge-join pass. A file stored both plain and
+compressed is described once, by the variant restructuring uses (see utilities.preferred_variants), so that no
+two entries share a path. Files with the same size and
+modification time are taken as unchanged without being read, as rsync does. Files of the same size are hashed,
+and the hashes are kept in the manifest of their snapshot for the next comparison. Only the files that changed are
+parsed, and their series are compared in one vectorised step, stacked over the union of their years.
+"""
+from __future__ import annotations
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import analytic_tools.utilities as ut
+from analytic_tools.analysis import stack_series
+from analytic_tools.cache import load_series
+
+# Suffix of the manifest of a snapshot, e.g. pollution_data.manifest.json
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def manifest_path(pollution_dir: str | Path) -> Path:
+    """Path to the manifest of the snapshot pollution_dir, in the pollution_data_restructured directory next to it,
+    with the other outputs of the pipeline, so that neither the snapshot nor its working directory gain a file"""
+    pollution_dir = Path(pollution_dir)
+    return pollution_dir.parent / "pollution_data_restructured" / (pollution_dir.name + MANIFEST_SUFFIX)
+
+
+def build_manifest(
+    pollution_dir: str | Path,
+    previous: dict | None = None,
+    algorithm: str = "blake2b",
+    selection: ut.Selection | None = None,
+    policy: ut.TraversalPolicy | None = None,
+) -> dict:
+    """Describe every gas .csv file of pollution_dir by its size and modification time, without reading it.
+       The hashes of previous are kept for the files whose size and modification time did not change.
+
+    Parameters:
+        - pollution_dir (str or pathlib.Path) : Path to the pollution_data directory of the snapshot
+        - previous (dict or None) : An earlier manifest of the same snapshot, e.g. read from manifest_path
+        - algorithm (str) : Name of the hash algorithm, see utilities.new_hasher. The hashes of a previous manifest
+                            made with another algorithm are dropped
+        - selection (utilities.Selection or None) : The gases and sources to describe, default to all of them
+        - policy (utilities.TraversalPolicy or None) : The subtrees of pollution_dir that are not searched
+
+    Returns:
+        - (dict) : The manifest, with keys algorithm and entries. Entries is a list of [key, name, size, mtime_ns, digest],
+                   sorted by key, the path of the file relative to pollution_dir without its compression suffix.
+                   Name is the path with the suffix, and digest is the hash of the decompressed contents, None until needed
+    """
+    pollution_dir = Path(pollution_dir)
+    if not pollution_dir.is_dir():
+        raise NotADirectoryError(f"{pollution_dir} is not a directory")
+
+    known = {}
+    if previous is not None and previous.get("algorithm") == algorithm:
+        known = {entry[1]: entry for entry in previous.get("entries", [])}
+
+    entries = []
+    for path in ut.find_gas_csv_files(pollution_dir, selection, policy):
+        name = path.relative_to(pollution_dir).as_posix()
+        stat = path.stat()
+        digest = None
+        old = known.get(name)
+        if old is not None and old[2:4] == [stat.st_size, stat.st_mtime_ns]:
+            digest = old[4]
+        entries.append([ut.split_compression(name)[0], name, stat.st_size, stat.st_mtime_ns, digest])
+    entries.sort()
+    return {"algorithm": algorithm, "entries": entries}
+
+
+def _load_manifest(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_manifest(path: Path, manifest: dict) -> None:
+    try:
+        path.parent.mkdir(exist_ok=True)
+        with ut.atomic_write(path, "w") as file:
+            file.write(json.dumps(manifest))
+    except OSError:
+        # A read-only snapshot is compared all the same, its hashes are only computed again next time
+        pass
+
+
+def merge_join(old_entries: list[list], new_entries: list[list]) -> tuple[list[list], list[list], list[tuple[list, list]]]:
+    """Pair the entries of two manifests by key, in one pass over both, which are sorted by key.
+
+    Parameters:
+        - old_entries (List[list]) : The entries of the manifest of the earlier snapshot, see build_manifest
+        - new_entries (List[list]) : The entries of the manifest of the later snapshot
+
+    Returns:
+        - (List[list]) : The entries only in the later snapshot
+        - (List[list]) : The entries only in the earlier snapshot
+        - (List[tuple[list, list]]) : The (old, new) entries of the files in both snapshots
+    """
+    added, removed, common = [], [], []
+    i = j = 0
+    while i < len(old_entries) and j < len(new_entries):
+        old, new = old_entries[i], new_entries[j]
+        if old[0] == new[0]:
+            common.append((old, new))
+            i += 1
+            j += 1
+        elif old[0] < new[0]:
+            removed.append(old)
+            i += 1
+        else:
+            added.append(new)
+            j += 1
+    removed.extend(old_entries[i:])
+    added.extend(new_entries[j:])
+    return added, removed, common
+
+
+def compare_series(old_series: list["np.ndarray"], new_series: list["np.ndarray"], tolerance: float = 0.0) -> list[dict]:
+    """Compare pairs of series, all at once, over the union of their years.
+
+    Parameters:
+        - old_series (List[numpy.ndarray]) : Arrays of shape (years, 2) with the year in the first column and the emission in the second
+        - new_series (List[numpy.ndarray]) : The series to compare them with, in the same order
+        - tolerance (float) : Largest absolute difference between two values that are considered equal
+
+    Returns:
+        - (List[dict]) : For every pair, the years added, removed and changed, and the largest absolute change (None if no
+                         value changed), with keys: added years, removed years, changed years, max change
+    """
+    import numpy as np
+
+    count = len(old_series)
+    if len(new_series) != count:
+        raise ValueError(f"Expected as many new series as old ones, but got {len(new_series)} and {count}")
+    if not count:
+        return []
+
+    years, values = stack_series([*old_series, *new_series])
+    old, new = values[:count], values[count:]
+    old_present, new_present = ~np.isnan(old), ~np.isnan(new)
+    both = old_present & new_present
+    change = np.where(both, np.abs(new - old), 0.0)
+    changed = both & (change > tolerance)
+    max_change = change.max(axis=1, initial=0.0)
+
+    res = []
+    for row in range(count):
+        res.append(
+            {
+                "added years": years[new_present[row] & ~old_present[row]].astype(int).tolist(),
+                "removed years": years[old_present[row] & ~new_present[row]].astype(int).tolist(),
+                "changed years": years[changed[row]].astype(int).tolist(),
+                "max change": float(max_change[row]) if changed[row].any() else None,
+            }
+        )
+    return res
+
+
+def _names(entries: list[list]) -> tuple[set[str], set[str]]:
+    """The sources (names of the src_[source] directories, without src_) and gases of the files of entries"""
+    parents = {Path(entry[0]).parent.name for entry in entries}
+    sources = {name[len("src_"):] if name.startswith("src_") else name for name in parents}
+    gases = {ut.gas_formula(entry[0]) for entry in entries}
+    return sources, gases
+
+
+def diff_snapshots(
+    old_dir: str | Path,
+    new_dir: str | Path,
+    workers: int = 4,
+    algorithm: str = "blake2b",
+    tolerance: float = 0.0,
+    selection: ut.Selection | None = None,
+    policy: ut.TraversalPolicy | None = None,
+    save_manifests: bool = True,
+) -> dict:
+    """Find what changed between two snapshots of pollution_data: the sources and gases added or removed,
+       the gas .csv files added, removed or changed, and the years and values of every changed series.
+
+    Parameters:
+        - old_dir (str or pathlib.Path) : Path to the pollution_data directory of the earlier snapshot
+        - new_dir (str or pathlib.Path) : Path to the pollution_data directory of the later snapshot
+        - workers (int) : Number of files hashed and parsed in parallel, default to four
+        - algorithm (str) : Name of the hash algorithm, see utilities.new_hasher (e.g. xxh64 if xxhash is installed)
+        - tolerance (float) : Largest absolute difference between two values that are considered equal
+        - selection (utilities.Selection or None) : The gases and sources to compare, default to all of them.
+                                                    Its years only limit the values compared in the changed files
+        - policy (utilities.TraversalPolicy or None) : The subtrees of the snapshots that are not searched
+        - save_manifests (bool) : If True, the manifest of each snapshot is written to the pollution_data_restructured
+                                  directory next to it (see manifest_path), so that its hashes are reused by the next comparison
+
+    Returns:
+        - (dict) : The report, with keys:
+                   sources and gases (each with the names added and removed), files (the keys of the files added,
+                   removed and changed, and the number unchanged), series (for every changed file whose values differ,
+                   see compare_series), hashed and read (the number of files hashed and parsed)
+    """
+    if not isinstance(old_dir, (str, Path)):
+        raise TypeError(f"old_dir is of type {type(old_dir)}, expected str or Path")
+    if not isinstance(new_dir, (str, Path)):
+        raise TypeError(f"new_dir is of type {type(new_dir)}, expected str or Path")
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, but got {workers}")
+
+    old_dir, new_dir = Path(old_dir), Path(new_dir)
+    manifests = {}
+    for root in (old_dir, new_dir):
+        previous = _load_manifest(manifest_path(root))
+        manifests[root] = build_manifest(root, previous, algorithm, selection, policy)
+    old_entries, new_entries = manifests[old_dir]["entries"], manifests[new_dir]["entries"]
+    added, removed, common = merge_join(old_entries, new_entries)
+
+    # Files of different sizes changed, and files of the same size and modification time are taken as unchanged
+    unchanged, changed, undecided = 0, [], []
+    for old, new in common:
+        same_compression = ut.split_compression(old[1])[1] == ut.split_compression(new[1])[1]
+        if same_compression and old[2:4] == new[2:4]:
+            unchanged += 1
+        elif same_compression and old[2] != new[2]:
+            changed.append((old, new))
+        else:
+            undecided.append((old, new))
+
+    to_hash = [(root, entry) for pair in undecided for root, entry in zip((old_dir, new_dir), pair) if entry[4] is None]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(lambda item: ut.hash_file(item[0] / item[1][1], algorithm, decompress=True), to_hash)
+        for (_, entry), digest in zip(to_hash, digests):
+            entry[4] = digest
+    for old, new in undecided:
+        if old[4] == new[4]:
+            unchanged += 1
+        else:
+            changed.append((old, new))
+
+    changed.sort(key=lambda pair: pair[0][0])
+
+    if save_manifests:
+        for root, manifest in manifests.items():
+            _save_manifest(manifest_path(root), manifest)
+
+    # Only the changed files are parsed, from the process-wide cache
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        old_series = list(pool.map(lambda pair: load_series(old_dir / pair[0][1]), changed))
+        new_series = list(pool.map(lambda pair: load_series(new_dir / pair[1][1]), changed))
+    years = selection.years if selection is not None else None
+    if years is not None:
+        old_series, new_series = (
+            [data[(data[:, 0] >= years[0]) & (data[:, 0] <= years[1])] for data in side] for side in (old_series, new_series)
+        )
+    series = {}
+    for (old, _), comparison in zip(changed, compare_series(old_series, new_series, tolerance)):
+        if comparison["added years"] or comparison["removed years"] or comparison["changed years"]:
+            series[old[0]] = comparison
+
+    old_sources, old_gases = _names(old_entries)
+    new_sources, new_gases = _names(new_entries)
+    return {
+        "sources": {"added": sorted(new_sources - old_sources), "removed": sorted(old_sources - new_sources)},
+        "gases": {"added": sorted(new_gases - old_gases), "removed": sorted(old_gases - new_gases)},
+        "files": {
+            "added": [entry[0] for entry in added],
+            "removed": [entry[0] for entry in removed],
+            "changed": [old[0] for old, _ in changed],
+            "unchanged": unchanged,
+        },
+        "series": series,
+        "hashed": len(to_hash),
+        "read": 2 * len(changed),
+    }
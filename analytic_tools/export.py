@@ -0,0 +1,265 @@
+"""Module containing the export of pollution_data_restructured/by_gas to one long-format columnar table.
+
+The table has one row per (gas, source, year), with the columns gas, source, year and value, so that
+analytics tools open one file instead of listing and parsing every small .csv file. It is written one
+gas at a time, as a row group, so the memory used does not depend on the size of the dataset.
+
+Two layouts are supported:
+    - parquet : Apache Parquet, written with pyarrow, which is only available if pyarrow is installed
+    - columnar : A dependency-free layout, read back with read_columnar. The file starts with COLUMNAR_MAGIC
+                 and is followed by the row groups, each storing its columns one after the other as little-endian
+                 arrays: gas (uint16 codes), source (uint16 codes), year (int32) and value (float64).
+                 It ends with a JSON footer holding the names the codes refer to and the offset and number
+                 of rows of every row group, then the length of the footer (uint64) and COLUMNAR_MAGIC again
+"""
+from __future__ import annotations
+
+import json
+import os
+import struct
+from pathlib import Path
+
+import analytic_tools.utilities as ut
+from analytic_tools.analysis import load_gas_series
+
+COLUMNAR_MAGIC = b"PDCOL1\0\0"
+# Types of the columns of the columnar layout, in the order they are stored in a row group
+COLUMNS = (("gas", "<u2"), ("source", "<u2"), ("year", "<i4"), ("value", "<f8"))
+FORMATS = ("auto", "columnar", "parquet")
+EXTENSIONS = {"columnar": ".pdcol", "parquet": ".parquet"}
+EXPORT_NAME = "pollution_data"
+
+_FOOTER_LENGTH = struct.Struct("<Q")
+
+
+def has_pyarrow() -> bool:
+    """Check if pyarrow is installed, so that Parquet files can be written"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_format(format: str) -> str:
+    """Resolve the "auto" format to parquet if pyarrow is installed and columnar otherwise"""
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format {format!r}, expected one of {', '.join(FORMATS)}")
+    if format == "auto":
+        return "parquet" if has_pyarrow() else "columnar"
+    if format == "parquet" and not has_pyarrow():
+        raise ImportError("The parquet format requires pyarrow, install it or use the columnar format")
+    return format
+
+
+class ColumnarWriter:
+    """Streaming writer of the dependency-free columnar layout, see the module documentation.
+    Every call to append writes one row group, and close writes the footer.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the file to write, overwritten if it exists
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, "wb")
+        self._file.write(COLUMNAR_MAGIC)
+        self._codes: dict[str, dict[str, int]] = {"gas": {}, "source": {}}
+        self._row_groups: list[dict[str, int]] = []
+
+    def _code(self, column: str, name: str) -> int:
+        codes = self._codes[column]
+        return codes.setdefault(name, len(codes))
+
+    def append(self, gas: str, sources: list[str], years: "np.ndarray", values: "np.ndarray") -> int:
+        """Write the series of one gas, as returned by analysis.load_gas_series, as a row group.
+        The years a source does not report (NaN) are left out.
+
+        Parameters:
+            - gas (str) : Formula of the gas
+            - sources (List[str]) : Names of the sources, one per row of values
+            - years (numpy.ndarray) : The years, of shape (years,)
+            - values (numpy.ndarray) : The emissions, of shape (sources, years)
+
+        Returns:
+            - (int) : Number of rows written
+        """
+        import numpy as np
+
+        reported = ~np.isnan(values)
+        source_rows, year_columns = np.nonzero(reported)
+        source_codes = np.array([self._code("source", source) for source in sources], dtype="<u2")
+        columns = {
+            "gas": np.full(source_rows.size, self._code("gas", gas), dtype="<u2"),
+            "source": source_codes[source_rows],
+            "year": years[year_columns],
+            "value": values[reported],
+        }
+        offset = self._file.tell()
+        for name, dtype in COLUMNS:
+            self._file.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        self._row_groups.append({"offset": offset, "rows": int(source_rows.size)})
+        return int(source_rows.size)
+
+    def close(self) -> None:
+        """Write the footer and close the file"""
+        if self._file.closed:
+            return
+        footer = {
+            "columns": [list(column) for column in COLUMNS],
+            "gas": list(self._codes["gas"]),
+            "source": list(self._codes["source"]),
+            "row_groups": self._row_groups,
+        }
+        data = json.dumps(footer).encode()
+        self._file.write(data)
+        self._file.write(_FOOTER_LENGTH.pack(len(data)))
+        self._file.write(COLUMNAR_MAGIC)
+        self._file.close()
+
+    def __enter__(self) -> ColumnarWriter:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ParquetWriter:
+    """Streaming writer of a Parquet file with pyarrow, with the same interface as ColumnarWriter.
+    Every call to append writes one row group, in which Parquet dictionary encodes the gas and source columns.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the file to write, overwritten if it exists
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = Path(path)
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                ("gas", pa.string()),
+                ("source", pa.string()),
+                ("year", pa.int32()),
+                ("value", pa.float64()),
+            ]
+        )
+        self._writer = pq.ParquetWriter(str(self.path), self._schema)
+
+    def append(self, gas: str, sources: list[str], years: "np.ndarray", values: "np.ndarray") -> int:
+        """Write the series of one gas as a row group, see ColumnarWriter.append"""
+        import numpy as np
+
+        pa = self._pa
+        reported = ~np.isnan(values)
+        source_rows, year_columns = np.nonzero(reported)
+        table = pa.table(
+            {
+                "gas": pa.array([gas] * source_rows.size, pa.string()),
+                "source": pa.array([sources[row] for row in source_rows], pa.string()),
+                "year": pa.array(years[year_columns].astype(np.int32)),
+                "value": pa.array(values[reported]),
+            },
+            schema=self._schema,
+        )
+        self._writer.write_table(table)
+        return int(source_rows.size)
+
+    def close(self) -> None:
+        """Write the footer and close the file"""
+        self._writer.close()
+
+    def __enter__(self) -> ParquetWriter:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_columnar(path: str | Path) -> dict[str, "np.ndarray"]:
+    """Read a file of the columnar layout written by ColumnarWriter.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the file
+
+    Returns:
+        - (Dict[str, numpy.ndarray]) : The columns gas and source (arrays of str) and year and value
+    """
+    import numpy as np
+
+    with open(path, "rb") as file:
+        if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f"{path} is not a columnar export file")
+        file.seek(-(len(COLUMNAR_MAGIC) + _FOOTER_LENGTH.size), os.SEEK_END)
+        (footer_length,) = _FOOTER_LENGTH.unpack(file.read(_FOOTER_LENGTH.size))
+        if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f"{path} is truncated, its footer is missing")
+        file.seek(-(len(COLUMNAR_MAGIC) + _FOOTER_LENGTH.size + footer_length), os.SEEK_END)
+        footer = json.loads(file.read(footer_length))
+
+        parts: dict[str, list] = {name: [] for name, _ in footer["columns"]}
+        for row_group in footer["row_groups"]:
+            file.seek(row_group["offset"])
+            for name, dtype in footer["columns"]:
+                parts[name].append(np.fromfile(file, dtype=dtype, count=row_group["rows"]))
+
+    columns = {}
+    for name, dtype in footer["columns"]:
+        columns[name] = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype)
+    for name in ("gas", "source"):
+        columns[name] = np.array(footer[name], dtype=str)[columns[name]] if footer[name] else np.empty(0, dtype=str)
+    return columns
+
+
+def export_pollution_data(
+    by_gas_dir: str | Path,
+    dest_dir: str | Path,
+    format: str = "auto",
+    selection: ut.Selection | None = None,
+) -> dict:
+    """Export every gas_[gas_formula] directory in by_gas_dir to one long-format table with the columns
+       gas, source, year and value, in dest_dir/pollution_data.[parquet or pdcol]. The gases are read and written
+       one at a time, and the file is only moved in place once it is complete.
+
+    Parameters:
+        - by_gas_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/by_gas directory
+        - dest_dir (str or pathlib.Path) : Absolute path to the directory the table is written to
+        - format (str) : One of auto (parquet if pyarrow is installed, otherwise columnar), columnar or parquet
+        - selection (utilities.Selection or None) : If given, only the selected gases are exported
+
+    Returns:
+        - (dict) : The outcome, with keys: path (of the written file), format, gases and rows (number exported)
+    """
+    if not isinstance(by_gas_dir, (str, Path)):
+        raise TypeError(f"by_gas_dir is of type {type(by_gas_dir)}, expected str or Path")
+    if not isinstance(dest_dir, (str, Path)):
+        raise TypeError(f"dest_dir is of type {type(dest_dir)}, expected str or Path")
+
+    by_gas_dir = Path(by_gas_dir)
+    dest_dir = Path(dest_dir)
+    if not by_gas_dir.is_dir():
+        raise NotADirectoryError(f"{by_gas_dir} is not a directory")
+    if not dest_dir.is_dir():
+        raise NotADirectoryError(f"{dest_dir} is not a directory")
+
+    format = resolve_format(format)
+    path = dest_dir / (EXPORT_NAME + EXTENSIONS[format])
+    tmp_path = dest_dir / f".{path.name}.tmp"
+    writer_class = ParquetWriter if format == "parquet" else ColumnarWriter
+
+    res = {"path": str(path), "format": format, "gases": 0, "rows": 0}
+    try:
+        with writer_class(tmp_path) as writer:
+            for gas_dir in sorted(by_gas_dir.iterdir()):
+                gas = gas_dir.name[len("gas_"):]
+                if not gas_dir.is_dir() or (selection is not None and not selection.match_gas(gas)):
+                    continue
+                res["rows"] += writer.append(gas, *load_gas_series(gas_dir))
+                res["gases"] += 1
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return res
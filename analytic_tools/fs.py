@@ -0,0 +1,703 @@
+"""Module containing the filesystem backends the restructuring can run on.
+
+FileSystem is the small interface the restructuring needs (list, stat, open, copy, mkdir and delete), on paths
+that are "/"-separated and relative to the root of the backend. Two backends implement it:
+    - LocalFileSystem : A directory of the local disk, with os and shutil
+    - ObjectStoreFileSystem : A bucket of an object store, over the subset of the S3 REST API listed below, without
+                              authentication (e.g. a MinIO bucket with anonymous access, or behind an authenticating proxy).
+                              Listings are fetched in pages (ListObjectsV2), connections are kept alive in a pool,
+                              large objects are written with multipart uploads and copied on the server side
+                              with multipart copies (UploadPartCopy), whose parts are sent in parallel
+
+The requests of ObjectStoreFileSystem are: GET /bucket?list-type=2 (listing), HEAD, GET, PUT and DELETE /bucket/key,
+PUT with x-amz-copy-source (copy), POST ?uploads, PUT ?partNumber&uploadId (optionally with x-amz-copy-source-range),
+POST ?uploadId (complete) and DELETE ?uploadId (abort). Object stores have no directories: a directory is the
+common prefix of the keys under it, so mkdir does nothing there.
+"""
+from __future__ import annotations
+
+import datetime
+import email.utils
+import http.client
+import io
+import os
+import shutil
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Iterator
+
+import analytic_tools.utilities as ut
+from analytic_tools.throttle import io_throttle
+
+# Size of the parts of multipart uploads and copies, the smallest part S3 accepts is 5 MiB
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class FileInfo:
+    """A file or directory of a FileSystem.
+
+    Parameters:
+        - path (str) : "/"-separated path, relative to the root of the file system
+        - is_dir (bool) : True for a directory
+        - size (int) : Size in bytes of a file, 0 for a directory
+        - mtime (float) : Modification time of a file, in seconds since the epoch, 0 if unknown
+    """
+
+    path: str
+    is_dir: bool
+    size: int = 0
+    mtime: float = 0.0
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.path).name
+
+
+def _parts(path: str | PurePosixPath) -> list[str]:
+    """The names of the components of a "/"-separated path, without empty and "." components"""
+    return [part for part in str(path).split("/") if part not in ("", ".")]
+
+
+class FileSystem:
+    """The interface of the filesystem backends, see the module documentation. Missing files raise FileNotFoundError."""
+
+    def list(self, path: str) -> list[FileInfo]:
+        """The files and directories in the directory path, sorted by name"""
+        raise NotImplementedError
+
+    def stat(self, path: str) -> FileInfo:
+        """The file or directory path"""
+        raise NotImplementedError
+
+    def open(self, path: str, mode: str = "rb") -> BinaryIO:
+        """Open the file path as a binary file object, to read ("rb") or to write ("wb"), replacing it.
+        In an object store, a written file only appears once the file object is closed"""
+        raise NotImplementedError
+
+    def copy(self, src: str, dest: str) -> None:
+        """Copy the file src to dest, replacing it"""
+        raise NotImplementedError
+
+    def mkdir(self, path: str) -> None:
+        """Create the directory path and its parents, if they do not exist"""
+        raise NotImplementedError
+
+    def delete(self, path: str) -> None:
+        """Delete the file path, or the directory path with all of its contents. Nothing happens if path does not exist"""
+        raise NotImplementedError
+
+    def exists(self, path: str) -> bool:
+        """Check if the file or directory path exists"""
+        try:
+            self.stat(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def walk(self, path: str, policy: ut.TraversalPolicy | None = None) -> Iterator[tuple[str, list[str], list[str]]]:
+        """Walk the directory tree under path top-down, like utilities.walk, one list call per directory.
+        Symbolic links and file system boundaries do not exist here, so only the ignore and max_depth fields of policy apply.
+
+        Parameters:
+            - path (str) : The root directory
+            - policy (utilities.TraversalPolicy or None) : The subtrees to leave out, default to walking everything
+
+        Returns:
+            - (Iterator[tuple[str, List[str], List[str]]]) : (dirpath, dirnames, filenames) for every directory walked,
+                                    where dirnames can be pruned in place like with os.walk
+        """
+        policy = policy or ut.TraversalPolicy()
+        stack = [("/".join(_parts(path)), 0)]
+        while stack:
+            dirpath, depth = stack.pop()
+            io_throttle.file()
+            entries = [entry for entry in self.list(dirpath) if not policy.ignores(entry.name)]
+            dirnames = [entry.name for entry in entries if entry.is_dir]
+            filenames = [entry.name for entry in entries if not entry.is_dir]
+            yield dirpath, dirnames, filenames
+            if policy.max_depth is None or depth < policy.max_depth:
+                stack.extend((f"{dirpath}/{name}" if dirpath else name, depth + 1) for name in reversed(dirnames))
+
+
+class LocalFileSystem(FileSystem):
+    """The directory root of the local disk as a FileSystem.
+
+    Parameters:
+        - root (str or pathlib.Path) : The directory the paths are relative to, default to the current one
+    """
+
+    def __init__(self, root: str | Path = ".") -> None:
+        self.root = Path(root)
+
+    def _path(self, path: str) -> Path:
+        return self.root.joinpath(*_parts(path))
+
+    def _info(self, path: str, stat: os.stat_result, is_dir: bool) -> FileInfo:
+        return FileInfo("/".join(_parts(path)), is_dir, 0 if is_dir else stat.st_size, stat.st_mtime)
+
+    def list(self, path: str) -> list[FileInfo]:
+        res = []
+        with os.scandir(self._path(path)) as entries:
+            for entry in entries:
+                is_dir = entry.is_dir()
+                res.append(self._info(f"{path}/{entry.name}", entry.stat(), is_dir))
+        return sorted(res, key=lambda info: info.name)
+
+    def stat(self, path: str) -> FileInfo:
+        local = self._path(path)
+        stat = local.stat()
+        return self._info(path, stat, local.is_dir())
+
+    def open(self, path: str, mode: str = "rb") -> BinaryIO:
+        if mode not in ("rb", "wb"):
+            raise ValueError(f"mode must be rb or wb, but got {mode!r}")
+        return open(self._path(path), mode)
+
+    def copy(self, src: str, dest: str) -> None:
+        shutil.copy2(self._path(src), self._path(dest))
+
+    def mkdir(self, path: str) -> None:
+        self._path(path).mkdir(parents=True, exist_ok=True)
+
+    def delete(self, path: str) -> None:
+        local = self._path(path)
+        if local.is_dir() and not local.is_symlink():
+            shutil.rmtree(local)
+        elif os.path.lexists(local):
+            local.unlink()
+
+    def walk(self, path: str, policy: ut.TraversalPolicy | None = None) -> Iterator[tuple[str, list[str], list[str]]]:
+        """Walk the tree under path with utilities.walk, so that every field of policy applies"""
+        for dirpath, dirnames, filenames in ut.walk(self._path(path), policy):
+            # The same dirnames list, so that pruning it still keeps the walk out of those directories
+            yield "/".join(_parts(Path(os.path.relpath(dirpath, self.root)).as_posix())), dirnames, filenames
+
+
+class ConnectionPool:
+    """A pool of at most size keep-alive HTTP connections to one server, shared by every thread.
+    get waits while size connections are in use, so the pool also bounds the number of concurrent requests.
+
+    Parameters:
+        - scheme (str) : http or https
+        - host (str) : Host name of the server
+        - port (int or None) : Port of the server, default to that of the scheme
+        - size (int) : Maximum number of connections
+        - timeout (float) : Timeout of the socket operations, in seconds
+    """
+
+    def __init__(self, scheme: str, host: str, port: int | None, size: int = 8, timeout: float = 30.0) -> None:
+        if size < 1:
+            raise ValueError(f"size must be at least 1, but got {size}")
+        self._factory = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def get(self) -> http.client.HTTPConnection:
+        """Take a connection out of the pool, opening a new one if none is idle"""
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        return self._factory(self.host, self.port, timeout=self.timeout)
+
+    def put(self, conn: http.client.HTTPConnection, reusable: bool = True) -> None:
+        """Give a connection back to the pool, closing it unless it is reusable (its last response was read entirely)"""
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self) -> None:
+        """Close the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class _ObjectReader(io.RawIOBase):
+    """The body of a GET response, read as a stream. The connection goes back to the pool once it is closed"""
+
+    def __init__(self, pool: ConnectionPool, conn: http.client.HTTPConnection, response: http.client.HTTPResponse) -> None:
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        return self._response.readinto(buffer)
+
+    def close(self) -> None:
+        if not self.closed:
+            # A body that was not read to the end leaves the connection unusable
+            reusable = self._response.isclosed() and not self._response.will_close
+            self._response.close()
+            self._pool.put(self._conn, reusable)
+        super().close()
+
+
+class _ObjectWriter(io.RawIOBase):
+    """A new object, written with one PUT request if it is smaller than the part size, or otherwise as a multipart
+    upload whose parts are sent in parallel while the next ones are written. At most as many parts as the backend has
+    workers are held in memory"""
+
+    def __init__(self, fs: ObjectStoreFileSystem, key: str) -> None:
+        self._fs = fs
+        self._key = key
+        self._buffer = bytearray()
+        self._upload_id: str | None = None
+        self._parts: list = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self._fs.part_size:
+            part = bytes(self._buffer[: self._fs.part_size])
+            del self._buffer[: self._fs.part_size]
+            self._upload_part(part)
+        return len(data)
+
+    def _upload_part(self, data: bytes) -> None:
+        if self._upload_id is None:
+            self._upload_id = self._fs._create_multipart(self._key)
+        in_flight = [part for part in self._parts if not part.done()]
+        if len(in_flight) >= self._fs.workers:
+            in_flight[0].result()
+        number = len(self._parts) + 1
+        self._parts.append(self._fs._executor().submit(self._fs._upload_part, self._key, self._upload_id, number, data))
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # An object whose writing failed is not published, truncated, on leaving a with block
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self) -> None:
+        """Discard the object: nothing is written, and a started multipart upload is aborted with its parts"""
+        if self.closed:
+            return
+        try:
+            if self._upload_id is not None:
+                # Parts still in flight would otherwise be stored after the abort
+                wait(self._parts)
+                self._fs._abort_multipart(self._key, self._upload_id)
+        finally:
+            self._buffer = bytearray()
+            super().close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self._fs._request("PUT", self._key, body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                self._fs._complete_multipart(self._key, self._upload_id, [part.result() for part in self._parts])
+        except BaseException:
+            self.abort()
+            raise
+        self._buffer = bytearray()
+        super().close()
+
+
+def _local_name(tag: str) -> str:
+    """Tag of an XML element without its namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_text(element: ET.Element, name: str) -> str | None:
+    """Text of the first child of element called name, in any namespace"""
+    for child in element:
+        if _local_name(child.tag) == name:
+            return child.text
+    return None
+
+
+def _parse_iso_time(text: str) -> float:
+    """Seconds since the epoch of a time like 2024-01-31T12:00:00.000Z"""
+    return datetime.datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
+class ObjectStoreFileSystem(FileSystem):
+    """A bucket of an S3-compatible object store as a FileSystem, see the module documentation.
+
+    Parameters:
+        - url (str) : URL of the bucket, e.g. http://localhost:9000/bucket, optionally followed by a prefix the paths are relative to
+        - page_size (int) : Number of keys requested per page of a listing, at most 1000 for S3
+        - max_connections (int) : Maximum number of connections kept to the server, see ConnectionPool
+        - part_size (int) : Size of the parts of multipart uploads and copies, default to DEFAULT_PART_SIZE
+        - workers (int) : Number of parts uploaded or copied in parallel
+        - timeout (float) : Timeout of the socket operations, in seconds
+    """
+
+    def __init__(
+        self,
+        url: str,
+        page_size: int = 1000,
+        max_connections: int = 8,
+        part_size: int = DEFAULT_PART_SIZE,
+        workers: int = 4,
+        timeout: float = 30.0,
+    ) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(f"Expected an http or https URL, but got {url!r}")
+        parts = _parts(parsed.path)
+        if not parts:
+            raise ValueError(f"The URL {url!r} does not name a bucket")
+        if page_size < 1 or part_size < 1 or workers < 1:
+            raise ValueError("page_size, part_size and workers must be at least 1")
+        self.bucket = parts[0]
+        self.prefix = "/".join(parts[1:])
+        self.page_size = page_size
+        self.part_size = part_size
+        self.workers = workers
+        self.pool = ConnectionPool(parsed.scheme, parsed.hostname, parsed.port, max_connections, timeout)
+        self._pool_executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool_executor is None:
+                self._pool_executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._pool_executor
+
+    def close(self) -> None:
+        """Stop the workers and close the connections"""
+        if self._pool_executor is not None:
+            self._pool_executor.shutdown()
+            self._pool_executor = None
+        self.pool.close()
+
+    def __enter__(self) -> ObjectStoreFileSystem:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _key(self, path: str) -> str:
+        return "/".join([*_parts(self.prefix), *_parts(path)])
+
+    def _path(self, key: str) -> str:
+        """Path of the object key, relative to the prefix"""
+        return key[len(self.prefix) + 1 :] if self.prefix else key
+
+    def _url(self, key: str, query: dict | None = None) -> str:
+        url = "/" + urllib.parse.quote(self.bucket) + ("/" + urllib.parse.quote(key) if key else "")
+        return url + ("?" + urllib.parse.urlencode(query) if query else "")
+
+    def _send(self, method: str, key: str, query: dict | None = None, headers: dict | None = None, body: bytes | None = None):
+        """Send a request on a pooled connection, retrying once if the server closed the kept-alive connection"""
+        url = self._url(key, query)
+        for attempt in range(2):
+            conn = self.pool.get()
+            try:
+                conn.request(method, url, body=body, headers=headers or {})
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.pool.put(conn, reusable=False)
+                if attempt:
+                    raise
+            except BaseException:
+                self.pool.put(conn, reusable=False)
+                raise
+
+    def _request(
+        self, method: str, key: str, query: dict | None = None, headers: dict | None = None, body: bytes | None = None
+    ) -> tuple[http.client.HTTPMessage, bytes]:
+        """Send a request and read its response, raising FileNotFoundError for 404 and OSError for the other errors"""
+        conn, response = self._send(method, key, query, headers, body)
+        data = response.read()
+        self.pool.put(conn, reusable=not response.will_close)
+        if response.status == 404:
+            raise FileNotFoundError(f"{self.bucket}/{key} does not exist")
+        if response.status >= 300:
+            raise OSError(f"{method} {self._url(key, query)} failed with {response.status} {response.reason}: {data[:200]!r}")
+        return response.headers, data
+
+    def _list_pages(self, prefix: str, delimiter: str | None) -> Iterator[ET.Element]:
+        """The pages of the listing of the keys starting with prefix, page_size keys at a time"""
+        query = {"list-type": "2", "prefix": prefix, "max-keys": str(self.page_size)}
+        if delimiter:
+            query["delimiter"] = delimiter
+        while True:
+            io_throttle.file()
+            _, data = self._request("GET", "", query)
+            page = ET.fromstring(data)
+            yield page
+            token = _find_text(page, "NextContinuationToken")
+            if _find_text(page, "IsTruncated") != "true" or not token:
+                return
+            query["continuation-token"] = token
+
+    def _list(self, path: str, recursive: bool) -> list[FileInfo]:
+        key = self._key(path)
+        prefix = key + "/" if key else ""
+        res = []
+        for page in self._list_pages(prefix, None if recursive else "/"):
+            for element in page:
+                name = _local_name(element.tag)
+                if name == "Contents":
+                    object_key = _find_text(element, "Key")
+                    if object_key == prefix:
+                        # A marker of an empty directory, as made by some tools
+                        continue
+                    mtime = _find_text(element, "LastModified")
+                    res.append(
+                        FileInfo(
+                            self._path(object_key),
+                            False,
+                            int(_find_text(element, "Size") or 0),
+                            _parse_iso_time(mtime) if mtime else 0.0,
+                        )
+                    )
+                elif name == "CommonPrefixes":
+                    res.append(FileInfo(self._path(_find_text(element, "Prefix").rstrip("/")), True))
+        return res
+
+    def list(self, path: str) -> list[FileInfo]:
+        res = self._list(path, recursive=False)
+        if not res and not self.stat(path).is_dir:
+            raise NotADirectoryError(f"{path} is not a directory")
+        return sorted(res, key=lambda info: info.name)
+
+    def stat(self, path: str) -> FileInfo:
+        key = self._key(path)
+        if key:
+            try:
+                headers, _ = self._request("HEAD", key)
+            except FileNotFoundError:
+                pass
+            else:
+                modified = headers.get("Last-Modified")
+                mtime = email.utils.parsedate_to_datetime(modified).timestamp() if modified else 0.0
+                return FileInfo("/".join(_parts(path)), False, int(headers.get("Content-Length", 0)), mtime)
+        # A directory is a prefix of other keys
+        page = next(self._list_pages(key + "/" if key else "", "/"))
+        if key and not any(_local_name(element.tag) in ("Contents", "CommonPrefixes") for element in page):
+            raise FileNotFoundError(f"{self.bucket}/{key} does not exist")
+        return FileInfo("/".join(_parts(path)), True)
+
+    def open(self, path: str, mode: str = "rb") -> BinaryIO:
+        key = self._key(path)
+        if mode == "wb":
+            return _ObjectWriter(self, key)
+        if mode != "rb":
+            raise ValueError(f"mode must be rb or wb, but got {mode!r}")
+        conn, response = self._send("GET", key)
+        if response.status != 200:
+            response.read()
+            self.pool.put(conn, reusable=not response.will_close)
+            if response.status == 404:
+                raise FileNotFoundError(f"{self.bucket}/{key} does not exist")
+            raise OSError(f"GET {self._url(key)} failed with {response.status} {response.reason}")
+        return io.BufferedReader(_ObjectReader(self.pool, conn, response), ut.CHUNK_SIZE)
+
+    def copy(self, src: str, dest: str) -> None:
+        """Copy the object src to dest on the server side, in parallel parts if it is larger than the part size"""
+        src_key = self._key(src)
+        dest_key = self._key(dest)
+        size = self.stat(src).size
+        source = f"{self.bucket}/{urllib.parse.quote(src_key)}"
+        if size <= self.part_size:
+            self._request("PUT", dest_key, headers={"x-amz-copy-source": source})
+            return
+
+        upload_id = self._create_multipart(dest_key)
+        ranges = [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+
+        def copy_part(item: tuple[int, tuple[int, int]]) -> str:
+            number, (first, last) = item
+            _, data = self._request(
+                "PUT",
+                dest_key,
+                {"partNumber": str(number), "uploadId": upload_id},
+                headers={"x-amz-copy-source": source, "x-amz-copy-source-range": f"bytes={first}-{last}"},
+            )
+            return _find_text(ET.fromstring(data), "ETag")
+
+        try:
+            etags = list(self._executor().map(copy_part, enumerate(ranges, start=1)))
+            self._complete_multipart(dest_key, upload_id, etags)
+        except BaseException:
+            self._abort_multipart(dest_key, upload_id)
+            raise
+
+    def mkdir(self, path: str) -> None:
+        pass
+
+    def delete(self, path: str) -> None:
+        key = self._key(path)
+        keys = [self._key(info.path) for info in self._list(path, recursive=True)]
+        if key:
+            keys.append(key)
+        list(self._executor().map(lambda key: self._request("DELETE", key), keys))
+
+    def walk(self, path: str, policy: ut.TraversalPolicy | None = None) -> Iterator[tuple[str, list[str], list[str]]]:
+        """Walk the tree under path like FileSystem.walk, but from one listing of all the keys under path,
+        fetched in pages, instead of one listing per directory"""
+        policy = policy or ut.TraversalPolicy()
+        root = "/".join(_parts(path))
+        tree: dict[str, tuple[set[str], list[str]]] = {root: (set(), [])}
+        for info in self._list(path, recursive=True):
+            parts = _parts(info.path[len(root) :] if root else info.path)
+            dirpath = root
+            for name in parts[:-1]:
+                tree[dirpath][0].add(name)
+                dirpath = f"{dirpath}/{name}" if dirpath else name
+                tree.setdefault(dirpath, (set(), []))
+            tree[dirpath][1].append(parts[-1])
+
+        stack = [(root, 0)]
+        while stack:
+            dirpath, depth = stack.pop()
+            subdirs, files = tree[dirpath]
+            dirnames = sorted(name for name in subdirs if not policy.ignores(name))
+            filenames = sorted(name for name in files if not policy.ignores(name))
+            yield dirpath, dirnames, filenames
+            if policy.max_depth is None or depth < policy.max_depth:
+                stack.extend((f"{dirpath}/{name}" if dirpath else name, depth + 1) for name in reversed(dirnames))
+
+    def _create_multipart(self, key: str) -> str:
+        _, data = self._request("POST", key, {"uploads": ""})
+        return _find_text(ET.fromstring(data), "UploadId")
+
+    def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> str:
+        headers, _ = self._request("PUT", key, {"partNumber": str(number), "uploadId": upload_id}, body=data)
+        return headers.get("ETag")
+
+    def _complete_multipart(self, key: str, upload_id: str, etags: list[str]) -> None:
+        root = ET.Element("CompleteMultipartUpload")
+        for number, etag in enumerate(etags, start=1):
+            part = ET.SubElement(root, "Part")
+            ET.SubElement(part, "PartNumber").text = str(number)
+            ET.SubElement(part, "ETag").text = etag
+        self._request("POST", key, {"uploadId": upload_id}, body=ET.tostring(root))
+
+    def _abort_multipart(self, key: str, upload_id: str) -> None:
+        try:
+            self._request("DELETE", key, {"uploadId": upload_id})
+        except OSError:
+            # The upload expires on the server anyway
+            pass
+
+
+def restructure_filesystem(
+    fs: FileSystem,
+    pollution_dir: str,
+    dest_dir: str,
+    workers: int = 1,
+    incremental: bool = False,
+    validate: bool = False,
+    selection: ut.Selection | None = None,
+    policy: ut.TraversalPolicy | None = None,
+    keep_compressed: bool = False,
+) -> dict:
+    """Copy the gas .csv files of the pollution_data directory pollution_dir of fs into gas_[gas_formula] directories
+       in dest_dir of fs, like restructure_pollution_data does on the local disk. Plain copies are made with fs.copy,
+       which copies on the server side for an object store, and the files that are validated, filtered by year or
+       decompressed are streamed through this process.
+
+    Parameters:
+        - fs (FileSystem) : The file system both directories are in
+        - pollution_dir (str) : Path to the pollution_data directory in fs
+        - dest_dir (str) : Path to the pollution_data_restructured/by_gas directory in fs
+        - workers (int) : Number of files copied in parallel
+        - incremental (bool) : If True, files whose copy is at least as new (and, for plain copies, of the same size) are skipped
+        - validate (bool) : If True, validate the files while they are copied and leave the invalid ones out
+        - selection (utilities.Selection or None) : The gases, sources and years to restructure, default to all of them
+        - policy (utilities.TraversalPolicy or None) : The subtrees to leave out, default to those in utilities.DEFAULT_IGNORE
+        - keep_compressed (bool) : If True, the copies of compressed gas files keep their compression
+
+    Returns:
+        - (dict) : The report of restructure_pollution_data, where errors are keyed by the path of each invalid file in fs
+    """
+    policy = policy or ut.TraversalPolicy(ignore=ut.DEFAULT_IGNORE)
+    years = selection.years if selection is not None else None
+
+    res = ut.new_restructure_report(validate=validate)
+
+    sources = []
+    for dirpath, dirnames, filenames in fs.walk(pollution_dir, policy):
+        if selection is not None:
+            dirnames[:] = [name for name in dirnames if not name.startswith("src_") or selection.match_source(name)]
+        for filename in filenames:
+            if dirpath and ut.is_restructured_source((*_parts(dirpath), filename), selection):
+                sources.append(f"{dirpath}/{filename}")
+
+    copies = []
+    copy_names: dict[str, set[str]] = {}
+    for path in ut.preferred_variants(sorted(sources)):
+        gas_dir = f"{dest_dir}/gas_{ut.gas_formula(path)}"
+        name = ut.restructured_name(PurePosixPath(path), keep_compressed)
+        fs.mkdir(gas_dir)
+        copies.append((path, f"{gas_dir}/{name}"))
+        copy_names.setdefault(gas_dir, set()).add(name)
+
+    def copy(pair: tuple[str, str]) -> tuple[bool, list[str]]:
+        path, dest = pair
+        src_compression = ut.split_compression(path)[1]
+        compression = ut.split_compression(dest)[1]
+        plain = years is None and not validate and compression == src_compression
+        if incremental:
+            src_info = fs.stat(path)
+            try:
+                dest_info = fs.stat(dest)
+            except FileNotFoundError:
+                dest_info = None
+            if dest_info is not None and ut.copy_is_up_to_date(src_info.mtime, src_info.size, dest_info.mtime, dest_info.size, plain):
+                return False, []
+        if plain:
+            fs.copy(path, dest)
+            return True, []
+
+        with fs.open(path) as src_file, ut.open_csv(src_file, compression=src_compression) as src_csv:
+            with fs.open(dest, "wb") as dest_file:
+                errors = ut.copy_gas_stream(src_csv, dest_file, validate, years, compression)
+        if errors:
+            # Invalid files are left out of by_gas
+            fs.delete(dest)
+        return True, errors
+
+    if workers == 1:
+        outcomes = [copy(pair) for pair in copies]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(copy, copies))
+
+    for (path, _), (copied, errors) in zip(copies, outcomes):
+        if copied:
+            ut.add_copy_outcome(res, path, errors)
+        else:
+            res["skipped"] += 1
+
+    # Copies of other variants of the same sources would count them twice, see restructure_pollution_data
+    for gas_dir, names in copy_names.items():
+        try:
+            infos = fs.list(gas_dir)
+        except (FileNotFoundError, NotADirectoryError):
+            # Every file of the gas was invalid, which leaves no directory behind in an object store
+            continue
+        for name in ut.stale_variants([info.name for info in infos], names):
+            fs.delete(f"{gas_dir}/{name}")
+    return res
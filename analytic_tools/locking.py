@@ -0,0 +1,209 @@
+"""Module containing the advisory locks that keep simultaneous runs on the same work_dir from redoing or tearing each other's work.
+
+A run of the whole pipeline holds the run lock of its pollution_data_restructured directory, and the plotting
+of a gas holds the lock of that gas, all in pollution_data_restructured/.locks. The locks are fcntl (flock)
+locks, which the kernel releases when their process dies, so that a crashed run never blocks the next one.
+Where a lock outlives its holder anyway (e.g. a lock lost by an NFS server), the lock file names the host and
+process holding it, and a lock whose process no longer exists, or which is older than stale_after, is broken.
+
+A second run either waits for the lock and then reuses the outputs of the first run (LOCK_POLICIES wait),
+or leaves the work to the first run (skip).
+"""
+from __future__ import annotations
+
+import contextlib
+import errno
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# What a run does when the lock it needs is held by another run
+LOCK_POLICIES = ("wait", "skip")
+
+# Name of the directory with the lock files, in pollution_data_restructured
+LOCKS_DIR_NAME = ".locks"
+
+
+def has_fcntl() -> bool:
+    """Check if fcntl locks are available, i.e. on every platform but Windows, where FileLock does not lock anything"""
+    return fcntl is not None
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but belongs to another user
+        return True
+    return True
+
+
+class FileLock:
+    """An exclusive advisory lock on the file at path, created if needed, usable as a context manager.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the lock file
+        - stale_after (float or None) : Number of seconds after which a lock held by another host is considered stale
+                                        and broken, default to never. A lock held by a process of this host that no
+                                        longer exists is always broken
+        - poll_interval (float) : Seconds between two attempts while waiting for the lock
+    """
+
+    def __init__(self, path: str | Path, stale_after: float | None = None, poll_interval: float = 0.1) -> None:
+        self.path = Path(path)
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._fd: int | None = None
+        # Set by acquire if another process held the lock when it was first tried
+        self.waited = False
+
+    @property
+    def locked(self) -> bool:
+        """True if this object holds the lock"""
+        return self._fd is not None
+
+    def holder(self) -> dict | None:
+        """The host, pid and time of the holder of the lock, as written in the lock file, None if it is not held"""
+        try:
+            return json.loads(self.path.read_text()) or None
+        except (OSError, ValueError):
+            return None
+
+    def _is_stale(self, holder: dict | None) -> bool:
+        if not holder:
+            return False
+        if holder.get("host") == socket.gethostname():
+            return not _process_exists(holder.get("pid", -1))
+        return self.stale_after is not None and time.time() - holder.get("time", time.time()) > self.stale_after
+
+    def _try_lock(self) -> int | None:
+        """Lock the file at path once without waiting, returning the locked file descriptor or None"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return None
+            raise
+        try:
+            same_file = os.path.samestat(os.fstat(fd), os.stat(self.path))
+        except FileNotFoundError:
+            same_file = False
+        if not same_file:
+            # The file was removed to break a stale lock while it was being opened, and the lock is on the old one
+            os.close(fd)
+            return None
+        return fd
+
+    def acquire(self, blocking: bool = True, timeout: float | None = None) -> bool:
+        """Take the lock, breaking it if it is stale.
+
+        Parameters:
+            - blocking (bool) : If False, give up at once when another process holds the lock
+            - timeout (float or None) : Maximum number of seconds to wait when blocking, default to no limit
+
+        Returns:
+            - (bool) : True if the lock was taken
+        """
+        if self.locked:
+            raise RuntimeError(f"{self.path} is already locked by this object")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.waited = False
+        while True:
+            fd = self._try_lock()
+            if fd is not None:
+                break
+            if self._is_stale(self.holder()):
+                # The next attempt creates a new lock file, which the stale holder does not lock
+                with contextlib.suppress(FileNotFoundError):
+                    self.path.unlink()
+                continue
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            self.waited = True
+            time.sleep(self.poll_interval)
+
+        holder = {"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, json.dumps(holder).encode(), 0)
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        """Release the lock. The lock file is left in place, since removing it would race with the next holder"""
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            os.ftruncate(fd, 0)
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class WorkDirLocks:
+    """The locks of one pollution_data_restructured directory: one for whole runs, and one per gas.
+
+    Parameters:
+        - restructured_dir (str or pathlib.Path) : Path to the pollution_data_restructured directory, created if needed
+        - policy (str) : What to do when a lock is held by another run, one of LOCK_POLICIES: wait for it, default, or skip the work
+        - timeout (float or None) : Maximum number of seconds to wait for a lock, default to no limit
+        - stale_after (float or None) : Age after which a lock held by another host is broken, see FileLock
+    """
+
+    def __init__(
+        self, restructured_dir: str | Path, policy: str = "wait", timeout: float | None = None, stale_after: float | None = None
+    ) -> None:
+        if policy not in LOCK_POLICIES:
+            raise ValueError(f"Unknown lock policy {policy!r}, expected one of {', '.join(LOCK_POLICIES)}")
+        self.dir = Path(restructured_dir) / LOCKS_DIR_NAME
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.policy = policy
+        self.timeout = timeout
+        self.stale_after = stale_after
+        # Set once a lock was only taken after waiting for another run, whose outputs can then be reused
+        self.waited = False
+
+    def _hold(self, name: str) -> Iterator[bool]:
+        """Hold the lock called name, yielding False instead if it was held by another run and waiting for it was not
+        an option. With the wait policy, a lock that is not taken within the timeout raises TimeoutError"""
+        lock = FileLock(self.dir / f"{name}.lock", stale_after=self.stale_after)
+        if not lock.acquire(blocking=self.policy == "wait", timeout=self.timeout):
+            if self.policy == "wait":
+                raise TimeoutError(f"{lock.path} is still held by {lock.holder()} after {self.timeout} s")
+            yield False
+            return
+        self.waited = self.waited or lock.waited
+        try:
+            yield True
+        finally:
+            lock.release()
+
+    @contextlib.contextmanager
+    def run(self) -> Iterator[bool]:
+        """Hold the lock of whole runs, yielding False if the policy is skip and another run holds it"""
+        yield from self._hold("run")
+
+    @contextlib.contextmanager
+    def gas(self, gas_dir_name: str) -> Iterator[bool]:
+        """Hold the lock of the gas_[gas_formula] directory called gas_dir_name, yielding False if the policy is skip
+        and another run holds it"""
+        yield from self._hold(gas_dir_name)
@@ -1,104 +1,505 @@
 """Module containing the functions used to plot the resulting data.
+
+matplotlib and numpy are imported inside the functions that need them, so that importing
+this module (and analyze_pollution_data.py) stays cheap for runs that never plot anything.
+The plots are drawn without pyplot, in one GasFigure per process that is reused for every gas.
 """
 from __future__ import annotations
 
-from pathlib import Path
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING
+
+import analytic_tools.utilities as ut
+from analytic_tools.cache import load_series
+from analytic_tools.progress import progress
+
+if TYPE_CHECKING:
+    from analytic_tools.archive import ArchiveSink
+    from analytic_tools.locking import WorkDirLocks
+    from analytic_tools.shard import Shard
+
+
+# Create labels with correct syntax
+NAME_DICT = {
+    "CH4": r"$\mathrm{CH_4}$",
+    "CO2": r"$\mathrm{CO_2}$",
+    "N2O": r"$\mathrm{N_2O}$",
+}
+
+# Legends with more entries than this are left out, as they would cover the whole plot
+MAX_LEGEND_ENTRIES = 20
+
+
+# Formats Pillow can save thumbnails in
+RASTER_FORMATS = {"png", "jpg", "jpeg", "tif", "tiff", "webp"}
+
+
+@dataclass(frozen=True)
+class OutputSpec:
+    """Description of one file a plot is saved to, named gas_[gas_formula][suffix].[format].
 
-import matplotlib.pyplot as plt
-import numpy as np
+    Parameters:
+        - format (str) : File format understood by matplotlib, e.g. png, svg or pdf, default to png
+        - dpi (int) : Resolution in dots per inch, default to 200
+        - size (tuple or None) : Size in inches, default to the size of the figure
+        - suffix (str) : Appended to the name of the file, to tell several outputs of the same format apart
+        - thumbnail (bool) : If True, the file is made by downscaling the raster render of the figure with Pillow,
+                             instead of rendering the figure again. Only raster formats can be thumbnails
+    """
+
+    format: str = "png"
+    dpi: int = 200
+    size: tuple[float, float] | None = None
+    suffix: str = ""
+    thumbnail: bool = False
+
+    def __post_init__(self) -> None:
+        if self.thumbnail and self.format.lower() not in RASTER_FORMATS:
+            raise ValueError(f"Thumbnails must have a raster format, but got {self.format}")
+        if self.dpi < 1:
+            raise ValueError(f"dpi must be at least 1, but got {self.dpi}")
+
+    def filename(self, name: str) -> str:
+        """Name of the file a plot called name is saved to with this spec"""
+        return f"{name}{self.suffix}.{self.format}"
 
 
+DEFAULT_OUTPUTS = (OutputSpec(),)
+
+
+def parse_output_spec(text: str) -> OutputSpec:
+    """Parse an output spec of the form FORMAT[:DPI[:WIDTHxHEIGHT]][:thumb], e.g. svg, png:100 or png:50:4x3.2:thumb.
+       Thumbnails are given the suffix _thumb.
+
+    Parameters:
+        - text (str) : The spec to parse
+
+    Returns:
+        - (OutputSpec) : The parsed spec
+    """
+    parts = text.split(":")
+    thumbnail = parts[-1] == "thumb"
+    if thumbnail:
+        parts = parts[:-1]
+    if not parts[0] or len(parts) > 3:
+        raise ValueError(f"Invalid output spec: {text}, expected FORMAT[:DPI[:WIDTHxHEIGHT]][:thumb]")
+    spec = {"format": parts[0].lower(), "thumbnail": thumbnail, "suffix": "_thumb" if thumbnail else ""}
+    try:
+        if len(parts) > 1:
+            spec["dpi"] = int(parts[1])
+        if len(parts) > 2:
+            width, height = parts[2].lower().split("x")
+            spec["size"] = (float(width), float(height))
+    except ValueError as e:
+        raise ValueError(f"Invalid output spec: {text}, expected FORMAT[:DPI[:WIDTHxHEIGHT]][:thumb]") from e
+    return OutputSpec(**spec)
+
+
+_NUMBER_WORDS = ["no", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]
+
+
+class GasFigure:
+    """A reusable figure for the plot of one gas. All the series of a gas are drawn as a single LineCollection,
+    and drawing another gas only replaces the data, title and legend, instead of building a new figure.
+
+    The figure is drawn with the Agg canvas directly, without pyplot and its global state, but one GasFigure
+    must still not be used by several threads at the same time.
+
+    Parameters:
+        - figsize (tuple) : Size of the figure in inches, default to (10, 8)
+    """
+
+    def __init__(self, figsize: tuple[float, float] = (10, 8)) -> None:
+        import matplotlib
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.lines = LineCollection([])
+        self.axes.add_collection(self.lines)
+        self.trend_lines = LineCollection([], linestyles="dashed", linewidths=1)
+        self.axes.add_collection(self.trend_lines)
+        self.axes.set_xlabel("Year")
+        self.axes.set_ylabel(r"1000 tonn $\mathrm{CO_2}$-equivalents AR5")
+        self._colors = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
+
+    def draw(self, gas: str, labels: list[str], series: list, trends: list | None = None) -> None:
+        """Replace the contents of the figure by the series of one gas.
+
+        Parameters:
+            - gas (str) : Formula of the gas, e.g. CO2
+            - labels (List[str]) : Label of each series
+            - series (List[numpy.ndarray]) : Arrays of shape (years, 2) with the year in the first column
+                                             and the emission in the second, one per label
+            - trends (List[numpy.ndarray] or None) : If given, the trend of each series, in the same layout,
+                                             drawn as a dashed line in the color of its series
+        """
+        import numpy as np
+        from matplotlib.lines import Line2D
+
+        if len(series) and all(data.shape == series[0].shape for data in series):
+            # One (series, years, 2) array, without a copy per series
+            segments = np.stack(series)[:, :, :2]
+        else:
+            segments = [data[:, :2] for data in series]
+        colors = [self._colors[i % len(self._colors)] for i in range(len(series))]
+        self.lines.set_segments(segments)
+        self.lines.set_color(colors)
+        self.trend_lines.set_segments(trends if trends is not None else [])
+        self.trend_lines.set_color(colors if trends is not None else [])
+
+        self.axes.ignore_existing_data_limits = True
+        if len(series):
+            points = np.concatenate([data[:, :2] for data in series]) if isinstance(segments, list) else segments.reshape(-1, 2)
+            self.axes.update_datalim(points[~np.isnan(points).any(axis=1)])
+        self.axes.autoscale_view()
+
+        sources = _NUMBER_WORDS[len(series)] if len(series) < len(_NUMBER_WORDS) else str(len(series))
+        self.axes.set_title(
+            r"Air pollution of "
+            + NAME_DICT.get(gas, gas)
+            + rf" from {sources} different sources as function of year"
+        )
 
-def create_plot(src_dir: str | Path, dest_dir: str | Path) -> None:
+        if self.axes.get_legend() is not None:
+            self.axes.get_legend().remove()
+        if 0 < len(series) <= MAX_LEGEND_ENTRIES:
+            handles = [Line2D([], [], color=color, label=label) for color, label in zip(colors, labels)]
+            self.axes.legend(handles=handles)
+
+    def save(self, path: str | Path, dpi: int = 200) -> None:
+        """Save the figure to path, in the format given by its suffix"""
+        self.figure.savefig(path, dpi=dpi)
+
+    def save_all(
+        self,
+        dest_dir: str | Path,
+        name: str,
+        outputs: tuple[OutputSpec, ...] | list[OutputSpec] = DEFAULT_OUTPUTS,
+        parallel_thumbnails: bool = False,
+        sink: ArchiveSink | None = None,
+    ) -> list[Path]:
+        """Save the figure, as drawn, to every output in outputs.
+
+        Parameters:
+            - dest_dir (str or pathlib.Path) : Directory to save the files in
+            - name (str) : Name of the plot, e.g. gas_CO2
+            - outputs (List[OutputSpec]) : The files to save
+            - parallel_thumbnails (bool) : If True, the thumbnails are downscaled in parallel threads
+            - sink (ArchiveSink or None) : If given, the files are saved as members of this archive, in the directory dest_dir inside it
+
+        Returns:
+            - (List[pathlib.Path]) : Paths to the saved files (or names of the members), in the order of outputs
+        """
+        dest_dir = Path(dest_dir) if sink is None else PurePosixPath(dest_dir)
+        figsize = tuple(self.figure.get_size_inches())
+        paths = [dest_dir / output.filename(name) for output in outputs]
+
+        def open_output(path):
+            # Renamed into place once saved, so that a concurrent run or reader never sees a partial plot
+            return ut.atomic_write(path) if sink is None else sink.open(path.as_posix())
+
+        try:
+            for output, path in zip(outputs, paths):
+                if not output.thumbnail:
+                    self.figure.set_size_inches(output.size or figsize)
+                    with open_output(path) as file:
+                        self.figure.savefig(file, dpi=output.dpi, format=output.format)
+        finally:
+            self.figure.set_size_inches(figsize)
+
+        thumbnails = [(output, path) for output, path in zip(outputs, paths) if output.thumbnail]
+        if thumbnails:
+            import numpy as np
+            from PIL import Image
+
+            def pixels(output: OutputSpec) -> tuple[int, int]:
+                # Keep the aspect ratio of the figure within the requested size
+                width, height = output.size or figsize
+                scale = min(width / figsize[0], height / figsize[1]) * output.dpi
+                return max(1, round(figsize[0] * scale)), max(1, round(figsize[1] * scale))
+
+            # Render once, at the resolution of the largest thumbnail, and downscale that image for all of them
+            dpi = self.figure.dpi
+            try:
+                self.figure.set_dpi(max(pixels(output)[0] for output, _ in thumbnails) / figsize[0])
+                self.figure.canvas.draw()
+                image = Image.fromarray(np.asarray(self.figure.canvas.buffer_rgba()).copy())
+            finally:
+                self.figure.set_dpi(dpi)
+
+            def save_thumbnail(item: tuple[OutputSpec, Path]) -> None:
+                output, path = item
+                thumbnail = image.resize(pixels(output), Image.LANCZOS)
+                image_format = output.format.upper()
+                if image_format in ("JPG", "JPEG"):
+                    image_format = "JPEG"
+                    thumbnail = thumbnail.convert("RGB")
+                with open_output(path) as file:
+                    thumbnail.save(file, format=image_format)
+
+            if parallel_thumbnails and len(thumbnails) > 1:
+                with ThreadPoolExecutor(max_workers=len(thumbnails)) as pool:
+                    list(pool.map(save_thumbnail, thumbnails))
+            else:
+                for item in thumbnails:
+                    save_thumbnail(item)
+
+        return paths
+
+
+_gas_figure: GasFigure | None = None
+
+
+def _get_gas_figure() -> GasFigure:
+    """The GasFigure shared by all the plots made in this process"""
+    global _gas_figure
+    if _gas_figure is None:
+        _gas_figure = GasFigure()
+    return _gas_figure
+
+
+def label_from_filename(name: str) -> str:
+    """Create the legend label of a src_[source]_[gas_formula].csv file, i.e. its source with "_" replaced by spaces"""
+    label_parts = name.split("_")
+    label = ""
+    for i in range(1, len(label_parts) - 1):
+        label += label_parts[i] + " "
+    return label
+
+
+def create_plot(
+    src_dir: str | Path,
+    dest_dir: str | Path,
+    figure: GasFigure | None = None,
+    outputs: tuple[OutputSpec, ...] | list[OutputSpec] = DEFAULT_OUTPUTS,
+    parallel_thumbnails: bool = False,
+    sink: ArchiveSink | None = None,
+    trend: int | None = None,
+) -> None:
     """Read all the .csv files within src_dir and display the data in one plot.
-        Store the plot at dest_dir, named as gas_[formula].png.
-        This function assumes that src_dir contains original gas .csv files only and no other files and subdirectories
+        Store the plot at dest_dir, named as gas_[formula].png (or as given by outputs).
+        This function assumes that src_dir contains original gas .csv files only (and possibly a summary.json file) and no other files and subdirectories
 
     Parameters:
         - src_dir (str or pathlib.Path) : Absolute path to gas_[gas_formula] directory containing .csv files with data
-        - dest_dir (str or pathlib.Path) : Absolute path to the directory to save the plot in
+        - dest_dir (str or pathlib.Path) : Absolute path to the directory to save the plot in, or the directory inside sink
+        - figure (GasFigure or None) : The figure to draw in, default to one that is reused by every call in this process
+        - outputs (List[OutputSpec]) : The files to save the plot to, the plot is drawn once for all of them
+        - parallel_thumbnails (bool) : If True, the thumbnail outputs are made in parallel threads
+        - sink (ArchiveSink or None) : If given, the plot is saved as members of this archive instead of as files
+        - trend (int or None) : If given, the degree of the polynomial trend drawn over each series, see plot_files
 
     """
     src_dir = Path(src_dir)
-    dest_dir = Path(dest_dir)
 
     if not src_dir.is_dir():
         raise NotADirectoryError(
             f"Expected an existing directory for src_dir, but received {src_dir}"
         )
-    elif not dest_dir.is_dir():
+    elif sink is None and not Path(dest_dir).is_dir():
         raise NotADirectoryError(
             f"Expected an existing directory for dest_dir, but received {dest_dir}"
         )
 
-    plt.figure(1, figsize=(10, 8))
-
-    # Create labels with correct syntax
-    name_dict = {
-        "CH4": r"$\mathrm{CH_4}$",
-        "CO2": r"$\mathrm{CO_2}$",
-        "N2O": r"$\mathrm{N_2O}$",
-    }
-    label = str(src_dir)[-3:]
-    gas_name = name_dict.get(label, label)
-    plt.title(
-        r"Air pollution of "
-        + gas_name
-        + r" from five different sources as function of year"
-    )
-    for file in src_dir.iterdir():
+    files = []
+    for file in sorted(src_dir.iterdir()):
+        if file.name == ut.SUMMARY_NAME:
+            # Summary statistics written next to the data, see analysis.summarize_pollution_data
+            continue
+        if file.name.startswith("."):
+            # Temporary file of a copy in progress in a concurrent run, see utilities.temporary_path
+            continue
         if not file.is_file():
             # Invalid argument, cannot read it as a file
             raise FileNotFoundError(f"Object pointed to by {file} is not a file")
-        elif not file.suffix == ".csv":
+        elif not ut.is_csv_name(file.name):
             # Invalid file type, must be .csv
             raise TypeError(f"Object pointed to by {file} is not a .csv file")
-        # Create a label for the plot
-        label_parts = str(file.name).split("_")
-        label = ""
-        for i in range(1, len(label_parts) - 1):
-            label += label_parts[i] + " "
-        # Plotting
-        data = np.loadtxt(file, delimiter=",", skiprows=1)
-        plt.plot(data[:, 0], data[:, 1], label=label)
-
-    plt.legend()
-    plt.xlabel("Year")
-    plt.ylabel(r"1000 tonn $\mathrm{CO_2}$-equivalents AR5")
-    # Create a name for the plot to store in dest_dir
-    figname = src_dir.name + ".png"
-    figpath = dest_dir / figname
-    plt.savefig(figpath, dpi=200)
-    plt.close()
-
-
-def plot_pollution_data(by_gas_dir: str | Path, fig_dir: str | Path) -> None:
+        files.append(file)
+
+    plot_files(
+        src_dir.name,
+        [label_from_filename(file.name) for file in files],
+        files,
+        dest_dir,
+        figure=figure,
+        outputs=outputs,
+        parallel_thumbnails=parallel_thumbnails,
+        sink=sink,
+        trend=trend,
+    )
+
+
+def plot_files(
+    name: str,
+    labels: list[str],
+    files: list[Path],
+    dest_dir: str | Path,
+    figure: GasFigure | None = None,
+    outputs: tuple[OutputSpec, ...] | list[OutputSpec] = DEFAULT_OUTPUTS,
+    parallel_thumbnails: bool = False,
+    sink: ArchiveSink | None = None,
+    years: tuple[int, int] | None = None,
+    trend: int | None = None,
+) -> None:
+    """Plot the gas .csv files in files, one line per file, and save the plot as name to dest_dir (see create_plot).
+    The files do not have to be in a gas_[gas_formula] directory, e.g. they may be the original files of pollution_data.
+
+    Parameters:
+        - name (str) : Name of the plot, gas_[gas_formula]
+        - labels (List[str]) : Legend label of every file
+        - files (List[pathlib.Path]) : Paths to the .csv files
+        - dest_dir (str or pathlib.Path) : Directory to save the plot in, or the directory inside sink
+        - figure (GasFigure or None) : The figure to draw in, default to one that is reused by every call in this process
+        - outputs (List[OutputSpec]) : The files to save the plot to
+        - parallel_thumbnails (bool) : If True, the thumbnail outputs are made in parallel threads
+        - sink (ArchiveSink or None) : If given, the plot is saved as members of this archive instead of as files
+        - years (tuple[int, int] or None) : If given, only the first to the last year are plotted
+        - trend (int or None) : If given, the degree of the least squares polynomial drawn as a dashed line over each series,
+                                from its first to its last year. The trends of all the series are fitted at once, see analysis.fit_trends
+
+    """
+    series = []
+    for file in files:
+        # Parsed once per process, as long as the file does not change
+        data = load_series(file)
+        if years is not None:
+            data = data[(data[:, 0] >= years[0]) & (data[:, 0] <= years[1])]
+        series.append(data)
+
+    trends = None
+    if trend is not None:
+        import numpy as np
+
+        from analytic_tools.analysis import fit_trends, stack_series
+
+        stacked_years, values = stack_series(series)
+        fitted = fit_trends(stacked_years, values, degree=trend)["fitted"]
+        trends = []
+        for row in range(len(series)):
+            # The trend is drawn over the years of its series, not extrapolated to those of the others
+            reported = np.flatnonzero(~np.isnan(values[row]))
+            span = slice(reported[0], reported[-1] + 1) if reported.size else slice(0, 0)
+            trends.append(np.column_stack([stacked_years[span], fitted[row, span]]))
+
+    figure = figure or _get_gas_figure()
+    figure.draw(name.split("_", 1)[-1], labels, series, trends)
+    figure.save_all(dest_dir, name, outputs, parallel_thumbnails, sink=sink)
+
+
+def plot_pollution_data(
+    by_gas_dir: str | Path,
+    fig_dir: str | Path,
+    workers: int = 1,
+    incremental: bool = False,
+    outputs: tuple[OutputSpec, ...] | list[OutputSpec] = DEFAULT_OUTPUTS,
+    parallel_thumbnails: bool = False,
+    selection: ut.Selection | None = None,
+    sink: ArchiveSink | None = None,
+    shard: Shard | None = None,
+    trend: int | None = None,
+    locks: WorkDirLocks | None = None,
+) -> dict[str, int]:
     """This function traverses the subdirectories of directory pointed to by by_gas_dir, which should be pollution_data_restructured/by_gas,
       and creates plots for each of them.
       It assumes that pollution_data_restructured/by_gas has only subdirectories of type gas_[gas_formula] as its contents,
       and that each of these subdirectories contains only original gas .csv files filtered by gas type.
-      Each plot is saved as .png file in fig_dir directory.
+      Each plot is saved as .png file in fig_dir directory, or to every output in outputs.
 
     Parameters:
         - by_gas_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/by_gas directory containing gas_[gas_formula] subdirectories
         - fig_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/figures directory where the plots are to be stored
+        - workers (int) : Number of processes used to create the plots, default to one (plot in the calling process)
+        - incremental (bool) : If True, skip the gases whose plots are newer than every file in their gas_[gas_formula] directory
+        - outputs (List[OutputSpec]) : The files each plot is saved to, default to one .png file at dpi=200
+        - parallel_thumbnails (bool) : If True, the thumbnail outputs of a plot are made in parallel threads
+        - selection (utilities.Selection or None) : If given, only the selected gases are plotted
+        - sink (ArchiveSink or None) : If given, the plots are saved as members of this archive, and fig_dir is the directory
+                                       inside the archive they are saved in (e.g. figures). Every plot is then made anew,
+                                       in the calling process, so incremental and workers have no effect
+        - shard (analytic_tools.shard.Shard or None) : If given, only the gases of this shard are plotted, so that several
+                                       processes or hosts can share the plotting, see analytic_tools.shard
+        - trend (int or None) : If given, the degree of the polynomial trend drawn over each series, see plot_files
+        - locks (analytic_tools.locking.WorkDirLocks or None) : If given, the lock of every gas is held while it is plotted,
+                                       so that concurrent runs on the same work_dir never plot a gas at the same time. With
+                                       the skip policy, the gases locked by another run are counted as skipped
 
     Returns:
-    None
+        - (Dict[str, int]) : Number of plots created and skipped, with keys: plotted, skipped
     """
     by_gas_dir = Path(by_gas_dir)
-    fig_dir = Path(fig_dir)
+    fig_dir = Path(fig_dir) if sink is None else PurePosixPath(fig_dir)
 
     if not by_gas_dir.exists():
         raise NotADirectoryError(f"Object pointed to by {by_gas_dir} does not exist")
-    elif not fig_dir.exists():
+    elif sink is None and not fig_dir.exists():
         raise NotADirectoryError(f"Object pointed to by {fig_dir} does not exist")
+    if not isinstance(workers, int) or isinstance(workers, bool):
+        raise TypeError(f"workers is of type {type(workers)}, expected int")
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, but got {workers}")
+    outputs = tuple(outputs)
+    if not outputs:
+        raise ValueError("outputs must contain at least one OutputSpec")
+    if len({output.filename("") for output in outputs}) != len(outputs):
+        raise ValueError("Several outputs would be saved to the same file, give them different suffixes")
+
+    res = {"plotted": 0, "skipped": 0}
 
-    for gas_subdir in by_gas_dir.iterdir():
-        if not gas_subdir.is_dir():
-            # Invalid structure of by_gas_dir
-            raise NotADirectoryError(
-                f"Object pointed to by {gas_subdir} is not a directory"
-            )
+    with contextlib.ExitStack() as held:
+        gas_subdirs = []
+        for gas_subdir in sorted(by_gas_dir.iterdir()):
+            if not gas_subdir.is_dir():
+                # Invalid structure of by_gas_dir
+                raise NotADirectoryError(
+                    f"Object pointed to by {gas_subdir} is not a directory"
+                )
+            if selection is not None and not selection.match_gas(gas_subdir.name[len("gas_"):]):
+                continue
+            if shard is not None and not shard.owns(gas_subdir.name[len("gas_"):]):
+                continue
+            # The locks are taken in sorted order, so that runs waiting for each other's gases never deadlock
+            if locks is not None and sink is None and not held.enter_context(locks.gas(gas_subdir.name)):
+                # Another run is plotting this gas
+                res["skipped"] += 1
+                continue
+            # The plots are up to date if they are newer than the directory (files added/removed) and all of its files
+            sources = [gas_subdir, *gas_subdir.iterdir()]
+            if incremental and sink is None and all(
+                ut.is_up_to_date(fig_dir / output.filename(gas_subdir.name), sources) for output in outputs
+            ):
+                res["skipped"] += 1
+            else:
+                gas_subdirs.append(gas_subdir)
+
+        progress.stage("plot", files=len(gas_subdirs))
+        if workers == 1 or len(gas_subdirs) < 2 or sink is not None:
+            for gas_subdir in gas_subdirs:
+                create_plot(gas_subdir, fig_dir, outputs=outputs, parallel_thumbnails=parallel_thumbnails, sink=sink, trend=trend)
+                progress.add(files=1)
         else:
-            create_plot(gas_subdir, fig_dir)
+            # Rendering holds the GIL, so the plots are made in separate processes rather than threads
+            n = len(gas_subdirs)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # The plots are counted here as they complete, since the worker processes do not share the counters
+                for _ in pool.map(
+                    create_plot,
+                    gas_subdirs,
+                    [fig_dir] * n,
+                    [None] * n,
+                    [outputs] * n,
+                    [parallel_thumbnails] * n,
+                    [None] * n,
+                    [trend] * n,
+                ):
+                    progress.add(files=1)
+        res["plotted"] = len(gas_subdirs)
+
+    return res
@@ -0,0 +1,350 @@
+"""Module containing the live progress reporting of the walker, the copier and the plot renderer.
+
+The stages of the pipeline count the directories they list, the files they copy or plot and the bytes they
+copy in the process-wide progress. Every thread counts in a slot of its own, without taking a lock, and the
+slots are only added up when a snapshot is taken, so that counting costs the same with many threads as
+with one. The slots of the threads that ended are folded into one. A ProgressReporter takes a snapshot every
+interval seconds, in a background thread, and passes it, with the current rates and the estimated time left,
+to its callbacks: TtyRenderer, LogRenderer or any function taking a Snapshot. Nothing is counted until
+report_progress is entered.
+"""
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, TextIO
+
+
+class _Slot:
+    """The counts of one thread, only ever changed by that thread"""
+
+    __slots__ = ("files", "bytes", "dirs", "thread")
+
+    def __init__(self, thread: threading.Thread | None = None) -> None:
+        self.files = 0
+        self.bytes = 0
+        self.dirs = 0
+        self.thread = thread
+
+
+def format_bytes(size: float) -> str:
+    """Format a number of bytes with a binary unit, e.g. 1.5 MiB"""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(size) < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_duration(seconds: float) -> str:
+    """Format a number of seconds as [H:]MM:SS"""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """The progress of the current stage at one point in time
+
+    Parameters:
+        - stage (str) : Name of the stage, e.g. restructure or plot, empty before the first stage
+        - files (int) : Number of files processed (copied or plotted) in the stage
+        - bytes (int) : Number of bytes processed in the stage
+        - dirs (int) : Number of directories listed in the stage
+        - elapsed (float) : Seconds since the start of the stage
+        - files_per_second (float) : Current rate of files, smoothed over the last snapshots
+        - bytes_per_second (float) : Current rate of bytes, smoothed over the last snapshots
+        - total_files (int or None) : Number of files the stage will process, None if unknown
+        - total_bytes (int or None) : Number of bytes the stage will process, None if unknown
+        - eta (float or None) : Estimated seconds left in the stage, None if unknown
+        - done (bool) : True for the last snapshot of a report
+    """
+
+    stage: str
+    files: int
+    bytes: int
+    dirs: int
+    elapsed: float
+    files_per_second: float
+    bytes_per_second: float
+    total_files: int | None = None
+    total_bytes: int | None = None
+    eta: float | None = None
+    done: bool = False
+
+    def line(self) -> str:
+        """Describe the snapshot in one line, e.g. restructure: 120/400 files, 1.2/4.0 MiB, 3.4 MiB/s, 56 files/s, ETA 0:05"""
+        files = f"{self.files}/{self.total_files}" if self.total_files is not None else str(self.files)
+        size = format_bytes(self.bytes)
+        if self.total_bytes is not None:
+            size = f"{size}/{format_bytes(self.total_bytes)}"
+        parts = [f"{files} files", size, f"{format_bytes(self.bytes_per_second)}/s", f"{self.files_per_second:.0f} files/s"]
+        if self.dirs:
+            parts.insert(1, f"{self.dirs} dirs")
+        if self.done:
+            parts.append(f"done in {format_duration(self.elapsed)}")
+        elif self.eta is not None:
+            parts.append(f"ETA {format_duration(self.eta)}")
+        return f"{self.stage or 'starting'}: " + ", ".join(parts)
+
+
+class Progress:
+    """Counters of the progress of the pipeline, shared by every thread of the process, see the module description.
+
+    Parameters:
+        - smoothing (float) : Weight of the latest interval in the rates, between 0 and 1. Lower values give steadier rates
+        - clock (Callable) : Function returning the current time in seconds, default to time.monotonic
+    """
+
+    def __init__(self, smoothing: float = 0.3, clock: Callable[[], float] = time.monotonic) -> None:
+        self.enabled = False
+        self.smoothing = smoothing
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._slots: list[_Slot] = []
+        # The counts of the threads that ended, whose slots were dropped
+        self._retired = _Slot()
+        self._finished: list[Snapshot] = []
+        self._stage = ""
+        self.stage("")
+
+    def _slot(self) -> _Slot:
+        slot = getattr(self._local, "slot", None)
+        if slot is None:
+            # Registered once per thread, the only time counting takes the lock
+            slot = self._local.slot = _Slot(threading.current_thread())
+            with self._lock:
+                self._retire()
+                self._slots.append(slot)
+        return slot
+
+    def _retire(self) -> None:
+        # Called with the lock held. The slots of the threads that ended are never changed again, so their counts
+        # are folded into one, and the slots kept are as many as the live threads, however many thread pools came and went
+        live = []
+        for slot in self._slots:
+            if slot.thread.is_alive():
+                live.append(slot)
+            else:
+                self._retired.files += slot.files
+                self._retired.bytes += slot.bytes
+                self._retired.dirs += slot.dirs
+        self._slots = live
+
+    def add(self, files: int = 0, bytes: int = 0, dirs: int = 0) -> None:
+        """Count files and bytes processed and directories listed by the calling thread. Does nothing unless enabled"""
+        if not self.enabled:
+            return
+        slot = self._slot()
+        slot.files += files
+        slot.bytes += bytes
+        slot.dirs += dirs
+
+    def _sum(self) -> tuple[int, int, int]:
+        slots = [self._retired, *self._slots]
+        return sum(slot.files for slot in slots), sum(slot.bytes for slot in slots), sum(slot.dirs for slot in slots)
+
+    def stage(self, name: str, files: int | None = None, bytes: int | None = None) -> None:
+        """Start the stage called name, counting from zero again. The last snapshot of the previous stage is kept
+           for the reporter, so that every stage is reported, however short.
+
+        Parameters:
+            - name (str) : Name of the stage, e.g. restructure
+            - files (int or None) : Number of files the stage will process, if known, used for the estimated time left
+            - bytes (int or None) : Number of bytes the stage will process, if known, used for the estimated time left
+        """
+        with self._lock:
+            if self.enabled and self._stage:
+                self._finished.append(self._snapshot(done=True))
+            self._stage = name
+            self._total_files = files
+            self._total_bytes = bytes
+            self._base = self._sum()
+            self._start = self._clock()
+            self._last = (self._start, 0, 0)
+            self._rates = (0.0, 0.0)
+
+    def finished(self) -> list[Snapshot]:
+        """The last snapshots of the stages that ended since the previous call"""
+        with self._lock:
+            finished, self._finished = self._finished, []
+        return finished
+
+    def snapshot(self, done: bool = False) -> Snapshot:
+        """The progress of the current stage, with the rates since the previous snapshot, smoothed"""
+        with self._lock:
+            return self._snapshot(done)
+
+    def _snapshot(self, done: bool) -> Snapshot:
+        # Called with the lock held
+        now = self._clock()
+        files, size, dirs = (total - base for total, base in zip(self._sum(), self._base))
+        last_time, last_files, last_bytes = self._last
+        if now > last_time:
+            weight = self.smoothing if last_time > self._start else 1.0
+            files_rate = (files - last_files) / (now - last_time)
+            bytes_rate = (size - last_bytes) / (now - last_time)
+            self._rates = (
+                weight * files_rate + (1 - weight) * self._rates[0],
+                weight * bytes_rate + (1 - weight) * self._rates[1],
+            )
+            self._last = (now, files, size)
+        files_per_second, bytes_per_second = self._rates
+
+        eta = None
+        if self._total_bytes is not None and bytes_per_second > 0:
+            eta = max(self._total_bytes - size, 0) / bytes_per_second
+        elif self._total_files is not None and files_per_second > 0:
+            eta = max(self._total_files - files, 0) / files_per_second
+        return Snapshot(
+            stage=self._stage,
+            files=files,
+            bytes=size,
+            dirs=dirs,
+            elapsed=now - self._start,
+            files_per_second=files_per_second,
+            bytes_per_second=bytes_per_second,
+            total_files=self._total_files,
+            total_bytes=self._total_bytes,
+            eta=eta,
+            done=done,
+        )
+
+
+# The progress counted by the walker, the copier and the renderer of this process, enabled by report_progress
+progress = Progress()
+
+
+class TtyRenderer:
+    """Render the snapshots on one line of a terminal, rewritten in place, with a line kept per finished stage
+
+    Parameters:
+        - stream (TextIO) : The terminal, default to sys.stderr
+    """
+
+    def __init__(self, stream: TextIO | None = None) -> None:
+        self.stream = stream if stream is not None else sys.stderr
+        self._stage: str | None = None
+        self._last: Snapshot | None = None
+
+    def __call__(self, snapshot: Snapshot) -> None:
+        if self._stage is not None and snapshot.stage != self._stage and self._last is not None:
+            # Keep the last line of the previous stage
+            self.stream.write("\n")
+        self._stage = snapshot.stage
+        self._last = snapshot
+        self.stream.write("\r\x1b[K" + snapshot.line())
+        self.stream.flush()
+
+    def close(self) -> None:
+        """End the line, once the report is done"""
+        if self._last is not None:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+class LogRenderer:
+    """Render the snapshots as log lines, at most one every interval seconds and one whenever a stage changes
+
+    Parameters:
+        - logger (logging.Logger or None) : The logger to write to, at level INFO. Default to writing lines to stream
+        - stream (TextIO or None) : The stream written to without a logger, default to sys.stderr
+        - interval (float) : Minimum number of seconds between two lines of the same stage, default to ten
+    """
+
+    def __init__(self, logger: logging.Logger | None = None, stream: TextIO | None = None, interval: float = 10.0) -> None:
+        self.logger = logger
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self._stage: str | None = None
+        self._written = float("-inf")
+
+    def _write(self, line: str) -> None:
+        if self.logger is not None:
+            self.logger.info(line)
+        else:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def __call__(self, snapshot: Snapshot) -> None:
+        if snapshot.done or snapshot.stage != self._stage or snapshot.elapsed - self._written >= self.interval:
+            self._write(snapshot.line())
+            self._stage = snapshot.stage
+            self._written = snapshot.elapsed
+
+
+class ProgressReporter:
+    """A background thread passing a snapshot of progress to every callback every interval seconds,
+    and a last one, with done set, when it stops. Callbacks with a close method have it called afterwards.
+
+    Parameters:
+        - callbacks (List[Callable]) : Functions taking a Snapshot, e.g. TtyRenderer() or LogRenderer()
+        - interval (float) : Seconds between two snapshots, default to half a second
+        - source (Progress or None) : The counters to report, default to the process-wide progress
+    """
+
+    def __init__(self, callbacks: list[Callable[[Snapshot], None]], interval: float = 0.5, source: Progress | None = None) -> None:
+        self.callbacks = list(callbacks)
+        self.interval = interval
+        self.progress = source if source is not None else progress
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+
+    def _emit(self, done: bool = False) -> None:
+        for snapshot in [*self.progress.finished(), self.progress.snapshot(done=done)]:
+            for callback in self.callbacks:
+                callback(snapshot)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._emit()
+
+    def start(self) -> "ProgressReporter":
+        """Enable the counters and start reporting"""
+        # Leave out the stage of a previous report
+        self.progress.stage("")
+        self.progress.finished()
+        self.progress.enabled = True
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop reporting, after a last snapshot, and disable the counters"""
+        self._stopped.set()
+        self._thread.join()
+        self._emit(done=True)
+        self.progress.enabled = False
+        for callback in self.callbacks:
+            close = getattr(callback, "close", None)
+            if close is not None:
+                close()
+
+    def __enter__(self) -> "ProgressReporter":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+@contextmanager
+def report_progress(*callbacks: Callable[[Snapshot], None], interval: float = 0.5) -> Iterator[Progress]:
+    """Report the progress of the process-wide counters to callbacks while in the block, see ProgressReporter.
+    Without callbacks, nothing is counted nor reported.
+
+    Parameters:
+        - callbacks (Callable) : Functions taking a Snapshot, e.g. TtyRenderer() or LogRenderer()
+        - interval (float) : Seconds between two snapshots, default to half a second
+
+    Returns:
+        - (Progress) : The process-wide progress
+    """
+    if not callbacks:
+        yield progress
+        return
+    with ProgressReporter(list(callbacks), interval=interval):
+        yield progress
@@ -0,0 +1,198 @@
+"""Module containing the sharding of the pipeline over several processes or hosts sharing a filesystem.
+
+The restructuring is partitioned by src_[source] directory and the plotting by gas, with a stable hash, so that
+every worker given the same number of shards agrees on its part of the work without talking to the others.
+The workers only meet in a coordination directory on the shared filesystem: each one writes the manifest of
+its shard there, and the worker that completes the set takes the merge lock (a file created exclusively),
+merges the manifests and runs the steps that need every shard, e.g. summarizing and plotting.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+# Name of the coordination directory, in pollution_data_restructured
+SHARDS_DIR_NAME = "shards"
+
+
+def shard_of(key: str, count: int) -> int:
+    """The shard, from 0 to count - 1, that key belongs to. Unlike hash, crc32 gives every process and host the same answer"""
+    return zlib.crc32(key.encode("utf-8")) % count
+
+
+@dataclass(frozen=True)
+class Shard:
+    """One of count parts of the work, numbered from 0
+
+    Parameters:
+        - index (int) : Number of the shard, from 0 to count - 1
+        - count (int) : Number of shards
+    """
+
+    index: int
+    count: int
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.index, int) or not isinstance(self.count, int):
+            raise TypeError("index and count must be of type int")
+        if self.count < 1 or not 0 <= self.index < self.count:
+            raise ValueError(f"invalid shard {self.index}/{self.count}, expected 0 <= index < count")
+
+    def owns(self, key: str) -> bool:
+        """Check if the work identified by key (e.g. the path of a src_[source] directory or a gas formula) is in this shard"""
+        return shard_of(key, self.count) == self.index
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def parse_shard(text: str) -> Shard:
+    """Parse a shard given as INDEX/COUNT, e.g. 0/4"""
+    index, _, count = text.partition("/")
+    try:
+        return Shard(int(index), int(count))
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid shard {text!r}, expected INDEX/COUNT with 0 <= INDEX < COUNT, e.g. 0/4") from None
+
+
+def source_key(path: Path, pollution_dir: Path) -> str:
+    """The key a gas .csv file is sharded by: the path of its src_[source] directory relative to pollution_dir,
+    so that hosts mounting the shared filesystem at different places agree on it"""
+    return path.parent.relative_to(pollution_dir).as_posix()
+
+
+def _remove(path: Path) -> None:
+    """Remove the file at path, if it still exists"""
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _merge_results(results: list[dict]) -> dict:
+    """Add up the numbers of the results of several shards, and merge their dictionaries (e.g. the validation errors)"""
+    merged: dict = {}
+    for result in results:
+        for key, val in result.items():
+            if isinstance(val, (int, float)) and not isinstance(val, bool):
+                merged[key] = merged.get(key, 0) + val
+            elif isinstance(val, dict):
+                merged.setdefault(key, {}).update(val)
+            else:
+                merged.setdefault(key, val)
+    return merged
+
+
+class ShardCoordinator:
+    """The coordination of count shards of one stage of the pipeline, through files in coord_dir.
+
+    Every shard calls finish with its result once its part is done. The calls may come from any number of
+    processes and hosts, in any order: the one that finds every manifest written and takes the merge lock gets
+    the merged result, and calls complete after running the steps that needed every shard. Until then, running
+    any shard again repeats the merge, so that a failed final step is retried by rerunning one shard.
+
+    Parameters:
+        - coord_dir (str or pathlib.Path) : Path to the coordination directory, created if needed, on the filesystem shared by the workers
+        - count (int) : Number of shards
+        - stage (str) : Name of the stage, so that several stages can be coordinated in the same directory
+    """
+
+    def __init__(self, coord_dir: str | Path, count: int, stage: str = "restructure") -> None:
+        self.coord_dir = Path(coord_dir)
+        self.count = count
+        self.stage = stage
+        self.lock_path = self.coord_dir / f"{stage}.lock"
+        self.coord_dir.mkdir(parents=True, exist_ok=True)
+
+    def manifest_path(self, index: int) -> Path:
+        """Path to the manifest of shard index"""
+        return self.coord_dir / f"{self.stage}-{index}-of-{self.count}.json"
+
+    @property
+    def merged_path(self) -> Path:
+        """Path to the merged manifest, written by the worker that merges the shards"""
+        return self.coord_dir / f"{self.stage}.json"
+
+    def pending(self) -> list[int]:
+        """The shards whose manifest has not been written yet"""
+        return [index for index in range(self.count) if not self.manifest_path(index).exists()]
+
+    def _write(self, path: Path, content: dict) -> None:
+        # Written atomically, so that another worker never reads a partial manifest
+        tmp_path = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(content, indent=1, default=str))
+        os.replace(tmp_path, path)
+
+    def _lock_is_stale(self) -> bool:
+        """Check if the merge lock was left behind by a process of this host that no longer exists"""
+        try:
+            holder = json.loads(self.lock_path.read_text())
+        except (OSError, ValueError):
+            return False
+        if holder.get("host") != socket.gethostname():
+            return False
+        try:
+            os.kill(holder["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except (OSError, KeyError, TypeError):
+            return False
+        return False
+
+    def acquire(self) -> bool:
+        """Take the merge lock, with an exclusive create, which also holds on NFS. Returns False if another worker holds it"""
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._lock_is_stale():
+                    return False
+                _remove(self.lock_path)
+                continue
+            with os.fdopen(fd, "w") as file:
+                json.dump({"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}, file)
+            return True
+        return False
+
+    def release(self) -> None:
+        """Release the merge lock, keeping the manifests so that the merge is repeated by the next shard to finish"""
+        _remove(self.lock_path)
+
+    def finish(self, shard: Shard, result: dict) -> dict | None:
+        """Write the manifest of shard, and merge the manifests of every shard if it was the last one missing.
+
+        Parameters:
+            - shard (Shard) : The shard that is done, whose count must be the count of the coordinator
+            - result (dict) : The outcome of the shard, e.g. returned by restructure_pollution_data
+
+        Returns:
+            - (dict or None) : The merged result, where the numbers of the shards are added up and their dictionaries merged,
+                               with the key shards (number of shards). None if shards are pending or another worker merges them
+        """
+        if shard.count != self.count:
+            raise ValueError(f"shard {shard} does not belong to a coordination of {self.count} shards")
+        manifest = {"shard": str(shard), "host": socket.gethostname(), "pid": os.getpid(), "finished": time.time(), "result": result}
+        self._write(self.manifest_path(shard.index), manifest)
+
+        # The worker writing the last manifest always sees every manifest, and the lock leaves one of them merging
+        if self.pending() or not self.acquire():
+            return None
+        if self.pending():
+            # The manifests of a previous coordination were removed in between
+            self.release()
+            return None
+        results = [json.loads(self.manifest_path(index).read_text())["result"] for index in range(self.count)]
+        merged = {**_merge_results(results), "shards": self.count}
+        self._write(self.merged_path, merged)
+        return merged
+
+    def complete(self) -> None:
+        """Remove the manifests of the shards and release the merge lock, once the steps needing every shard are done"""
+        for index in range(self.count):
+            _remove(self.manifest_path(index))
+        self.release()
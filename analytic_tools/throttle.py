@@ -0,0 +1,203 @@
+"""Module containing the I/O throttling and priority control of background runs on shared hosts.
+
+The copies, hashes and scans of analytic_tools go through the process-wide io_throttle, which limits them to
+a number of bytes and a number of files per second with two token buckets. It does not limit anything until
+set_io_limits is called. lower_priority lowers the CPU priority (nice) and the I/O priority (ionice) of the
+process, so that the remaining work yields to co-located services. Both trade wall time for a lower impact,
+and both apply to the calling process and to the worker processes it forks afterwards, each on its own.
+The priorities are also inherited by spawned processes, but the limits are not: a pool of spawned workers
+passes them on with set_io_limits as its initializer, as batch_analyze_pollution_data does.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import platform
+import sys
+import threading
+import time
+from typing import Callable
+
+# Number of the ioprio_set system call, which has no wrapper in the C library, per machine
+_IOPRIO_SET = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289, "aarch64": 30, "arm64": 30, "armv7l": 314, "ppc64le": 273}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+IO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+
+class TokenBucket:
+    """A token bucket refilled with rate tokens per second, holding at most burst tokens.
+    A caller may take more tokens than the bucket holds: it then waits until the debt is repaid, so that
+    large amounts (e.g. a chunk of a file) are limited as precisely as small ones. The tokens are reserved
+    before waiting, so that concurrent threads share the rate instead of each using all of it.
+
+    Parameters:
+        - rate (float or None) : Number of tokens per second, None for no limit
+        - burst (float or None) : Maximum number of tokens saved up while idle, default to one second of tokens
+        - clock (Callable) : Function returning the current time in seconds, default to time.monotonic
+        - sleep (Callable) : Function waiting a number of seconds, default to time.sleep
+    """
+
+    def __init__(
+        self,
+        rate: float | None,
+        burst: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate is not None and rate <= 0:
+            raise ValueError(f"rate must be positive, but got {rate}")
+        self.rate = rate
+        self.burst = burst if burst is not None else (rate or 0.0)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.burst
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> float:
+        """Take amount tokens, waiting as long as needed for the bucket to refill.
+
+        Parameters:
+            - amount (float) : Number of tokens to take
+
+        Returns:
+            - (float) : Number of seconds waited
+        """
+        if self.rate is None or amount <= 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class Throttle:
+    """Limits on the bytes and the files read and written per second, shared by every thread of the process.
+    The update method makes a Throttle a consumer of utilities.copy_file_chunked, like a hash object.
+
+    Parameters:
+        - bytes_per_second (float or None) : Maximum number of bytes per second, None for no limit
+        - files_per_second (float or None) : Maximum number of files opened and directories listed per second, None for no limit
+    """
+
+    def __init__(self, bytes_per_second: float | None = None, files_per_second: float | None = None) -> None:
+        self._lock = threading.Lock()
+        self.configure(bytes_per_second, files_per_second)
+
+    def configure(self, bytes_per_second: float | None = None, files_per_second: float | None = None) -> None:
+        """Replace the limits, and reset the statistics"""
+        bytes_bucket = TokenBucket(bytes_per_second)
+        files_bucket = TokenBucket(files_per_second)
+        with self._lock:
+            self.bytes_per_second = bytes_per_second
+            self.files_per_second = files_per_second
+            self._bytes = bytes_bucket
+            self._files = files_bucket
+            self._stats = {"bytes": 0, "files": 0, "waited": 0.0}
+
+    @property
+    def limited(self) -> bool:
+        """True if any limit is set"""
+        return self.bytes_per_second is not None or self.files_per_second is not None
+
+    def _count(self, key: str, amount: int, waited: float) -> None:
+        with self._lock:
+            self._stats[key] += amount
+            self._stats["waited"] += waited
+
+    def update(self, chunk: bytes) -> None:
+        """Account for a chunk of bytes read or written, waiting if the byte limit is reached"""
+        if self.limited:
+            self._count("bytes", len(chunk), self._bytes.acquire(len(chunk)))
+
+    def file(self) -> None:
+        """Account for a file opened or a directory listed, waiting if the file limit is reached"""
+        if self.limited:
+            self._count("files", 1, self._files.acquire(1))
+
+    def stats(self) -> dict:
+        """Statistics of the throttle, with keys: bytes and files (accounted for while limited) and waited (seconds)"""
+        with self._lock:
+            return dict(self._stats)
+
+
+# The throttle shared by the copies, hashes and scans of this process, without limits until set_io_limits is called
+io_throttle = Throttle()
+
+
+def set_io_limits(bytes_per_second: float | None = None, files_per_second: float | None = None) -> Throttle:
+    """Replace the limits of the process-wide io_throttle, see Throttle. Calling it without limits removes them.
+
+    Parameters:
+        - bytes_per_second (float or None) : Maximum number of bytes per second, None for no limit
+        - files_per_second (float or None) : Maximum number of files opened and directories listed per second, None for no limit
+
+    Returns:
+        - (Throttle) : The process-wide throttle
+    """
+    # Changed in place, since the modules using it hold a reference to it
+    io_throttle.configure(bytes_per_second, files_per_second)
+    return io_throttle
+
+
+def parse_rate(text: str) -> float:
+    """Parse a number of bytes per second with an optional binary multiplier, e.g. 512K, 20M or 1G"""
+    multipliers = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    text = text.strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    multiplier = multipliers.get(text[-1:], 1)
+    number = text[:-1] if text[-1:] in multipliers else text
+    rate = float(number) * multiplier
+    if rate <= 0:
+        raise ValueError(f"the rate must be positive, but got {text!r}")
+    return rate
+
+
+def _set_io_priority(io_class: str, level: int) -> bool:
+    """Set the I/O priority of the calling process with the ioprio_set system call, see ionice(1).
+    Returns False where it is not available, e.g. on other platforms than Linux"""
+    number = _IOPRIO_SET.get(platform.machine().lower())
+    if not sys.platform.startswith("linux") or number is None:
+        return False
+    data = 0 if io_class == "idle" else level
+    ioprio = (IO_CLASSES[io_class] << _IOPRIO_CLASS_SHIFT) | data
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return libc.syscall(number, _IOPRIO_WHO_PROCESS, 0, ioprio) == 0
+
+
+def lower_priority(niceness: int = 10, io_class: str = "idle", io_level: int = 7) -> dict:
+    """Lower the CPU and I/O priority of the calling process, and so of the worker processes it creates afterwards.
+    A priority can only be lowered: a niceness below the current one is left as it is.
+
+    Parameters:
+        - niceness (int) : The nice value (0 to 19, higher is lower priority), set with os.setpriority, default to ten
+        - io_class (str) : The I/O scheduling class, one of idle (only use the disk when no one else does),
+                           best-effort or realtime, see ionice(1). Default to idle
+        - io_level (int) : The priority within the best-effort and realtime classes, from 0 (highest) to 7 (lowest)
+
+    Returns:
+        - (dict) : The outcome, with keys: nice (the niceness of the process afterwards) and
+                   io class (the I/O class that was set, None if the I/O priority is not supported here)
+    """
+    if io_class not in IO_CLASSES:
+        raise ValueError(f"Unknown I/O class {io_class!r}, expected one of {', '.join(IO_CLASSES)}")
+    if not 0 <= io_level <= 7:
+        raise ValueError(f"io_level must be between 0 and 7, but got {io_level}")
+
+    res = {"nice": None, "io class": None}
+    if hasattr(os, "setpriority"):
+        current = os.getpriority(os.PRIO_PROCESS, 0)
+        if niceness > current:
+            os.setpriority(os.PRIO_PROCESS, 0, niceness)
+        res["nice"] = os.getpriority(os.PRIO_PROCESS, 0)
+    if _set_io_priority(io_class, io_level):
+        res["io class"] = io_class
+    return res
@@ -3,18 +3,239 @@
 from __future__ import annotations
 
 # Include the necessary packages here
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, List
+import contextlib
+import csv
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
 import os
 import shutil
+import tempfile
+import threading
 
+from analytic_tools.progress import progress
+from analytic_tools.throttle import io_throttle
 
-def get_diagnostics(dir: str | Path) -> dict[str, int]:
+# Name of the file with the summary statistics of a gas, written next to its .csv files in by_gas/gas_[gas_formula]
+SUMMARY_NAME = "summary.json"
+
+# The years every original gas .csv file must report
+FIRST_YEAR = 1990
+LAST_YEAR = 2022
+
+# Size of the chunks files are read in when copied or hashed, which bounds the memory used per file
+CHUNK_SIZE = 1024 * 1024
+
+# Suffixes of the compressed variants of the gas .csv files (e.g. CO2.csv.gz), which are decompressed while they are read.
+# When a directory holds several variants of the same file, the plain one is used, then the first of these, see variant_rank
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+# Directories that never hold original data, left out when searching for the gas .csv files
+DEFAULT_IGNORE = ("pollution_data_restructured", ".git", "__pycache__")
+
+
+@dataclass(frozen=True)
+class TraversalPolicy:
+    """Policy of the directory walk done by walk, deciding which subtrees are not descended into.
+
+    Parameters:
+        - ignore (tuple[str]) : Shell-style patterns (e.g. ".git" or "backup_*") of the names of the files and
+                                directories to leave out, together with everything below them
+        - max_depth (int or None) : Number of levels of subdirectories to descend into, default to all of them.
+                                The subdirectories at the last level are listed, but not walked
+        - same_filesystem (bool) : If True, do not descend into directories on another file system than the root
+        - follow_symlinks (bool) : If True, descend into symbolic links to directories. Every directory is still
+                                walked at most once, so symbolic link loops end the descent
+    """
+
+    ignore: tuple[str, ...] = ()
+    max_depth: int | None = None
+    same_filesystem: bool = False
+    follow_symlinks: bool = False
+
+    def ignores(self, name: str) -> bool:
+        """Check if the file or directory called name is left out of the walk"""
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.ignore)
+
+
+def walk(dir: str | Path, policy: TraversalPolicy | None = None):
+    """Walk the directory tree with root directory pointed to by dir top-down, like os.walk, following policy.
+       As with os.walk, removing names from dirnames before the next step keeps the walk out of those directories.
+       Every directory listed counts as a file for the limits of throttle.io_throttle, and is counted by progress.progress.
+
+    Parameters:
+        - dir (str or pathlib.Path) : Path to the root directory
+        - policy (TraversalPolicy or None) : The subtrees to leave out, default to walking everything except symbolic links
+
+    Returns:
+        - (Iterator[tuple[str, List[str], List[str]]]) : (dirpath, dirnames, filenames) for every directory walked,
+                                with the names sorted. Symbolic links to directories are listed in dirnames
+    """
+    policy = policy or TraversalPolicy()
+    root = os.fspath(dir)
+    root_stat = os.stat(root)
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    stack = [(root, 0)]
+    while stack:
+        dirpath, depth = stack.pop()
+        subdirs = {}
+        filenames = []
+        io_throttle.file()
+        progress.add(dirs=1)
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if policy.ignores(entry.name):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        subdirs[entry.name] = entry
+                    else:
+                        filenames.append(entry.name)
+        except OSError:
+            # The directory was removed or cannot be read
+            continue
+        dirnames = sorted(subdirs)
+        filenames.sort()
+        yield dirpath, dirnames, filenames
+
+        if policy.max_depth is not None and depth >= policy.max_depth:
+            continue
+        descend = []
+        for name in dirnames:
+            entry = subdirs.get(name)
+            if entry is None or (entry.is_symlink() and not policy.follow_symlinks):
+                continue
+            if policy.follow_symlinks or policy.same_filesystem:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if policy.same_filesystem and stat.st_dev != root_stat.st_dev:
+                    continue
+                if (stat.st_dev, stat.st_ino) in visited:
+                    # A symbolic link back into the part of the tree that is walked already
+                    continue
+                visited.add((stat.st_dev, stat.st_ino))
+            descend.append((entry.path, depth + 1))
+        stack.extend(reversed(descend))
+
+
+# File extensions counted separately by the diagnostics, the others are counted as "other files"
+DIAGNOSTIC_SUFFIXES = (".csv", ".txt", ".npy", ".md")
+
+
+class DirNode:
+    """One directory of a rollup tree built by build_rollup_tree. Besides its own files and subdirectories,
+    every node holds the totals of its whole subtree, so any directory can be summarized without walking it again.
+
+    Attributes:
+        - name (str) : Name of the directory
+        - files (List[str]) : Names of the files directly in the directory, sorted
+        - children (List[DirNode]) : The subdirectories, sorted by name
+        - file_count (int) : Number of files in the subtree
+        - dir_count (int) : Number of subdirectories in the subtree, not counting the directory itself
+        - bytes (int) : Total size of the files in the subtree
+        - suffixes (Dict[str, int]) : Number of files in the subtree per file extension, e.g. {".csv": 15}
+    """
+
+    __slots__ = ("name", "files", "children", "file_count", "dir_count", "bytes", "suffixes")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.files: list[str] = []
+        self.children: list[DirNode] = []
+        self.file_count = 0
+        self.dir_count = 0
+        self.bytes = 0
+        self.suffixes: dict[str, int] = {}
+
+    def count_file(self, name: str, size: int) -> None:
+        """Count a file of size bytes called name, directly in this directory"""
+        suffix = os.path.splitext(name)[1]
+        self.suffixes[suffix] = self.suffixes.get(suffix, 0) + 1
+        self.file_count += 1
+        self.bytes += size
+
+    def diagnostics(self) -> dict[str, int]:
+        """The diagnostics of the subtree, in the format returned by get_diagnostics"""
+        res = {"files": self.file_count, "subdirectories": self.dir_count}
+        for suffix in DIAGNOSTIC_SUFFIXES:
+            res[f"{suffix} files"] = self.suffixes.get(suffix, 0)
+        res["other files"] = self.file_count - sum(self.suffixes.get(suffix, 0) for suffix in DIAGNOSTIC_SUFFIXES)
+        return res
+
+
+def build_rollup_tree(dir: str | Path, policy: TraversalPolicy | None = None) -> DirNode:
+    """Walk the directory tree with root directory pointed to by dir once, and build a DirNode for every
+       directory with the file counts, sizes and extension counts of its subtree.
+
+    Parameters:
+        - dir (str or pathlib.Path) : Path to the root directory
+        - policy (TraversalPolicy or None) : The subtrees to leave out, see walk
+
+    Returns:
+        - (DirNode) : The root of the tree, named after dir
+    """
+    root = DirNode(Path(dir).resolve().name)
+    nodes: dict[str, DirNode] = {os.fspath(dir): root}
+    order = []
+    progress.stage("diagnose")
+    for dirpath, dirnames, filenames in walk(dir, policy):
+        node = nodes.pop(dirpath)
+        node.files = filenames
+        node.children = [DirNode(name) for name in dirnames]
+        for child in node.children:
+            nodes[os.path.join(dirpath, child.name)] = child
+        node.dir_count = len(dirnames)
+        for filename in filenames:
+            try:
+                size = os.stat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                # e.g. a broken symbolic link
+                size = 0
+            node.count_file(filename, size)
+        order.append(node)
+
+    # The walk is top-down, so every node comes after its parent
+    add_subtree_totals(order)
+    return root
+
+
+def add_subtree_totals(nodes: list[DirNode]) -> None:
+    """Add the counts of every node to those of its parent, turning the counts of the files directly in each
+    directory into the totals of its subtree. Every node must come after its parent in nodes, as in a top-down walk.
+
+    Parameters:
+        - nodes (List[DirNode]) : The nodes of the tree, each holding the counts of its own files and subdirectories
+
+    Returns:
+        None
+    """
+    for node in reversed(nodes):
+        for child in node.children:
+            node.file_count += child.file_count
+            node.dir_count += child.dir_count
+            node.bytes += child.bytes
+            for suffix, count in child.suffixes.items():
+                node.suffixes[suffix] = node.suffixes.get(suffix, 0) + count
+
+
+def get_diagnostics(dir: str | Path, policy: TraversalPolicy | None = None) -> dict[str, int]:
     """Get diagnostics for the directory tree, with root directory pointed to by dir.
        Counts up all the files, subdirectories, and specifically .csv, .txt, .npy, .md and other files in the whole directory tree.
 
     Parameters:
-        dir (str or pathlib.Path) : Absolute path to the directory of interest
+        dir (str or pathlib.Path) : Absolute path to the directory of interest, or to a .zip or .tar[.gz] archive of it
+        policy (TraversalPolicy or None) : The subtrees left out of the count, see walk. Default to counting everything
 
     Returns:
         res (Dict[str, int]) : a dictionary of the findings with following keys: files, subdirectories, .csv files, .txt files, .npy files, .md files, other files.
@@ -44,35 +265,18 @@ def get_diagnostics(dir: str | Path) -> dict[str, int]:
     if not dir.exists():  # Check if path exists
         raise NotADirectoryError("The directory does not exist.")
 
-    if not dir.is_dir():  # Check if it's a directory, not a file
-        raise NotADirectoryError(f"{dir} is not a directory.")
+    from analytic_tools.archive import build_archive_tree, is_archive
 
-    
+    if is_archive(dir):
+        # An archive is counted from its member list, without extracting it
+        res.update(build_archive_tree(dir, policy).diagnostics())
+        return res
 
+    if not dir.is_dir():  # Check if it's a directory, not a file
+        raise NotADirectoryError(f"{dir} is not a directory.")
 
-    # Traverse the directory and find its contents
-    #contents = [x for x in dir.iterdir() if x.is_dir()] #itererer gjennom alt fra current folder og alle subtrær og finner det som er subfolder
-    #contents = [x for x in dir.iterdir()] 
-    contents = [x for x in dir.rglob('*')] # Lager en liste for alle filer og folders i directoryet
-
-    # Count folders and total num. of files
-    for path in contents:
-    #for path in dir.rglob('*'):
-        if path.is_dir() and path != dir:
-            #print(path)
-            res["subdirectories"] +=1
-        elif path.is_file():
-            res["files"] += 1
-            if path.suffix == ".csv":
-                res[".csv files"] +=1
-            elif path.suffix == ".txt":
-                res[".txt files"] += 1
-            elif path.suffix == ".npy":
-                res[".npy files"] += 1
-            elif path.suffix == ".md":
-                res[".md files"] += 1
-            else:
-                res["other files"] += 1
+    # Traverse the directory and count its contents
+    res.update(build_rollup_tree(dir, policy).diagnostics())
 
     return res
 
@@ -126,14 +330,16 @@ def display_diagnostics(dir: str | Path, contents: dict[str, int]) -> None:
         print(f"Number of {key}: {val}")
 
 
-def display_directory_tree(dir: str | Path, maxfiles: int = 3) -> None:
+def display_directory_tree(dir: str | Path, maxfiles: int = 3, tree: DirNode | None = None) -> None:
     """Display a directory tree, with root directory pointed to by dir.
        Limit the number of files to be displayed for convenience to maxfiles.
+       Every directory is followed by the number of files in its subtree.
        This tree is built with inspiration from the code written by "Flimm" at https://stackoverflow.com/questions/6639394/what-is-the-python-way-to-walk-a-directory-tree
 
     Parameters:
-        dir (str or pathlib.Path) : Absolute path to the directory of interest
+        dir (str or pathlib.Path) : Absolute path to the directory of interest, or to a .zip or .tar[.gz] archive of it
         maxfiles (int) : Maximum number of files to be displayed at each level in the tree, default to three.
+        tree (DirNode or None) : The rollup tree of dir, if it was built already by build_rollup_tree
 
     Returns:
         None
@@ -148,48 +354,121 @@ def display_directory_tree(dir: str | Path, maxfiles: int = 3) -> None:
 
     path = Path(dir)
 
-    if not path.is_dir():
-        raise NotADirectoryError
-    
+    from analytic_tools.archive import build_archive_tree, is_archive
+
     # Error handling: Check if the input path is a valid directory
     if not path.exists():
         raise NotADirectoryError(f"{path} does not exist.")
-    if not path.is_dir():
+    if not path.is_dir() and not is_archive(path):
         raise NotADirectoryError(f"{path} is not a directory.")
     if not isinstance(maxfiles, int):
         raise TypeError
     if maxfiles < 1:
         raise ValueError
-    
 
-    
+    if tree is None:
+        tree = build_archive_tree(path) if is_archive(path) else build_rollup_tree(path)
+
     # Print the root directory
     print(f"{path.name}/")
 
-    indent = 0
-
-    for dirpath, _, files in path.walk():
-        # Calculate the indentation level based on the depth of the current directory
-        depth = len(Path(dirpath).relative_to(path).parts)
+    stack = [(tree, 0)]
+    while stack:
+        node, depth = stack.pop()
+        # The indentation level is given by the depth of the current directory
         indent = "    " * depth
-        
+
         # Print the directory
-        print(f"{indent}- {Path(dirpath).name}/")
-        
+        print(f"{indent}- {node.name}/ ({node.file_count} files)")
+
         # Limit the number of files displayed
-        files_to_display = files[:maxfiles] if len(files) > maxfiles else files
+        files_to_display = node.files[:maxfiles] if len(node.files) > maxfiles else node.files
         for file in files_to_display:
             print(f"{indent}    - {file}")
-        
+
         # Indicate if there are more files than the limit
-        if len(files) > maxfiles:
+        if len(node.files) > maxfiles:
             print(f"{indent}    - ...")
 
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+
+
+def split_compression(name: str) -> tuple[str, str]:
+    """Split the name of a possibly compressed file into its uncompressed name and its compression suffix,
+    e.g. ("CO2.csv", ".gz") for CO2.csv.gz and ("CO2.csv", "") for CO2.csv"""
+    for suffix in COMPRESSED_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)], suffix
+    return name, ""
+
+
+def is_csv_name(name: str) -> bool:
+    """Check if name is the name of a .csv file, compressed (see COMPRESSED_SUFFIXES) or not"""
+    return split_compression(name)[0].endswith(".csv")
+
+
+def variant_rank(name: str) -> int:
+    """Rank of a plain or compressed variant of a file, lowest preferred: 0 for CO2.csv, then 1 for CO2.csv.gz and 2 for CO2.csv.zst"""
+    suffix = split_compression(name)[1]
+    return COMPRESSED_SUFFIXES.index(suffix) + 1 if suffix else 0
+
+
+def preferred_variants(paths: list) -> list:
+    """Keep one variant (see variant_rank) of every file stored several times in the same directory, e.g. CO2.csv of
+       CO2.csv and CO2.csv.gz, which would otherwise both be restructured into the copy src_[source]_CO2.csv.
+
+    Parameters:
+        - paths (List[str | Path]) : Paths to gas .csv files, as strings with / as separator or as paths
+
+    Returns:
+        - (List[str | Path]) : The paths kept, in the order given
+    """
+    best = {}
+    for path in paths:
+        parts = path.rsplit("/", 1) if isinstance(path, str) else (path.parent, path.name)
+        key = (*parts[:-1], split_compression(parts[-1])[0])
+        if key not in best or variant_rank(parts[-1]) < variant_rank(best[key][1]):
+            best[key] = (path, parts[-1])
+    kept = {id(path) for path, _ in best.values()}
+    return [path for path in paths if id(path) in kept]
+
+
+def existing_variant(path: str | Path) -> Path | None:
+    """The preferred (see variant_rank) of the variants of the file pointed to by path that exist, e.g. CO2.csv
+       for CO2.csv.gz if both exist, or None if none of them exists"""
+    path = Path(path)
+    name = split_compression(path.name)[0]
+    for suffix in ("", *COMPRESSED_SUFFIXES):
+        variant = path.with_name(name + suffix)
+        if variant.is_file():
+            return variant
+    return None
+
+
+def stale_variants(names: list[str], copies: set[str]) -> list[str]:
+    """The names in a gas_[gas_formula] directory that are other variants of the copies just made, e.g. src_a_CO2.csv.zst
+       left by a run that kept the compression next to src_a_CO2.csv, and are to be removed so that no source counts twice.
+
+    Parameters:
+        - names (List[str]) : Names of the files in the gas_[gas_formula] directory
+        - copies (Set[str]) : Names of the copies of the current sources in the directory
+
+    Returns:
+        - (List[str]) : The names to remove
+    """
+    current = {split_compression(name)[0] for name in copies}
+    return [name for name in names if name not in copies and is_csv_name(name) and split_compression(name)[0] in current]
+
+
+def gas_formula(path: str | Path) -> str:
+    """Formula of the gas of a [gas_formula].csv file, compressed or not, e.g. CO2 for CO2.csv.gz"""
+    return Path(split_compression(Path(path).name)[0]).stem
+
 
 def is_gas_csv(path: str | Path) -> bool:
     """Checks if a csv file pointed to by path is an original gas statistics file.
         An original file must be called '[gas_formula].csv' where [gas_formula] is
-        in ['CO2', 'CH4', 'N2O', 'SF6', 'H2'].
+        in ['CO2', 'CH4', 'N2O', 'SF6', 'H2'], or be a compressed variant of it, e.g. '[gas_formula].csv.gz'.
 
     Parameters:
          - path (str of pathlib.Path) : Absolute path to .csv file that will be checked
@@ -204,7 +483,8 @@ def is_gas_csv(path: str | Path) -> bool:
     if not isinstance(path, (str, Path)):
         raise TypeError(f"Expected a path-like object (str or Path), but got {type(path).__name__}.")
     
-    file = Path(path)
+    # A compressed file is classified by the name it has once decompressed
+    file = Path(split_compression(Path(path).name)[0])
 
     # if not file.is_file():
     #     raise ValueError(f"Did not get a file")
@@ -221,6 +501,166 @@ def is_gas_csv(path: str | Path) -> bool:
     return gas_name in gasses
 
 
+def has_zstd() -> bool:
+    """Check if .zst files can be read and written, with compression.zstd (Python 3.14) or the zstandard package"""
+    try:
+        _zstd()
+    except ImportError:
+        return False
+    return True
+
+
+def _zstd():
+    """The module used to read and write .zst files"""
+    try:
+        from compression import zstd
+
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(".zst files require the zstandard package, install it with pip install .[zstd]") from e
+    return zstandard
+
+
+def open_csv(file, mode: str = "rb", compression: str | None = None):
+    """Open a .csv file as a binary file object, which decompresses the file in chunks while it is read, or
+       compresses what is written to it, so that a compressed file is never inflated in memory as a whole.
+
+    Parameters:
+        - file (str, pathlib.Path or BinaryIO) : Path to the file, or a binary file object (e.g. a member of an archive).
+                                      A file object is not closed with the returned one, unless it is returned as is
+        - mode (str) : "rb" to read or "wb" to write
+        - compression (str or None) : One of COMPRESSED_SUFFIXES, or "" for a plain .csv file.
+                                      Default to the compression suffix of the name of file, which must then be a path
+
+    Returns:
+        - (BinaryIO) : The file object, which is a file object given as file itself if there is no compression
+    """
+    if compression is None:
+        compression = split_compression(Path(file).name)[1]
+    if compression == ".gz":
+        # The level of the gzip command, much faster than the default of the gzip module for a slightly larger file
+        return gzip.open(file, mode, compresslevel=6)
+    if compression == ".zst":
+        zst_file = _zstd().open(file, mode)
+        # Buffered, so that the decompressed stream can be read line by line, e.g. by np.loadtxt
+        return io.BufferedReader(zst_file, CHUNK_SIZE) if mode == "rb" else zst_file
+    if compression:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSED_SUFFIXES)}")
+    return open(file, mode) if isinstance(file, (str, Path)) else file
+
+
+@dataclass(frozen=True)
+class Selection:
+    """Selection of a subset of the gas .csv files, for partial restructuring and plotting.
+       Gases and sources are matched with shell-style patterns (e.g. "CO2" or "oil_*"), where a source is
+       the name of its src_[source] directory without the "src_" prefix. Empty filters select everything.
+
+    Parameters:
+        - gases (tuple[str]) : Patterns of the gases to include, default to all
+        - sources (tuple[str]) : Patterns of the sources to include, default to all
+        - exclude_gases (tuple[str]) : Patterns of the gases to leave out
+        - exclude_sources (tuple[str]) : Patterns of the sources to leave out
+        - years (tuple[int, int] or None) : First and last year of the rows to keep, default to all rows
+    """
+
+    gases: tuple[str, ...] = ()
+    sources: tuple[str, ...] = ()
+    exclude_gases: tuple[str, ...] = ()
+    exclude_sources: tuple[str, ...] = ()
+    years: tuple[int, int] | None = None
+
+    @staticmethod
+    def _match(name: str, include: tuple[str, ...], exclude: tuple[str, ...]) -> bool:
+        if include and not any(fnmatch.fnmatchcase(name, pattern) for pattern in include):
+            return False
+        return not any(fnmatch.fnmatchcase(name, pattern) for pattern in exclude)
+
+    def match_gas(self, gas: str) -> bool:
+        """Check if the gas with formula gas is selected"""
+        return self._match(gas, self.gases, self.exclude_gases)
+
+    def match_source(self, dir_name: str) -> bool:
+        """Check if the source directory named dir_name (src_[source]) is selected"""
+        source = dir_name[len("src_"):] if dir_name.startswith("src_") else dir_name
+        return self._match(source, self.sources, self.exclude_sources)
+
+
+def find_gas_csv_files(
+    dir: str | Path, selection: Selection | None = None, policy: TraversalPolicy | None = None
+) -> list[Path]:
+    """Find all the original gas .csv files (see is_gas_csv) in the directory tree with root directory pointed to by dir.
+       Of a file stored both plain and compressed in the same directory, only one variant is found, see preferred_variants.
+       With a selection, src_[source] directories of sources that are not selected are pruned before they are
+       descended into, so the cost of the search is proportional to the selected part of the tree.
+
+    Parameters:
+        - dir (str or pathlib.Path) : Path to the directory to search, e.g. pollution_data
+        - selection (Selection or None) : The gases and sources to find, default to all
+        - policy (TraversalPolicy or None) : The subtrees to leave out of the search, see walk.
+                                             Default to leaving out the directories in DEFAULT_IGNORE
+
+    Returns:
+        - (List[pathlib.Path]) : Paths to the gas .csv files, sorted
+    """
+    if not isinstance(dir, (str, Path)):
+        raise TypeError(f"Expected a path-like object (str or Path), but got {type(dir).__name__}.")
+
+    if policy is None:
+        policy = TraversalPolicy(ignore=DEFAULT_IGNORE)
+
+    res = []
+    for dirpath, dirnames, filenames in walk(dir, policy):
+        if selection is not None:
+            # Pruning dirnames in place keeps the walk out of the sources that are not selected
+            dirnames[:] = [name for name in dirnames if not name.startswith("src_") or selection.match_source(name)]
+        for filename in filenames:
+            path = Path(dirpath, filename)
+            if is_csv_name(filename) and is_gas_csv(path) and (selection is None or selection.match_gas(gas_formula(path))):
+                res.append(path)
+    return sorted(preferred_variants(res))
+
+
+class YearFilter:
+    """Streaming filter of the rows of a gas .csv file, keeping the header and the rows of the years from first to last.
+    Used as the transform of copy_file_chunked. Rows whose year cannot be parsed are kept, for validation to report.
+
+    Parameters:
+        - first (int) : First year to keep
+        - last (int) : Last year to keep
+    """
+
+    def __init__(self, first: int, last: int) -> None:
+        self.first = first
+        self.last = last
+        self._rest = b""
+        self._header = True
+
+    def _keep(self, line: bytes) -> bool:
+        if self._header:
+            self._header = False
+            return True
+        try:
+            year = int(line.split(b",", 1)[0])
+        except ValueError:
+            return True
+        return self.first <= year <= self.last
+
+    def filter(self, chunk: bytes) -> bytes:
+        """Return the kept complete lines of chunk, keeping an incomplete last line for the next chunk"""
+        lines = (self._rest + chunk).split(b"\n")
+        self._rest = lines.pop()
+        return b"".join(line + b"\n" for line in lines if self._keep(line))
+
+    def flush(self) -> bytes:
+        """Return the last line, if it is kept and was not terminated by a newline"""
+        rest, self._rest = self._rest, b""
+        return rest if rest and self._keep(rest) else b""
+
+
 def get_dest_dir_from_csv_file(dest_parent: str | Path, file_path: str | Path) -> Path:
     """Given a file pointed to by file_path, derive the correct gas_[gas_formula] directory name.
         Checks if a directory "gas_[gas_formula]", exists and if not, it creates one as a subdirectory under dest_parent.
@@ -247,11 +687,13 @@ def get_dest_dir_from_csv_file(dest_parent: str | Path, file_path: str | Path) -
     dest_parent = Path(dest_parent)
     file_path = Path(file_path)
 
-    # Check if the file has a valid gas name and .csv suffix before checking existence
-    if file_path.stem not in ['CO2', 'CH4', 'N2O', 'SF6', 'H2']:
-        raise ValueError(f"Invalid gas name: {file_path.stem}")
-    if file_path.suffix != '.csv':
-        raise ValueError(f"Invalid file extension: {file_path.suffix}. Expected '.csv'")
+    # Check if the file has a valid gas name and .csv suffix before checking existence,
+    # where a compressed file is checked by the name it has once decompressed
+    csv_name = Path(split_compression(file_path.name)[0])
+    if csv_name.stem not in ['CO2', 'CH4', 'N2O', 'SF6', 'H2']:
+        raise ValueError(f"Invalid gas name: {csv_name.stem}")
+    if csv_name.suffix != '.csv':
+        raise ValueError(f"Invalid file extension: {csv_name.suffix}. Expected '.csv'")
 
     # Check if the destination parent directory exists
     if not dest_parent.is_dir():
@@ -265,7 +707,7 @@ def get_dest_dir_from_csv_file(dest_parent: str | Path, file_path: str | Path) -
 
     # If the input file is valid:
     # Derive the name of the directory, pattern: gas_[gas_formula] directory
-    gas_name = file_path.stem
+    gas_name = csv_name.stem
 
     dest_name = f"gas_{gas_name}"
     # Derive its absolute path
@@ -306,6 +748,539 @@ def merge_parent_and_basename(path: str | Path) -> str:
     return new_base
 
 
+def restructured_name(path: str | Path, keep_compressed: bool = False) -> str:
+    """Name of the copy of the gas .csv file pointed to by path in by_gas/gas_[gas_formula], see merge_parent_and_basename.
+       The copy of a compressed file is named src_[source]_[gas_formula].csv, as it is decompressed,
+       unless keep_compressed is True, e.g. src_[source]_[gas_formula].csv.gz
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the gas .csv file, e.g. pollution_data/by_src/src_agriculture/CO2.csv.gz
+        - keep_compressed (bool) : If True, the name keeps the compression suffix of path
+
+    Returns:
+        - (str) : Name of the copy
+    """
+    path = Path(path)
+    if not keep_compressed:
+        path = path.with_name(split_compression(path.name)[0])
+    return merge_parent_and_basename(path)
+
+
+def is_up_to_date(dest: str | Path, sources: list[str | Path], same_size: bool = False) -> bool:
+    """Check whether the file pointed to by dest is up to date with respect to the files in sources.
+       dest counts as up to date if it exists and was modified no earlier than every one of the sources.
+
+    Parameters:
+        - dest (str or pathlib.Path) : Path to the derived file
+        - sources (List[str | Path]) : Paths to the files (or directories) dest was derived from
+        - same_size (bool) : If True, dest is a copy of its single source (made with shutil.copy2) and must also have the same size
+
+    Returns:
+        - (bool) : Truth value of whether dest can be reused instead of being created again
+    """
+    if not isinstance(dest, (str, Path)):
+        raise TypeError(f"Expected a path-like object (str or Path), but got {type(dest).__name__}.")
+
+    try:
+        dest_stat = Path(dest).stat()
+    except FileNotFoundError:
+        return False
+
+    for src in sources:
+        src_stat = Path(src).stat()
+        if src_stat.st_mtime_ns > dest_stat.st_mtime_ns:
+            return False
+        if same_size and src_stat.st_size != dest_stat.st_size:
+            return False
+    return True
+
+
+def new_hasher(algorithm: str = "blake2b"):
+    """Create a hash object for algorithm, which is either the name of a hashlib algorithm or of an
+       algorithm of the optional xxhash package (e.g. xxh64, xxh3_64), which is considerably faster.
+
+    Parameters:
+        - algorithm (str) : Name of the algorithm, default to blake2b
+
+    Returns:
+        - A hash object with update and hexdigest methods
+    """
+    if algorithm.startswith("xxh"):
+        try:
+            import xxhash
+        except ImportError as e:
+            raise ImportError(f"The {algorithm} algorithm requires the xxhash package") from e
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def hash_file(path: str | Path, algorithm: str = "blake2b", chunk_size: int = CHUNK_SIZE, decompress: bool = False) -> str:
+    """Compute the hex digest of the file pointed to by path, reading it in chunks of chunk_size bytes.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the file to hash
+        - algorithm (str) : Name of the algorithm, see new_hasher, default to blake2b
+        - chunk_size (int) : Number of bytes read at a time
+        - decompress (bool) : If True, a compressed .csv file (see COMPRESSED_SUFFIXES) is hashed once decompressed
+
+    Returns:
+        - (str) : Hex digest of the contents of the file
+    """
+    if not isinstance(path, (str, Path)):
+        raise TypeError(f"Expected a path-like object (str or Path), but got {type(path).__name__}.")
+
+    hasher = new_hasher(algorithm)
+    io_throttle.file()
+    with (open_csv(path) if decompress else open(path, "rb")) as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            io_throttle.update(chunk)
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def copy_file_chunked(
+    src: str | Path,
+    dest: str | Path,
+    consumers: list = (),
+    chunk_size: int = CHUNK_SIZE,
+    transform: YearFilter | None = None,
+    compression: str | None = None,
+) -> int:
+    """Copy the file pointed to by src to dest in chunks of chunk_size bytes, like shutil.copy2, and pass
+       every chunk to the update method of each consumer, so that e.g. hashing is done in the same read as the copy.
+       A compressed src (see COMPRESSED_SUFFIXES) is decompressed while it is read, so the consumers and the
+       transform always see the contents of the .csv file, and the copy is compressed again as given by compression.
+       The copy is limited by the process-wide throttle.io_throttle, if limits are set.
+
+    Parameters:
+        - src (str or pathlib.Path) : Path to the file to copy
+        - dest (str or pathlib.Path) : Path to the copy, overwritten if it exists
+        - consumers (List) : Objects with an update(bytes) method, such as hashlib hashes, which are passed the bytes written
+        - chunk_size (int) : Number of bytes read at a time
+        - transform (YearFilter or None) : Object with filter(bytes) and flush() methods, changing the bytes before they are written
+        - compression (str or None) : Compression of the copy, one of COMPRESSED_SUFFIXES or "" for a plain .csv file,
+                                      default to the compression of src
+
+    Returns:
+        - (int) : Number of bytes written, before they are compressed
+    """
+    if compression is None:
+        compression = split_compression(Path(src).name)[1]
+    with open_csv(src) as src_file:
+        size = copy_stream_chunked(src_file, dest, consumers, chunk_size, transform, compression)
+    shutil.copystat(src, dest)
+    return size
+
+
+def copy_stream_chunked(
+    src_file,
+    dest: str | Path,
+    consumers: list = (),
+    chunk_size: int = CHUNK_SIZE,
+    transform: YearFilter | None = None,
+    compression: str = "",
+) -> int:
+    """Write the contents of the binary file object src_file (e.g. a member of an archive) to dest in chunks,
+       see copy_file_chunked. The file object is read to the end, but not closed.
+
+    Parameters:
+        - src_file (BinaryIO) : File object to read, see open_csv to decompress it while it is read
+        - dest (str, pathlib.Path or BinaryIO) : Path to the copy, overwritten if it exists, or a binary file object to write to
+        - consumers (List) : Objects with an update(bytes) method, which are passed the bytes written
+        - chunk_size (int) : Number of bytes read at a time
+        - transform (YearFilter or None) : Object with filter(bytes) and flush() methods, changing the bytes before they are written
+        - compression (str) : Compression of the copy, one of COMPRESSED_SUFFIXES, default to none
+
+    Returns:
+        - (int) : Number of bytes written, before they are compressed
+    """
+    io_throttle.file()
+    with contextlib.ExitStack() as stack:
+        if isinstance(dest, (str, Path)):
+            dest = stack.enter_context(open(dest, "wb"))
+        if compression:
+            # Closed first, so that the end of the compressed stream is written before dest is closed
+            dest = stack.enter_context(open_csv(dest, "wb", compression))
+        return _copy_chunks(src_file, dest, consumers, chunk_size, transform)
+
+
+def _copy_chunks(src_file, dest_file, consumers, chunk_size, transform) -> int:
+    """Copy src_file to dest_file, see copy_stream_chunked"""
+    size = 0
+    chunks = iter(lambda: src_file.read(chunk_size), b"")
+    if transform is not None:
+        chunks = _transformed(chunks, transform)
+    for chunk in chunks:
+        io_throttle.update(chunk)
+        for consumer in consumers:
+            consumer.update(chunk)
+        dest_file.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def _transformed(chunks, transform):
+    """Pass every chunk through transform.filter, and end with what transform.flush returns"""
+    for chunk in chunks:
+        yield transform.filter(chunk)
+    yield transform.flush()
+
+
+class GasCsvValidator:
+    """Streaming validator of the contents of an original gas .csv file, fed with the chunks of the file as they
+    are read, e.g. as a consumer of copy_file_chunked, so that validating costs no extra read.
+
+    A valid file has a header row of two columns, the first one being "aar", followed by one row per year
+    from first_year to last_year, each with an integer year and a numeric value.
+
+    Parameters:
+        - max_errors (int) : Maximum number of errors recorded, default to ten
+        - first_year (int) : First year the file must report, default to FIRST_YEAR
+        - last_year (int) : Last year the file must report, default to LAST_YEAR
+    """
+
+    def __init__(self, max_errors: int = 10, first_year: int = FIRST_YEAR, last_year: int = LAST_YEAR) -> None:
+        self.max_errors = max_errors
+        self.first_year = first_year
+        self.last_year = last_year
+        self.errors: list[str] = []
+        self._years: set[int] = set()
+        self._line_number = 0
+        self._rest = b""
+        self._finished = False
+
+    def _error(self, message: str) -> None:
+        if len(self.errors) < self.max_errors:
+            self.errors.append(message)
+
+    def _check_line(self, line: bytes) -> None:
+        self._line_number += 1
+        text = line.decode("utf-8", errors="replace").rstrip("\r")
+        if self._line_number == 1:
+            header = next(csv.reader([text]), [])
+            if len(header) != 2 or header[0].strip().lstrip("\ufeff") != "aar":
+                self._error(f"line 1: expected a header with the columns aar and the emission, but got {text!r}")
+            return
+        if not text.strip():
+            return
+        fields = text.split(",")
+        if len(fields) != 2:
+            self._error(f"line {self._line_number}: expected 2 columns, but got {len(fields)}")
+            return
+        try:
+            year = int(fields[0])
+        except ValueError:
+            self._error(f"line {self._line_number}: year {fields[0]!r} is not an integer")
+            return
+        try:
+            float(fields[1])
+        except ValueError:
+            self._error(f"line {self._line_number}: value {fields[1]!r} is not numeric")
+        if not self.first_year <= year <= self.last_year:
+            self._error(f"line {self._line_number}: year {year} is outside {self.first_year}-{self.last_year}")
+        elif year in self._years:
+            self._error(f"line {self._line_number}: year {year} appears more than once")
+        self._years.add(year)
+
+    def update(self, chunk: bytes) -> None:
+        """Validate the complete lines of chunk, keeping an incomplete last line for the next chunk"""
+        lines = (self._rest + chunk).split(b"\n")
+        self._rest = lines.pop()
+        for line in lines:
+            self._check_line(line)
+
+    def finish(self) -> list[str]:
+        """Validate what is left after the last chunk and return the errors found, an empty list for a valid file"""
+        if not self._finished:
+            self._finished = True
+            if self._rest:
+                self._check_line(self._rest)
+            if self._line_number == 0:
+                self._error("the file is empty")
+            missing = sorted(set(range(self.first_year, self.last_year + 1)) - self._years)
+            if missing and self._line_number > 0:
+                shown = ", ".join(str(year) for year in missing[:5]) + (", ..." if len(missing) > 5 else "")
+                self._error(f"{len(missing)} missing years: {shown}")
+        return self.errors
+
+
+def validate_gas_csv(path: str | Path) -> list[str]:
+    """Validate the contents of the original gas .csv file pointed to by path, see GasCsvValidator.
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the file to validate, decompressed while it is read if it is compressed
+
+    Returns:
+        - (List[str]) : The errors found, an empty list for a valid file
+    """
+    validator = GasCsvValidator()
+    io_throttle.file()
+    with open_csv(path) as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            io_throttle.update(chunk)
+            validator.update(chunk)
+    return validator.finish()
+
+
+# The steps below are shared by every restructuring: of a pollution_data directory (analyze_pollution_data),
+# of an archive (analytic_tools.archive) and on a file system backend (analytic_tools.fs)
+
+
+def new_restructure_report(store: bool = False, validate: bool = False) -> dict:
+    """The report of a restructuring before any file is copied, see restructure_pollution_data
+
+    Parameters:
+        - store (bool) : If True, the copies are deduplicated in a content-addressed store, and the keys
+                         stored, bytes stored and bytes saved are added
+        - validate (bool) : If True, the copies are validated, and the keys invalid and errors are added
+
+    Returns:
+        - (dict) : The report, with keys copied and skipped and the keys above
+    """
+    res = {"copied": 0, "skipped": 0}
+    if store:
+        res.update({"stored": 0, "bytes stored": 0, "bytes saved": 0})
+    if validate:
+        res.update({"invalid": 0, "errors": {}})
+    return res
+
+
+def add_copy_outcome(res: dict, key: str, errors: list[str], size: int = 0, is_new: bool = True) -> None:
+    """Add the outcome of the copy of one gas .csv file to res, see new_restructure_report
+
+    Parameters:
+        - res (dict) : The report of the restructuring
+        - key (str) : The name of the file in the report of its errors, e.g. its path relative to pollution_data
+        - errors (List[str]) : The errors found by validating the copy, which was then left out
+        - size (int) : Size of the stored file, with a content-addressed store
+        - is_new (bool) : With a content-addressed store, False if the contents were stored already
+    """
+    if errors:
+        res["invalid"] += 1
+        res["errors"][key] = errors
+        return
+    res["copied"] += 1
+    if "stored" in res:
+        if is_new:
+            res["stored"] += 1
+            res["bytes stored"] += size
+        else:
+            res["bytes saved"] += size
+
+
+def is_restructured_source(parts: tuple[str, ...] | list[str], selection: Selection | None = None) -> bool:
+    """Check if the file whose path has the components parts (relative to pollution_data) is a gas .csv file
+       to restructure: an original gas .csv file (see is_gas_csv) in a subdirectory, with its gas and source selected"""
+    name = parts[-1]
+    if len(parts) < 2 or not is_csv_name(name) or not is_gas_csv(name):
+        return False
+    if selection is None:
+        return True
+    source = parts[-2]
+    return selection.match_gas(gas_formula(name)) and (not source.startswith("src_") or selection.match_source(source))
+
+
+def copy_is_up_to_date(src_mtime: float, src_size: int, dest_mtime: float, dest_size: int, same_size: bool) -> bool:
+    """Check if an existing copy (dest) is at least as new as its source, and of the same size if same_size, for incremental runs"""
+    return dest_mtime >= src_mtime and (not same_size or dest_size == src_size)
+
+
+def copy_checks(validate: bool = False, years: tuple[int, int] | None = None) -> tuple[list, YearFilter | None]:
+    """The consumers validating the copy of a gas .csv file and the transform filtering its years.
+       The copy of a selected range of years is validated against that range.
+
+    Parameters:
+        - validate (bool) : If True, a GasCsvValidator is among the consumers, first
+        - years (tuple[int, int] or None) : First and last year of the rows to keep, default to all rows
+
+    Returns:
+        - (List) : The consumers, see copy_file_chunked
+        - (YearFilter or None) : The transform, see copy_file_chunked
+    """
+    consumers = []
+    if validate:
+        first, last = (FIRST_YEAR, LAST_YEAR) if years is None else years
+        consumers.append(GasCsvValidator(first_year=max(first, FIRST_YEAR), last_year=min(last, LAST_YEAR)))
+    return consumers, YearFilter(*years) if years is not None else None
+
+
+def copy_gas_stream(
+    src_file, dest, validate: bool = False, years: tuple[int, int] | None = None, compression: str = ""
+) -> list[str]:
+    """Copy the decompressed contents of a gas .csv file to dest, validating them and filtering their years on the way.
+
+    Parameters:
+        - src_file (BinaryIO) : The decompressed contents, see open_csv
+        - dest (str, pathlib.Path or BinaryIO) : Path to the copy, or a binary file object to write to, see copy_stream_chunked
+        - validate (bool) : If True, validate the contents, see copy_checks
+        - years (tuple[int, int] or None) : First and last year of the rows to copy, default to all rows
+        - compression (str) : Compression of the copy, see copy_stream_chunked
+
+    Returns:
+        - (List[str]) : The errors found by validating the contents, an empty list if valid or not validated
+    """
+    consumers, transform = copy_checks(validate, years)
+    copy_stream_chunked(src_file, dest, consumers, transform=transform, compression=compression)
+    return consumers[0].finish() if validate else []
+
+
+def store_file(
+    src: str | Path,
+    store_dir: str | Path,
+    algorithm: str = "blake2b",
+    consumers: list = (),
+    transform: YearFilter | None = None,
+    compression: str | None = None,
+) -> tuple[Path, bool]:
+    """Add the file pointed to by src to the content-addressed store in store_dir, where every distinct
+       content is stored once as [digest[:2]]/[digest][suffix]. The file is hashed while it is copied into the store.
+       The digest of a compressed file is that of its decompressed contents, see copy_file_chunked.
+
+    Parameters:
+        - src (str or pathlib.Path) : Path to the file to store
+        - store_dir (str or pathlib.Path) : Path to the root directory of the store
+        - algorithm (str) : Name of the algorithm used to address the contents, see new_hasher, default to blake2b
+        - consumers (List) : Further objects with an update(bytes) method the chunks are passed to, see copy_file_chunked
+        - transform (YearFilter or None) : Transform of the contents before they are hashed and stored, see copy_file_chunked
+        - compression (str or None) : Compression of the stored file, see copy_file_chunked, default to the compression of src
+
+    Returns:
+        - (pathlib.Path) : Path to the stored file
+        - (bool) : True if the contents were new to the store, False if they were stored already
+    """
+    src = Path(src)
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    csv_name, src_compression = split_compression(src.name)
+    compression = src_compression if compression is None else compression
+
+    hasher = new_hasher(algorithm)
+    fd, tmp_name = tempfile.mkstemp(dir=store_dir, prefix=".tmp_")
+    os.close(fd)
+    try:
+        copy_file_chunked(src, tmp_name, [hasher, *consumers], transform=transform, compression=compression)
+        digest = hasher.hexdigest()
+        stored = store_dir / digest[:2] / (digest + Path(csv_name).suffix + compression)
+        stored.parent.mkdir(exist_ok=True)
+        try:
+            # os.link fails if the contents were stored already, also when racing another process
+            os.link(tmp_name, stored)
+            return stored, True
+        except FileExistsError:
+            return stored, False
+    finally:
+        os.unlink(tmp_name)
+
+
+def link_file(target: str | Path, link_path: str | Path) -> None:
+    """Make link_path a hard link to target, or a symbolic link if hard links are not possible
+       (e.g. across file systems). An existing file at link_path is replaced.
+
+    Parameters:
+        - target (str or pathlib.Path) : Path to the existing file
+        - link_path (str or pathlib.Path) : Path to the link to create
+
+    Returns:
+    None
+    """
+    target = Path(target)
+    link_path = Path(link_path)
+    try:
+        if os.path.samefile(target, link_path):
+            # Already linked, and renaming a link over another link to the same file would leave both in place
+            return
+    except FileNotFoundError:
+        pass
+    tmp_path = temporary_path(link_path)
+    try:
+        os.link(target, tmp_path)
+    except OSError:
+        os.symlink(target.absolute(), tmp_path)
+    os.replace(tmp_path, link_path)
+
+
+# Directory of a content-addressed store holding a record of every link made to it, see record_link
+STORE_LINKS_NAME = "links"
+
+
+def _link_record_path(store_dir: Path, link_path: Path) -> Path:
+    key = hashlib.blake2b(os.fsencode(os.path.abspath(link_path)), digest_size=16).hexdigest()
+    return store_dir / STORE_LINKS_NAME / key[:2] / f"{key}.json"
+
+
+def record_link(store_dir: str | Path, link_path: str | Path, stored: str | Path, source: dict) -> None:
+    """Record which source the link at link_path to the stored file stored was made from. A link has the modification
+       time of the stored contents, which may come from another source, so incremental runs compare the record instead,
+       see is_link_up_to_date. The record is kept in the store, under STORE_LINKS_NAME, and written atomically.
+
+    Parameters:
+        - store_dir (str or pathlib.Path) : Path to the root directory of the store
+        - link_path (str or pathlib.Path) : Path to the link, see link_file
+        - stored (str or pathlib.Path) : Path to the stored file, as returned by store_file
+        - source (dict) : Description of the source and of how it was copied, e.g. its path, size, modification time,
+                          range of years and compression. Any JSON serializable dict
+
+    Returns:
+    None
+    """
+    store_dir = Path(store_dir)
+    record_path = _link_record_path(store_dir, Path(link_path))
+    record_path.parent.mkdir(parents=True, exist_ok=True)
+    record = {"source": source, "stored": Path(stored).relative_to(store_dir).as_posix()}
+    with atomic_write(record_path, "w") as file:
+        file.write(json.dumps(record))
+
+
+def is_link_up_to_date(store_dir: str | Path, link_path: str | Path, source: dict) -> bool:
+    """Check whether the link at link_path was made from source (see record_link) and still links to the stored file
+
+    Parameters:
+        - store_dir (str or pathlib.Path) : Path to the root directory of the store
+        - link_path (str or pathlib.Path) : Path to the link, see link_file
+        - source (dict) : Description of the source, as given to record_link
+
+    Returns:
+        - (bool) : Truth value of whether the link can be kept instead of storing the source again
+    """
+    store_dir = Path(store_dir)
+    try:
+        record = json.loads(_link_record_path(store_dir, Path(link_path)).read_text())
+        # The link may have been replaced since, e.g. by a copy made without the store
+        return record["source"] == source and os.path.samefile(store_dir / record["stored"], link_path)
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+
+def temporary_path(path: str | Path) -> Path:
+    """Path to a hidden temporary sibling of path, unique to the calling process and thread, to write path in
+       before renaming it, so that concurrent runs never see a partial file nor write to the same temporary file"""
+    path = Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+@contextlib.contextmanager
+def atomic_write(path: str | Path, mode: str = "wb"):
+    """Open a temporary file (see temporary_path) that replaces the file at path once the block completes,
+       and is removed if the block fails, so that path holds either its previous or its new contents
+
+    Parameters:
+        - path (str or pathlib.Path) : Path to the file to write
+        - mode (str) : Mode the temporary file is opened with, default to wb
+
+    Returns:
+        - (file object) : The open temporary file
+    """
+    tmp_path = temporary_path(path)
+    try:
+        with open(tmp_path, mode) as file:
+            yield file
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            tmp_path.unlink()
+        raise
+
+
 def delete_directories(path_list: list[str | Path]) -> None:
     """Prompt the user for permission and delete the objects pointed to by the paths in path_list if
        permission is given. If the object is a directory, its whole directory tree is removed.
@@ -0,0 +1,129 @@
+"""Module containing the integrity verification of pollution_data_restructured/by_gas against pollution_data.
+
+Every gas .csv file of pollution_data is paired with its expected copy by_gas/gas_[gas_formula]/src_[source]_[gas_formula].csv,
+and the two are hashed in parallel, in chunks. Compressed files are compared by their decompressed contents. The outcome is kept in a manifest, so that a later verification only
+hashes the pairs where either file changed size or modification time.
+"""
+from __future__ import annotations
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import analytic_tools.utilities as ut
+
+MANIFEST_NAME = "verify_manifest.json"
+
+
+def _stat_key(path: Path) -> list[int] | None:
+    """Size and modification time of path, or None if it does not exist"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _compare(src: Path, dest: Path, algorithm: str) -> str | None:
+    """Hash the decompressed contents of src and dest and return the digest of dest if they are equal, otherwise None"""
+    compressed = ut.split_compression(src.name)[1] or ut.split_compression(dest.name)[1]
+    if not compressed and src.stat().st_size != dest.stat().st_size:
+        return None
+    dest_digest = ut.hash_file(dest, algorithm, decompress=True)
+    return dest_digest if ut.hash_file(src, algorithm, decompress=True) == dest_digest else None
+
+
+def verify_restructured(
+    pollution_dir: str | Path,
+    by_gas_dir: str | Path,
+    workers: int = 4,
+    manifest_path: str | Path | None = None,
+    algorithm: str = "blake2b",
+) -> dict:
+    """Check that every gas .csv file in pollution_dir has an identical copy in by_gas_dir, as made by restructure_pollution_data.
+
+    Parameters:
+        - pollution_dir (str or pathlib.Path) : Absolute path to the pollution_data directory
+        - by_gas_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/by_gas directory
+        - workers (int) : Number of files hashed in parallel, default to four
+        - manifest_path (str, pathlib.Path or None) : Path to the manifest of the previous verification, which is
+                                     updated afterwards. Default to verify_manifest.json next to by_gas_dir
+        - algorithm (str) : Name of the hash algorithm, see utilities.new_hasher (e.g. xxh64 if xxhash is installed)
+
+    Returns:
+        - (dict) : The report, with keys:
+                   checked (number of pairs hashed), reused (number of pairs whose result was taken from the manifest),
+                   mismatched (copies whose contents differ from their source), missing (copies that do not exist)
+                   and unexpected (files in by_gas_dir without a source). The last three are lists of paths relative to by_gas_dir
+    """
+    if not isinstance(pollution_dir, (str, Path)):
+        raise TypeError(f"pollution_dir is of type {type(pollution_dir)}, expected str or Path")
+    if not isinstance(by_gas_dir, (str, Path)):
+        raise TypeError(f"by_gas_dir is of type {type(by_gas_dir)}, expected str or Path")
+
+    pollution_dir = Path(pollution_dir)
+    by_gas_dir = Path(by_gas_dir)
+
+    if not pollution_dir.is_dir():
+        raise NotADirectoryError(f"{pollution_dir} is not a directory")
+    if not by_gas_dir.is_dir():
+        raise NotADirectoryError(f"{by_gas_dir} is not a directory")
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, but got {workers}")
+
+    manifest_path = Path(manifest_path) if manifest_path is not None else by_gas_dir.parent / MANIFEST_NAME
+    try:
+        previous = json.loads(manifest_path.read_text())
+    except (FileNotFoundError, ValueError):
+        previous = {}
+    if previous.get("algorithm") != algorithm:
+        previous = {}
+    previous_entries = previous.get("entries", {})
+
+    report = {"checked": 0, "reused": 0, "mismatched": [], "missing": [], "unexpected": []}
+    entries = {}
+    to_hash = []
+
+    for src in ut.find_gas_csv_files(pollution_dir):
+        dest = by_gas_dir / f"gas_{ut.gas_formula(src)}" / ut.restructured_name(src)
+        if not dest.exists() and ut.split_compression(src.name)[1]:
+            # Restructured with keep_compressed
+            dest = dest.with_name(ut.restructured_name(src, keep_compressed=True))
+        rel = dest.relative_to(by_gas_dir).as_posix()
+        entry = {"src": str(src), "src_stat": _stat_key(src), "dest_stat": _stat_key(dest)}
+        if entry["dest_stat"] is None:
+            report["missing"].append(rel)
+            continue
+        old = previous_entries.get(rel)
+        if old is not None and all(old.get(key) == entry[key] for key in ("src", "src_stat", "dest_stat")):
+            # Neither file changed since the last verification
+            entries[rel] = old
+            report["reused"] += 1
+        else:
+            entries[rel] = entry
+            to_hash.append((rel, src, dest))
+
+    # Chunked hashing keeps the memory use at about workers * CHUNK_SIZE, however large the files are
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(lambda item: _compare(item[1], item[2], algorithm), to_hash)
+        for (rel, _, _), digest in zip(to_hash, digests):
+            entries[rel]["digest"] = digest
+            report["checked"] += 1
+
+    report["mismatched"] = sorted(rel for rel, entry in entries.items() if entry["digest"] is None)
+
+    expected = set(entries) | set(report["missing"])
+    for gas_dir in by_gas_dir.iterdir():
+        if gas_dir.is_dir():
+            for file in gas_dir.iterdir():
+                rel = file.relative_to(by_gas_dir).as_posix()
+                if ut.is_csv_name(file.name) and rel not in expected:
+                    report["unexpected"].append(rel)
+    report["missing"].sort()
+    report["unexpected"].sort()
+
+    # Written atomically, so that an interrupted verification never leaves a corrupt manifest behind
+    with ut.atomic_write(manifest_path, "w") as file:
+        file.write(json.dumps({"algorithm": algorithm, "entries": entries}, indent=1))
+
+    return report
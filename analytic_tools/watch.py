@@ -0,0 +1,310 @@
+"""Module containing the watch mode, which keeps pollution_data_restructured up to date while new
+files are dropped into pollution_data/by_src/src_* directories.
+
+Changes are picked up with inotify on Linux and by periodically polling the src_* directories elsewhere.
+Only the files and gases touched by a change are copied and plotted again, instead of rebuilding the whole tree.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+import analytic_tools.utilities as ut
+import analytic_tools.plotting as plot
+from analytic_tools.analysis import write_gas_summary
+
+# inotify event flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _is_watched_csv(path: Path) -> bool:
+    """Check if path is an original gas .csv file inside a src_* directory"""
+    return path.parent.name.startswith("src_") and ut.is_csv_name(path.name) and ut.is_gas_csv(path)
+
+
+def _scan(by_src_dir: Path) -> dict[Path, tuple[int, int]]:
+    """The size and modification time of every gas .csv file of the src_* directories under by_src_dir"""
+    state = {}
+    with os.scandir(by_src_dir) as src_dirs:
+        for src_dir in src_dirs:
+            if not (src_dir.is_dir() and src_dir.name.startswith("src_")):
+                continue
+            with os.scandir(src_dir.path) as files:
+                for file in files:
+                    path = Path(file.path)
+                    if file.is_file() and _is_watched_csv(path):
+                        stat = file.stat()
+                        state[path] = (stat.st_size, stat.st_mtime_ns)
+    return state
+
+
+def _changes(old: dict[Path, tuple[int, int]], new: dict[Path, tuple[int, int]]) -> set[Path]:
+    """The files created, modified or deleted between two scans"""
+    return {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
+
+class PollingWatcher:
+    """Detect changes to the gas .csv files of the src_* directories under by_src_dir by comparing
+    the size and modification time of the files between two calls to poll.
+
+    Parameters:
+        - by_src_dir (str or pathlib.Path) : Absolute path to the pollution_data/by_src directory
+        - interval (float) : Number of seconds to sleep between two scans
+    """
+
+    def __init__(self, by_src_dir: str | Path, interval: float = 1.0) -> None:
+        self.by_src_dir = Path(by_src_dir)
+        self.interval = interval
+        self._state = _scan(self.by_src_dir)
+
+    def poll(self, timeout: float | None = None) -> set[Path]:
+        """Wait for at most timeout seconds (default to interval) and return the gas .csv files that were
+        created, modified or deleted since the last call"""
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        state = _scan(self.by_src_dir)
+        changed = _changes(self._state, state)
+        self._state = state
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Detect changes to the gas .csv files of the src_* directories under by_src_dir with inotify.
+    New src_* directories are watched as soon as they are created. When the kernel drops events because its
+    queue overflowed, the directories are scanned again, and the files that changed since they were last reported are reported.
+
+    Parameters:
+        - by_src_dir (str or pathlib.Path) : Absolute path to the pollution_data/by_src directory
+
+    Raises:
+        - OSError : If inotify is not available on this platform
+    """
+
+    def __init__(self, by_src_dir: str | Path) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.by_src_dir = Path(by_src_dir)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: dict[int, Path] = {}
+        self._pending: set[Path] = set()
+        self._add_watch(self.by_src_dir)
+        self._watch_src_dirs()
+        self._state = _scan(self.by_src_dir)
+
+    def _watch_src_dirs(self) -> None:
+        # Watching a directory again only returns its watch descriptor
+        for src_dir in self.by_src_dir.iterdir():
+            if src_dir.is_dir() and src_dir.name.startswith("src_"):
+                self._add_watch(src_dir)
+
+    def _rescan(self) -> None:
+        # Events were lost, so the changes not reported yet are found by scanning again, and the source
+        # directories created in the meantime are watched
+        self._watch_src_dirs()
+        state = _scan(self.by_src_dir)
+        self._pending |= _changes(self._state, state)
+        self._state = state
+
+    def _add_watch(self, dir: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {dir}")
+        self._watches[wd] = dir
+
+    def _read_events(self) -> None:
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd: int, mask: int, name: bytes) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self._rescan()
+            return
+        parent = self._watches.get(wd)
+        if parent is None or not name:
+            return
+        path = parent / os.fsdecode(name)
+        if mask & IN_ISDIR:
+            if parent == self.by_src_dir and path.name.startswith("src_") and mask & (IN_CREATE | IN_MOVED_TO):
+                # A new source directory, which may already contain files by the time it is watched
+                self._add_watch(path)
+                self._pending.update(p for p in path.iterdir() if _is_watched_csv(p))
+        elif _is_watched_csv(path):
+            self._pending.add(path)
+
+    def poll(self, timeout: float | None = None) -> set[Path]:
+        """Wait for at most timeout seconds for events, and return the gas .csv files that were
+        created, modified or deleted since the last call"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            self._read_events()
+        changed, self._pending = self._pending, set()
+        # The scan is kept up to date with the changes reported, so that an overflow only reports the ones after them
+        for path in changed:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                self._state.pop(path, None)
+            else:
+                self._state[path] = (stat.st_size, stat.st_mtime_ns)
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def apply_changes(changed: set[Path] | list[Path], by_gas_dir: str | Path, fig_dir: str | Path) -> list[str]:
+    """Bring by_gas_dir and fig_dir up to date with the gas .csv files in changed.
+       Files that still exist are copied to their gas_[gas_formula] directory, files that were deleted
+       have their copy removed, and the summary and plot of every affected gas are created again.
+
+    Parameters:
+        - changed (Set[pathlib.Path]) : Absolute paths to the gas .csv files that were created, modified or deleted
+        - by_gas_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/by_gas directory
+        - fig_dir (str or pathlib.Path) : Absolute path to the pollution_data_restructured/figures directory
+
+    Returns:
+        - (List[str]) : Names of the gas_[gas_formula] directories that were updated
+    """
+    by_gas_dir = Path(by_gas_dir)
+    fig_dir = Path(fig_dir)
+
+    gas_dirs = set()
+    for path in changed:
+        path = Path(path)
+        gas_dir = by_gas_dir / f"gas_{ut.gas_formula(path)}"
+        dest_file_path = gas_dir / ut.restructured_name(path)
+        # The copy is made of the preferred variant of the file, whichever variant changed, see utilities.preferred_variants
+        path = ut.existing_variant(path)
+        if path is not None:
+            gas_dir.mkdir(parents=True, exist_ok=True)
+            # Renamed over the old copy once complete, so that readers never see it missing or partial,
+            # and a link into a content-addressed store is replaced instead of written through
+            tmp_path = ut.temporary_path(dest_file_path)
+            try:
+                if ut.split_compression(path.name)[1]:
+                    ut.copy_file_chunked(path, tmp_path, compression="")
+                else:
+                    shutil.copy2(path, tmp_path)
+                os.replace(tmp_path, dest_file_path)
+            except BaseException:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+                raise
+        if gas_dir.is_dir():
+            # The copy of a deleted file goes, and so do the copies of other variants, e.g. kept compressed by an earlier run
+            for name in os.listdir(gas_dir):
+                if ut.split_compression(name)[0] == dest_file_path.name and (path is None or name != dest_file_path.name):
+                    (gas_dir / name).unlink()
+        gas_dirs.add(gas_dir)
+
+    for gas_dir in gas_dirs:
+        figpath = fig_dir / (gas_dir.name + ".png")
+        if gas_dir.is_dir() and any(ut.is_csv_name(file.name) for file in gas_dir.iterdir()):
+            write_gas_summary(gas_dir)
+            plot.create_plot(gas_dir, fig_dir)
+        else:
+            # The last file of this gas was removed
+            if gas_dir.is_dir():
+                shutil.rmtree(gas_dir)
+            if figpath.exists():
+                figpath.unlink()
+
+    return sorted(gas_dir.name for gas_dir in gas_dirs)
+
+
+def watch_pollution_data(
+    work_dir: str | Path,
+    debounce: float = 1.0,
+    interval: float = 1.0,
+    polling: bool = False,
+    on_update: Callable[[list[str]], None] | None = None,
+    stop: threading.Event | None = None,
+) -> None:
+    """Watch work_dir/pollution_data/by_src and keep work_dir/pollution_data_restructured up to date until stop is set.
+       Changes are collected until no new change has arrived for debounce seconds, and are then applied with apply_changes.
+       The restructured directories are expected to have been created already, e.g. by analyze_pollution_data.
+
+    Parameters:
+        - work_dir (str or pathlib.Path) : Absolute path to the working directory containing pollution_data and pollution_data_restructured
+        - debounce (float) : Number of quiet seconds to wait for before applying the collected changes
+        - interval (float) : Number of seconds between two scans when polling
+        - polling (bool) : If True, always poll instead of using inotify
+        - on_update (Callable or None) : Called with the names of the updated gas directories after each batch of changes
+        - stop (threading.Event or None) : Event that ends the watch when set, default to watching forever
+
+    Returns:
+    None
+    """
+    if not isinstance(work_dir, (str, Path)):
+        raise TypeError(f"work_dir is of type {type(work_dir)}, expected str or Path")
+
+    work_dir = Path(work_dir)
+    by_src_dir = work_dir / "pollution_data" / "by_src"
+    by_gas_dir = work_dir / "pollution_data_restructured" / "by_gas"
+    fig_dir = work_dir / "pollution_data_restructured" / "figures"
+
+    for dir in (by_src_dir, by_gas_dir, fig_dir):
+        if not dir.is_dir():
+            raise NotADirectoryError(f"{dir} is not a directory")
+
+    stop = stop or threading.Event()
+
+    watcher: InotifyWatcher | PollingWatcher
+    try:
+        if polling:
+            raise OSError("polling requested")
+        watcher = InotifyWatcher(by_src_dir)
+    except OSError:
+        watcher = PollingWatcher(by_src_dir, interval)
+
+    pending: set[Path] = set()
+    last_change = 0.0
+    try:
+        while not stop.is_set():
+            changed = watcher.poll(timeout=min(debounce, interval) if pending else interval)
+            now = time.monotonic()
+            if changed:
+                pending |= changed
+                last_change = now
+            elif pending and now - last_change >= debounce:
+                updated = apply_changes(pending, by_gas_dir, fig_dir)
+                pending = set()
+                if on_update is not None:
+                    on_update(updated)
+    finally:
+        watcher.close()
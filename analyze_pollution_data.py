@@ -4,23 +4,104 @@
 from __future__ import annotations
 
 # Import necessary packages here
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path, PurePosixPath
 import analytic_tools.utilities as ut
 import analytic_tools.plotting as plot
+from analytic_tools.analysis import fit_pollution_trends, load_files_series, summarize_gas, summarize_pollution_data
+from analytic_tools.archive import ARCHIVE_SUFFIXES, ArchiveSink, is_archive, restructure_archive
+from analytic_tools.fs import FileSystem, restructure_filesystem
+from analytic_tools.locking import LOCK_POLICIES, WorkDirLocks
+from analytic_tools.progress import LogRenderer, TtyRenderer, progress, report_progress
+from analytic_tools.shard import SHARDS_DIR_NAME, Shard, ShardCoordinator, parse_shard, source_key
+from analytic_tools.throttle import io_throttle, lower_priority, parse_rate, set_io_limits
+import argparse
+import contextlib
+import glob
+import json
+import os
 import shutil
+import sys
+import time
+import traceback
 
-def restructure_pollution_data(pollution_dir: str | Path, dest_dir: str | Path) -> None:
+# Name of the report with the errors found by validating the gas .csv files, written to pollution_data_restructured
+VALIDATION_REPORT_NAME = "validation_report.json"
+
+# Name of the file with the trends of every series written by the trends command, in pollution_data_restructured
+TRENDS_NAME = "trends.json"
+
+
+def find_pollution_data(work_dir: Path) -> Path:
+    """Path to the pollution_data directory of work_dir or, if there is none, to a pollution_data archive
+       (e.g. pollution_data.tar.gz or pollution_data.zip) in work_dir. Default to work_dir/pollution_data if neither exists
+    """
+    pollution_dir = work_dir / "pollution_data"
+    if not pollution_dir.is_dir():
+        for suffix in ARCHIVE_SUFFIXES:
+            archive = work_dir / f"pollution_data{suffix}"
+            if archive.is_file():
+                return archive
+    return pollution_dir
+
+
+def restructure_pollution_data(
+    pollution_dir: str | Path,
+    dest_dir: str | Path,
+    workers: int = 1,
+    incremental: bool = False,
+    store_dir: str | Path | None = None,
+    validate: bool = False,
+    selection: ut.Selection | None = None,
+    policy: ut.TraversalPolicy | None = None,
+    sink: ArchiveSink | None = None,
+    keep_compressed: bool = False,
+    fs: FileSystem | None = None,
+    shard: Shard | None = None,
+) -> dict:
     """This function searches the tree of pollution_data directory pointed to by pollution_dir for .csv files
         that satisfy the criteria described in the assignment. It then moves a renamed copy of these files to gas-specific
         sub-directories in dest_dir, which will be created based on the gasses present in pollution_data directory.
 
     Parameters:
-        - pollution_dir (str or pathlib.Path) : The absolute path to pollution_data directory
+        - pollution_dir (str or pathlib.Path) : The absolute path to pollution_data directory, or to a .zip or .tar[.gz|.bz2|.xz]
+                                     archive of it, whose gas .csv members are then streamed into dest_dir without extracting the rest
         - dest_dir (str or pathlib.Path) : The absolute path to new directory where gas-specific subdirectories will
                                      be created, which must be pollution_data_restructured/by_gas
+        - workers (int) : Number of threads used to copy the files, default to one. Archives are always read by one thread
+        - incremental (bool) : If True, files whose copy already exists with the same size and modification time are not copied again
+        - store_dir (str, pathlib.Path or None) : If given, the path to a content-addressed store (see utilities.store_file).
+                                     Every distinct content is then stored once in store_dir, and the files in dest_dir are links to it.
+                                     Links have the time of the stored contents, so incremental runs compare the record of the
+                                     source each link was made from instead, see utilities.record_link
+        - validate (bool) : If True, the contents of every file are validated while it is copied (see utilities.GasCsvValidator),
+                                     and invalid files are reported and left out of dest_dir
+        - selection (utilities.Selection or None) : The gases, sources and years to restructure, default to all of them.
+                                     With a range of years, only the rows of those years are copied. Note that incremental
+                                     runs do not notice a change of the range, since the copies keep the time of their source
+        - policy (utilities.TraversalPolicy or None) : The subtrees of pollution_dir that are not searched, see utilities.walk.
+                                     Default to leaving out the directories in utilities.DEFAULT_IGNORE
+        - sink (ArchiveSink or None) : If given, the copies are written as members of this archive instead of as files,
+                                     and dest_dir is the directory inside the archive they are written to (e.g. by_gas).
+                                     Every member is written anew, so incremental has no effect, and store_dir cannot be used
+        - keep_compressed (bool) : Compressed gas files (.csv.gz or .csv.zst, see utilities.COMPRESSED_SUFFIXES) are decompressed
+                                     in chunks while they are copied, into plain .csv copies. If True, the copies keep
+                                     their compression instead, e.g. src_[source]_[gas_formula].csv.gz.
+                                     Of a file stored both plain and compressed, only one variant is copied (see
+                                     utilities.preferred_variants), and the copies of the other variants are removed
+        - fs (analytic_tools.fs.FileSystem or None) : If given, pollution_dir and dest_dir are "/"-separated paths in this
+                                     file system (e.g. an object store), and the files are copied with it, see
+                                     analytic_tools.fs.restructure_filesystem. store_dir and sink cannot be used then
+        - shard (analytic_tools.shard.Shard or None) : If given, only the src_[source] directories of this shard are restructured,
+                                     so that several processes or hosts can share the work, see analytic_tools.shard.
+                                     Only pollution_data directories can be sharded, not archives, sinks or file system backends
 
     Returns:
-    None
+        - (dict) : Number of files copied and skipped, with keys: copied, skipped.
+                   With a store_dir, the deduplication report is added with keys: stored (new distinct contents),
+                   bytes stored (size of the new contents) and bytes saved (size of the copies that were linked instead).
+                   With validate, the keys invalid (number of invalid files) and errors are added, where errors
+                   maps the path of each invalid file, relative to pollution_dir, to the list of errors found in it
 
     Pseudocode:
     1. Iterate through the contents of `pollution_dir`
@@ -38,44 +119,242 @@ def restructure_pollution_data(pollution_dir: str | Path, dest_dir: str | Path)
     if not isinstance(dest_dir, (str, Path)):
         raise TypeError(f"dest_dir is of type {type(dest_dir)}, expected str or Path")
 
+    if shard is not None and not isinstance(shard, Shard):
+        raise TypeError(f"shard is of type {type(shard)}, expected Shard")
+    if shard is not None and (fs is not None or sink is not None):
+        raise ValueError("shard cannot be used together with a file system backend or an archive sink")
+
+    if fs is not None:
+        if store_dir is not None or sink is not None:
+            raise ValueError("store_dir and sink cannot be used together with a file system backend")
+        return restructure_filesystem(
+            fs,
+            PurePosixPath(pollution_dir).as_posix(),
+            PurePosixPath(dest_dir).as_posix(),
+            workers=workers,
+            incremental=incremental,
+            validate=validate,
+            selection=selection,
+            policy=policy,
+            keep_compressed=keep_compressed,
+        )
+
     pollution_dir = Path(pollution_dir)
-    dest_dir = Path(dest_dir)
+    dest_dir = Path(dest_dir) if sink is None else PurePosixPath(dest_dir)
 
     if not pollution_dir.exists():
         raise NotADirectoryError(f"pollution_dir does not exist")
-    if not pollution_dir.is_dir():
+    if not pollution_dir.is_dir() and not is_archive(pollution_dir):
         raise NotADirectoryError(f"pollution_dir is not a dir")
-    if not dest_dir.exists():
+    if sink is None and not dest_dir.exists():
         raise NotADirectoryError(f"dest_dir does not exist")
-    if not dest_dir.is_dir():
+    if sink is None and not dest_dir.is_dir():
         raise NotADirectoryError(f"dest_dir is not a dir")
+    if sink is not None and store_dir is not None:
+        raise ValueError("store_dir cannot be used together with an archive sink")
+    if not isinstance(workers, int) or isinstance(workers, bool):
+        raise TypeError(f"workers is of type {type(workers)}, expected int")
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, but got {workers}")
+    if store_dir is not None and not isinstance(store_dir, (str, Path)):
+        raise TypeError(f"store_dir is of type {type(store_dir)}, expected str or Path")
+    if selection is not None and not isinstance(selection, ut.Selection):
+        raise TypeError(f"selection is of type {type(selection)}, expected Selection")
+    if policy is not None and not isinstance(policy, ut.TraversalPolicy):
+        raise TypeError(f"policy is of type {type(policy)}, expected TraversalPolicy")
+
+    if is_archive(pollution_dir):
+        if shard is not None:
+            raise ValueError("archives are read as one stream and cannot be sharded, extract them first")
+        # The members of an archive are read one after the other, as a stream
+        return restructure_archive(
+            pollution_dir,
+            dest_dir,
+            incremental=incremental,
+            store_dir=store_dir,
+            validate=validate,
+            selection=selection,
+            policy=policy,
+            sink=sink,
+            keep_compressed=keep_compressed,
+        )
+
+    years = selection.years if selection is not None else None
+    res = ut.new_restructure_report(store=store_dir is not None, validate=validate)
 
-    # Contents of pollution_data tree
-    contents = [file for file in pollution_dir.rglob("*.csv")]
+    # Gas .csv files in the pollution_data tree
+    progress.stage("scan")
+    contents = ut.find_gas_csv_files(pollution_dir, selection, policy)
+    if shard is not None:
+        # Every file of a src_[source] directory belongs to the same shard
+        contents = [path for path in contents if shard.owns(source_key(path, pollution_dir))]
 
+    def stored_source(path: Path, compression: str) -> dict:
+        # What a copy linked into the store is made from, see utilities.record_link
+        stat = path.stat()
+        return {
+            "path": str(path.absolute()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "years": list(years) if years is not None else None,
+            "compression": compression,
+        }
+
+    # Directories are created up front, so the copies below can safely run in parallel
+    copies = []
+    copy_names: dict[Path, set[str]] = {}
     for path in contents:
-        if ut.is_gas_csv(path):
-    #        dest_dir = ut.get_dest_dir_from_csv_file(pollution_dir, path)
-            new_dir = ut.get_dest_dir_from_csv_file(dest_dir, path)
-            
-            new_dir.mkdir(parents=True, exist_ok=True)
-            
+        filename = ut.restructured_name(path, keep_compressed)
+
+        if sink is not None:
+            # The same layout, inside the archive
+            copies.append((path, dest_dir / f"gas_{ut.gas_formula(path)}" / filename))
+            continue
+
+        new_dir = ut.get_dest_dir_from_csv_file(dest_dir, path)
+
+        dest_file_path = Path(new_dir / filename)
+        copy_names.setdefault(dest_file_path.parent, set()).add(filename)
+
+        # Copies with filtered years are smaller than their source, and decompressed copies differ in size too
+        compression = ut.split_compression(filename)[1]
+        same_size = years is None and compression == ut.split_compression(path.name)[1]
+        if store_dir is not None:
+            # A link has the time of the stored contents, which may have been stored from another source
+            up_to_date = incremental and ut.is_link_up_to_date(store_dir, dest_file_path, stored_source(path, compression))
+        else:
+            up_to_date = incremental and ut.is_up_to_date(dest_file_path, [path], same_size=same_size)
+        if up_to_date:
+            res["skipped"] += 1
+        else:
+            copies.append((path, dest_file_path))
+
+    if progress.enabled:
+        progress.stage("restructure", files=len(copies), bytes=sum(path.stat().st_size for path, _ in copies))
+
+    def copy(pair: tuple[Path, Path]) -> tuple[int, bool, list[str]]:
+        path, dest_file_path = pair
+        if progress.enabled:
+            # Counted when the copy starts, which keeps the rate steady for large files
+            progress.add(files=1, bytes=path.stat().st_size)
+        # Compressed files are decompressed while they are read, and compressed again if the copy keeps the compression
+        compression = ut.split_compression(dest_file_path.name)[1]
+        recompressed = compression != ut.split_compression(path.name)[1]
+        if sink is not None:
+            # Several threads may read and filter files, while the archive itself is written by one at a time
+            with ut.open_csv(path) as src_file, sink.open(dest_file_path.as_posix(), path.stat().st_mtime) as entry:
+                errors = ut.copy_gas_stream(src_file, entry, validate, years, compression)
+                if errors:
+                    entry.discard()
+            return 0, True, errors
+        # The validator reads the chunks of the copy, so the file is only read once
+        consumers, transform = ut.copy_checks(validate, years)
+        if store_dir is None:
+            size, is_new = 0, True
+            # The copy is renamed over dest_file_path once complete, so that a concurrent run never sees a partial copy,
+            # and a link into a content-addressed store used by an earlier run is replaced instead of written through
+            tmp_path = ut.temporary_path(dest_file_path)
+            if validate or transform is not None or recompressed or io_throttle.limited:
+                # A chunked copy, which can be validated, transformed and throttled
+                ut.copy_file_chunked(path, tmp_path, consumers, transform=transform, compression=compression)
+            else:
+                shutil.copy2(path, tmp_path)
+        else:
+            # Described before it is read, so that a change while it is stored is seen by the next run
+            source = stored_source(path, compression)
+            stored, is_new = ut.store_file(
+                path, store_dir, consumers=consumers, transform=transform, compression=compression
+            )
+            size = stored.stat().st_size
 
-            filename = ut.merge_parent_and_basename(path)
+        errors = consumers[0].finish() if validate else []
+        if errors:
+            # Invalid files are left out of by_gas, instead of making the plotting fail later on
+            if store_dir is None:
+                tmp_path.unlink()
+            elif is_new:
+                if stored.exists():
+                    stored.unlink()
+        elif store_dir is None:
+            os.replace(tmp_path, dest_file_path)
+        else:
+            ut.link_file(stored, dest_file_path)
+            ut.record_link(store_dir, dest_file_path, stored, source)
+        return size, is_new, errors
 
-            dest_file_path = Path(new_dir / filename)
+    if workers == 1:
+        outcomes = [copy(pair) for pair in copies]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(copy, copies))
 
-            shutil.copy2(path, dest_file_path)
+    for (path, _), (size, is_new, errors) in zip(copies, outcomes):
+        ut.add_copy_outcome(res, str(path.relative_to(pollution_dir)), errors, size, is_new)
 
+    # Copies of other variants of the same sources, e.g. left by a run that kept the compression, would count them twice
+    for gas_dir, names in copy_names.items():
+        for name in ut.stale_variants(os.listdir(gas_dir), names):
+            (gas_dir / name).unlink()
 
-def analyze_pollution_data(work_dir: str | Path) -> None:
+    return res
+
+
+def analyze_pollution_data(
+    work_dir: str | Path,
+    workers: int = 1,
+    incremental: bool = False,
+    display: bool = True,
+    store_dir: str | Path | None = None,
+    outputs: list[plot.OutputSpec] | None = None,
+    parallel_thumbnails: bool = False,
+    validate: bool = False,
+    selection: ut.Selection | None = None,
+    policy: ut.TraversalPolicy | None = None,
+    export: str | None = None,
+    archive: str | Path | None = None,
+    keep_compressed: bool = False,
+    shard: Shard | None = None,
+    trend: int | None = None,
+    lock: str | None = None,
+    lock_timeout: float | None = None,
+) -> None:
     """Do the restructuring of the pollution_data and plot
        the statistics showing emissions of each gas as function of all the corresponding
        sources. The new structure and the plots are saved in a separate directory under work_dir
 
     Parameters:
         - work_dir (str or pathlib.Path) : Absolute path to the working directory that
-                                    contains the pollution_data directory and where the new directories will be created
+                                    contains the pollution_data directory and where the new directories will be created.
+                                    Without a pollution_data directory, a pollution_data archive is read instead, see find_pollution_data
+        - workers (int) : Number of workers used by the restructuring and plotting stages, default to one
+        - incremental (bool) : If True, reuse the copies and plots that are already up to date
+        - display (bool) : If True, display the diagnostics and the directory tree of work_dir at the end
+        - store_dir (str, pathlib.Path or None) : Content-addressed store to deduplicate the restructured files in,
+                                    see restructure_pollution_data
+        - outputs (List[OutputSpec] or None) : The files each plot is saved to, default to one .png file per gas
+        - parallel_thumbnails (bool) : If True, the thumbnail outputs of a plot are made in parallel threads
+        - validate (bool) : If True, validate the gas .csv files while they are copied and leave the invalid ones out.
+                                    The errors are written to pollution_data_restructured/validation_report.json
+        - selection (utilities.Selection or None) : The gases, sources and years to restructure, summarize and plot,
+                                    default to all of them, see restructure_pollution_data
+        - policy (utilities.TraversalPolicy or None) : The subtrees of pollution_data that are not searched, see restructure_pollution_data
+        - export (str or None) : If given, the format (auto, columnar or parquet) of the long-format table the restructured data
+                                    is exported to, in pollution_data_restructured, see analytic_tools.export.export_pollution_data
+        - archive (str, pathlib.Path or None) : If given, the path to a .zip or .tar[.gz|.bz2|.xz] archive the whole restructured
+                                    tree (by_gas, with the summaries, figures and validation report) is written to, in one
+                                    sequential write, instead of pollution_data_restructured. See write_restructured_archive
+        - keep_compressed (bool) : If True, the copies of compressed gas files keep their compression, see restructure_pollution_data
+        - shard (analytic_tools.shard.Shard or None) : If given, only this shard of the src_[source] directories is restructured.
+                                    The manifest of the shard is written to pollution_data_restructured/shards, and the
+                                    process finishing the last shard merges the manifests, then summarizes, plots and exports
+                                    every gas, while the others return after their copies. work_dir must be on a filesystem
+                                    shared by the processes, and cannot be combined with archive
+        - trend (int or None) : If given, the degree of the polynomial trend drawn over each series of the plots, see plotting.plot_files
+        - lock (str or None) : If given, the policy (one of analytic_tools.locking.LOCK_POLICIES) of a run finding another run
+                                    working on the same work_dir: wait for it and reuse its outputs, as with incremental, or skip
+                                    the run. The plotting of each gas is locked too. Sharded runs only lock the plotting
+        - lock_timeout (float or None) : Maximum number of seconds to wait for a lock, default to no limit. A run still waiting
+                                    then raises TimeoutError
 
     Returns:
     None
@@ -84,8 +363,10 @@ def analyze_pollution_data(work_dir: str | Path) -> None:
     - Create pollution_data_restructured in work_dir
     - Populate it with a by_gas subdirectory
     - Make a call to restructure_pollution_data
+    - Write the summary statistics of each gas with summarize_pollution_data
     - Populate pollution_data_restructured with a subdirectory named figures
     - Make a call to plot_pollution_data
+    - Export the restructured data to one table with export_pollution_data, if requested
     """
     # Do the correct error handling first
     if not isinstance(work_dir, (str, Path)):
@@ -102,34 +383,208 @@ def analyze_pollution_data(work_dir: str | Path) -> None:
 
 
     # Create pollution_data_restructured in work_dir
-    pollution_dir = work_dir / "pollution_data"
+    pollution_dir = find_pollution_data(work_dir)
     restructured_dir = work_dir / "pollution_data_restructured"
 
     # Ensure pollution_data exists
     if not pollution_dir.exists():
         raise NotADirectoryError(f"{pollution_dir} does not exist")
-    if not pollution_dir.is_dir():
+    if not pollution_dir.is_dir() and not is_archive(pollution_dir):
         raise NotADirectoryError(f"{pollution_dir} is not a directory")
-    
+
+    if archive is not None:
+        if shard is not None:
+            raise ValueError("an archive is written by one process and cannot be sharded")
+        if store_dir is not None or export is not None:
+            raise ValueError("store_dir and export need the restructured files on disk, and cannot be used with an archive")
+        res = write_restructured_archive(
+            pollution_dir,
+            archive,
+            workers=workers,
+            validate=validate,
+            selection=selection,
+            policy=policy,
+            outputs=outputs or plot.DEFAULT_OUTPUTS,
+            parallel_thumbnails=parallel_thumbnails,
+            keep_compressed=keep_compressed,
+            trend=trend,
+        )
+        if display:
+            for path, errors in res.get("errors", {}).items():
+                print(f"Invalid file {path}:")
+                for error in errors:
+                    print(f"    - {error}")
+            tree = ut.build_rollup_tree(work_dir)
+            ut.display_diagnostics(work_dir, tree.diagnostics())
+            ut.display_directory_tree(work_dir, tree=tree)
+        return
+
     # Create pollution_data_restructured in work_dir
     restructured_dir.mkdir(parents=True, exist_ok=True)
 
-    # Populate it with a by_gas sub-folder
-    by_gas_dir = restructured_dir / "by_gas"
-    by_gas_dir.mkdir(parents=True, exist_ok=True)  # This creates the "by_gas" directory
+    locks = None
+    if lock is not None:
+        locks = WorkDirLocks(restructured_dir, policy=lock, timeout=lock_timeout)
+    # The shards of a run work on the same work_dir by design, and only lock the plotting of each gas
+    with locks.run() if locks is not None and shard is None else contextlib.nullcontext(True) as acquired:
+        if not acquired:
+            if display:
+                print(f"Another run is working on {work_dir}, skipping it")
+            return
+        if locks is not None and locks.waited:
+            # The run that held the lock did the same work, whose outputs are reused
+            incremental = True
+
+        # Populate it with a by_gas sub-folder
+        by_gas_dir = restructured_dir / "by_gas"
+        by_gas_dir.mkdir(parents=True, exist_ok=True)  # This creates the "by_gas" directory
+
+        # Make a call to restructure_pollution_data
+        res = restructure_pollution_data(
+            pollution_dir,
+            by_gas_dir,
+            workers=workers,
+            incremental=incremental,
+            store_dir=store_dir,
+            validate=validate,
+            selection=selection,
+            policy=policy,
+            keep_compressed=keep_compressed,
+            shard=shard,
+        )
+        coordinator = None
+        if shard is not None:
+            # The remaining steps need every shard, and are run once, by the process finishing the last one
+            coordinator = ShardCoordinator(restructured_dir / SHARDS_DIR_NAME, shard.count)
+            res = coordinator.finish(shard, res)
+            if res is None:
+                if display:
+                    print(f"Finished shard {shard}, the last shard to finish summarizes and plots every gas")
+                return
+        try:
+            if validate:
+                with ut.atomic_write(restructured_dir / VALIDATION_REPORT_NAME, "w") as file:
+                    file.write(json.dumps(res["errors"], indent=1))
+                if display:
+                    for path, errors in res["errors"].items():
+                        print(f"Invalid file {path}:")
+                        for error in errors:
+                            print(f"    - {error}")
+
+            # Precompute the summary statistics of each gas next to its .csv files
+            summarize_pollution_data(by_gas_dir, incremental=incremental, selection=selection)
+
+            # Populate pollution_data_restructured with a sub folder named figures
+            figures_dir = restructured_dir / "figures"
+            figures_dir.mkdir(parents=True, exist_ok=True)  # Create "figures" directory
+
+            # Make a call to plot_pollution_data
+            plot.plot_pollution_data(
+                by_gas_dir,
+                figures_dir,
+                workers=workers,
+                incremental=incremental,
+                outputs=outputs or plot.DEFAULT_OUTPUTS,
+                parallel_thumbnails=parallel_thumbnails,
+                selection=selection,
+                trend=trend,
+                locks=locks,
+            )
+
+            if export is not None:
+                from analytic_tools.export import export_pollution_data
 
-    # Make a call to restructure_pollution_data
-    restructure_pollution_data(pollution_dir, by_gas_dir)
+                export_pollution_data(by_gas_dir, restructured_dir, format=export, selection=selection)
+        except BaseException:
+            if coordinator is not None:
+                # Leave the merge lock to the next shard to finish, which merges again and retries these steps
+                coordinator.release()
+            raise
+        if coordinator is not None:
+            coordinator.complete()
 
-    # Populate pollution_data_restructured with a sub folder named figures
-    figures_dir = restructured_dir / "figures"
-    figures_dir.mkdir(parents=True, exist_ok=True)  # Create "figures" directory
+        if display:
+            # One traversal serves both the diagnostics and the tree
+            tree = ut.build_rollup_tree(work_dir)
+            ut.display_diagnostics(work_dir, tree.diagnostics())
+            ut.display_directory_tree(work_dir, tree=tree)
 
-    # Make a call to plot_pollution_data
-    plot.plot_pollution_data(by_gas_dir, figures_dir)
 
-    ut.display_diagnostics(work_dir,ut.get_diagnostics(work_dir))
-    ut.display_directory_tree(work_dir)
+def write_restructured_archive(
+    pollution_dir: str | Path,
+    archive: str | Path,
+    workers: int = 1,
+    validate: bool = False,
+    selection: ut.Selection | None = None,
+    policy: ut.TraversalPolicy | None = None,
+    outputs: list[plot.OutputSpec] | tuple[plot.OutputSpec, ...] = plot.DEFAULT_OUTPUTS,
+    parallel_thumbnails: bool = False,
+    keep_compressed: bool = False,
+    trend: int | None = None,
+) -> dict:
+    """Write the layout of pollution_data_restructured (by_gas/gas_[gas_formula]/src_[source]_[gas_formula].csv with a
+       summary.json per gas, and figures/gas_[gas_formula].png) as members of one archive, without creating any of these files.
+       The summaries and plots are made from the original files, which is possible since the copies only rename them.
+
+    Parameters:
+        - pollution_dir (str or pathlib.Path) : Absolute path to the pollution_data directory
+        - archive (str or pathlib.Path) : Path to the .zip or .tar[.gz|.bz2|.xz] archive to write, replaced if it exists
+        - workers (int) : Number of threads reading the files to copy, default to one
+        - validate (bool) : If True, leave out the invalid files and add their errors to the archive as validation_report.json
+        - selection (utilities.Selection or None) : The gases, sources and years to restructure, default to all of them
+        - policy (utilities.TraversalPolicy or None) : The subtrees of pollution_dir that are not searched
+        - outputs (List[OutputSpec]) : The files each plot is saved to
+        - parallel_thumbnails (bool) : If True, the thumbnail outputs of a plot are made in parallel threads
+        - keep_compressed (bool) : If True, the copies of compressed gas files keep their compression, see restructure_pollution_data
+        - trend (int or None) : If given, the degree of the polynomial trend drawn over each series of the plots
+
+    Returns:
+        - (dict) : The report of restructure_pollution_data, with the key plotted added
+    """
+    pollution_dir = Path(pollution_dir)
+    if is_archive(pollution_dir):
+        raise ValueError("Writing the restructured tree to an archive needs a pollution_data directory, not an archive")
+    years = selection.years if selection is not None else None
+
+    with ArchiveSink(archive) as sink:
+        res = restructure_pollution_data(
+            pollution_dir,
+            "by_gas",
+            workers=workers,
+            validate=validate,
+            selection=selection,
+            policy=policy,
+            sink=sink,
+            keep_compressed=keep_compressed,
+        )
+        if validate:
+            with sink.open(VALIDATION_REPORT_NAME) as entry:
+                entry.write(json.dumps(res["errors"], indent=1).encode())
+
+        invalid = {pollution_dir / path for path in res.get("errors", {})}
+        gases: dict[str, list[Path]] = {}
+        for path in ut.find_gas_csv_files(pollution_dir, selection, policy):
+            if path not in invalid:
+                gases.setdefault(ut.gas_formula(path), []).append(path)
+
+        for gas, files in sorted(gases.items()):
+            names = [ut.restructured_name(file) for file in files]
+            summary = {"gas": gas, **summarize_gas(*load_files_series(files, names, years))}
+            with sink.open(f"by_gas/gas_{gas}/{ut.SUMMARY_NAME}") as entry:
+                entry.write(json.dumps(summary, indent=1).encode())
+            plot.plot_files(
+                f"gas_{gas}",
+                [plot.label_from_filename(name) for name in names],
+                files,
+                "figures",
+                outputs=outputs,
+                parallel_thumbnails=parallel_thumbnails,
+                sink=sink,
+                years=years,
+                trend=trend,
+            )
+        res["plotted"] = len(gases)
+    return res
 
 
 def analyze_pollution_data_tmp(work_dir: str | Path) -> None:
@@ -157,10 +612,569 @@ def analyze_pollution_data_tmp(work_dir: str | Path) -> None:
     ...
 
 
-if __name__ == "__main__":
-    # Create a variable holding the path to your working directory
-    work_dir = Path(".")
-    # Make a call to analyze_pollution_data
-    analyze_pollution_data(work_dir)
-    ut.delete_directories([work_dir / "pollution_data_restructured"]) # optional
+def _analyze_one(
+    work_dir: Path, incremental: bool, store_dir: str | Path | None, validate: bool, keep_compressed: bool = False
+) -> dict:
+    """Run analyze_pollution_data on one work_dir and describe the outcome, catching any error so that
+       it is reported in the batch summary instead of aborting the other datasets"""
+    start = time.perf_counter()
+    res = {"work_dir": str(work_dir), "status": "ok", "elapsed": 0.0, "diagnostics": None, "error": None, "throttle": None}
+    try:
+        analyze_pollution_data(
+            work_dir,
+            incremental=incremental,
+            display=False,
+            store_dir=store_dir,
+            validate=validate,
+            keep_compressed=keep_compressed,
+        )
+        res["diagnostics"] = ut.get_diagnostics(work_dir / "pollution_data_restructured")
+    except Exception as e:
+        res["status"] = "failed"
+        res["error"] = f"{type(e).__name__}: {e}"
+        res["traceback"] = traceback.format_exc()
+    res["elapsed"] = time.perf_counter() - start
+    if io_throttle.limited:
+        res["throttle"] = io_throttle.stats()
+    return res
+
+
+def batch_analyze_pollution_data(
+    work_dirs: str | Path | list[str | Path],
+    workers: int = 1,
+    incremental: bool = False,
+    store_dir: str | Path | None = None,
+    validate: bool = False,
+    keep_compressed: bool = False,
+) -> list[dict]:
+    """Run analyze_pollution_data on many working directories, each one in a process of its own.
+       A dataset that fails does not stop the others; its error is captured in the returned summary.
+
+    Parameters:
+        - work_dirs (str, pathlib.Path or List[str | Path]) : The working directories, or a glob pattern matching them
+        - workers (int) : Number of datasets analyzed in parallel, default to one
+        - incremental (bool) : If True, reuse the copies and plots that are already up to date
+        - store_dir (str, pathlib.Path or None) : Content-addressed store shared by all the datasets, see restructure_pollution_data
+        - validate (bool) : If True, validate the gas .csv files of every dataset, see analyze_pollution_data
+        - keep_compressed (bool) : If True, the copies of compressed gas files keep their compression, see restructure_pollution_data
+
+    Returns:
+        - (List[dict]) : One entry per working directory, in the order given, with keys:
+                         work_dir, status ("ok" or "failed"), elapsed, diagnostics (of pollution_data_restructured), error
+                         and throttle (the statistics of the I/O limits in the worker process, see throttle.Throttle.stats,
+                         None without limits)
+    """
+    if isinstance(work_dirs, (str, Path)):
+        work_dirs = sorted(glob.glob(str(work_dirs)))
+    if not isinstance(work_dirs, (list, tuple)):
+        raise TypeError(f"work_dirs is of type {type(work_dirs)}, expected str, Path or list")
+    if not isinstance(workers, int) or isinstance(workers, bool):
+        raise TypeError(f"workers is of type {type(workers)}, expected int")
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, but got {workers}")
+
+    work_dirs = [Path(work_dir) for work_dir in work_dirs]
+    results: dict[Path, dict] = {}
+
+    # A fresh process per dataset (where supported) keeps a crashing or leaking dataset from affecting the next ones.
+    # Such processes are spawned rather than forked, so the I/O limits of this process are passed on to each of them
+    pool_args = {"max_tasks_per_child": 1} if sys.version_info >= (3, 11) else {}
+    limits = (io_throttle.bytes_per_second, io_throttle.files_per_second)
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_io_limits, initargs=limits, **pool_args) as pool:
+        futures = {
+            pool.submit(_analyze_one, work_dir, incremental, store_dir, validate, keep_compressed): work_dir
+            for work_dir in work_dirs
+        }
+        for future in as_completed(futures):
+            work_dir = futures[future]
+            try:
+                results[work_dir] = future.result()
+            except Exception as e:
+                # The worker process itself died, e.g. killed by the OS
+                results[work_dir] = {
+                    "work_dir": str(work_dir),
+                    "status": "failed",
+                    "elapsed": None,
+                    "diagnostics": None,
+                    "error": f"{type(e).__name__}: {e}",
+                    "throttle": None,
+                }
+
+    return [results[work_dir] for work_dir in work_dirs]
 
+
+def format_batch_summary(results: list[dict]) -> str:
+    """Format the result of batch_analyze_pollution_data as a table with one row per working directory
+
+    Parameters:
+        - results (List[dict]) : The list returned by batch_analyze_pollution_data
+
+    Returns:
+        - (str) : The table, ready to be printed
+    """
+    header = ["work_dir", "status", "elapsed [s]", "files", ".csv files", "error"]
+    rows = [header]
+    for res in results:
+        diagnostics = res["diagnostics"] or {}
+        elapsed = res["elapsed"]
+        rows.append(
+            [
+                res["work_dir"],
+                res["status"],
+                "-" if elapsed is None else f"{elapsed:.3f}",
+                str(diagnostics.get("files", "-")),
+                str(diagnostics.get(".csv files", "-")),
+                res["error"] or "",
+            ]
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def _tree_as_dict(node: ut.DirNode) -> dict:
+    """Describe the rollup tree with root node as nested dictionaries, for the json output of the tree command"""
+    return {
+        "name": node.name,
+        "files": node.files,
+        "subdirectories": [_tree_as_dict(child) for child in node.children],
+        "diagnostics": {**node.diagnostics(), "bytes": node.bytes},
+    }
+
+
+def _parse_years(text: str) -> tuple[int, int]:
+    """Parse a range of years given as FIRST-LAST, or a single year, on the command line"""
+    first, _, last = text.partition("-")
+    try:
+        years = (int(first), int(last or first))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid range of years {text!r}, expected e.g. 2000-2010") from None
+    if years[0] > years[1]:
+        raise argparse.ArgumentTypeError(f"invalid range of years {text!r}, the first year is after the last one")
+    return years
+
+
+def _parse_positive(text: str) -> float:
+    """Parse a positive number on the command line"""
+    try:
+        number = float(text)
+    except ValueError:
+        number = 0.0
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"invalid number {text!r}, expected a positive number")
+    return number
+
+
+def _parse_shard(text: str) -> Shard:
+    """Parse a shard given as INDEX/COUNT on the command line"""
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def _selection(args: argparse.Namespace) -> ut.Selection | None:
+    """Build the Selection given by the filter options on the command line, or None if no filter was given"""
+    selection = ut.Selection(
+        gases=tuple(args.gas or ()),
+        sources=tuple(args.source or ()),
+        exclude_gases=tuple(args.exclude_gas or ()),
+        exclude_sources=tuple(args.exclude_source or ()),
+        years=args.years,
+    )
+    return None if selection == ut.Selection() else selection
+
+
+def _policy(args: argparse.Namespace, ignore: tuple[str, ...] = ()) -> ut.TraversalPolicy:
+    """Build the TraversalPolicy given by the traversal options on the command line, ignoring ignore as well"""
+    return ut.TraversalPolicy(
+        ignore=(*ignore, *(args.ignore or ())),
+        max_depth=args.max_depth,
+        same_filesystem=args.one_file_system,
+        follow_symlinks=args.follow_symlinks,
+    )
+
+
+def _report(args: argparse.Namespace, elapsed: float, result: dict | None = None) -> None:
+    """Print the outcome of one command of the command line interface in the requested output format"""
+    if args.format == "json":
+        print(json.dumps({"command": args.command, "elapsed": elapsed, **(result or {})}, default=str))
+    else:
+        for key, val in (result or {}).items():
+            print(f"{key}: {val}")
+        print(f"Finished {args.command} in {elapsed:.3f} s")
+
+
+def _progress_renderers(args: argparse.Namespace) -> list:
+    """The renderers of the progress requested with --progress, none by default unless stderr is a terminal"""
+    mode = args.progress
+    if mode == "auto":
+        # Batches run in other processes, and watch would keep a stale line on screen
+        mode = "tty" if sys.stderr.isatty() and args.command not in ("batch", "watch") else "off"
+    if mode == "tty":
+        return [TtyRenderer()]
+    if mode == "log":
+        return [LogRenderer()]
+    return []
+
+
+def _run_command(args: argparse.Namespace) -> int:
+    """Run the command of the command line interface parsed in args, see main"""
+    if args.command == "batch":
+        start = time.perf_counter()
+        work_dirs = []
+        for pattern in args.work_dirs:
+            work_dirs.extend(sorted(glob.glob(pattern)) or [pattern])
+        results = batch_analyze_pollution_data(
+            work_dirs,
+            workers=args.workers,
+            incremental=args.incremental,
+            store_dir=args.store,
+            validate=args.validate,
+            keep_compressed=args.keep_compressed,
+        )
+        if args.format == "json":
+            _report(args, time.perf_counter() - start, {"results": results})
+        else:
+            print(format_batch_summary(results))
+            _report(args, time.perf_counter() - start)
+        return int(any(res["status"] != "ok" for res in results))
+
+    work_dir = args.work_dir
+    restructured_dir = work_dir / "pollution_data_restructured"
+    start = time.perf_counter()
+
+    if args.command == "diagnose":
+        res = ut.get_diagnostics(work_dir, _policy(args))
+        if args.format == "text":
+            ut.display_diagnostics(work_dir, res)
+        _report(args, time.perf_counter() - start, {"diagnostics": res} if args.format == "json" else None)
+    elif args.command == "tree":
+        if args.format == "text":
+            ut.display_directory_tree(work_dir, args.maxfiles)
+            _report(args, time.perf_counter() - start)
+        else:
+            tree = _tree_as_dict(ut.build_rollup_tree(work_dir))
+            _report(args, time.perf_counter() - start, {"tree": tree})
+    elif args.command == "restructure" and args.object_store is not None:
+        from analytic_tools.fs import ObjectStoreFileSystem
+
+        prefix = PurePosixPath(work_dir.as_posix())
+        with ObjectStoreFileSystem(args.object_store, max_connections=max(args.workers, 8)) as fs:
+            res = restructure_pollution_data(
+                (prefix / "pollution_data").as_posix(),
+                (prefix / "pollution_data_restructured" / "by_gas").as_posix(),
+                workers=args.workers,
+                store_dir=args.store,
+                validate=args.validate,
+                incremental=args.incremental,
+                selection=_selection(args),
+                policy=_policy(args, ut.DEFAULT_IGNORE),
+                keep_compressed=args.keep_compressed,
+                fs=fs,
+            )
+        _report(args, time.perf_counter() - start, res)
+    elif args.command == "restructure" and args.archive is not None:
+        with ArchiveSink(args.archive) as sink:
+            res = restructure_pollution_data(
+                find_pollution_data(work_dir),
+                "by_gas",
+                workers=args.workers,
+                store_dir=args.store,
+                validate=args.validate,
+                selection=_selection(args),
+                policy=_policy(args, ut.DEFAULT_IGNORE),
+                sink=sink,
+                keep_compressed=args.keep_compressed,
+            )
+        _report(args, time.perf_counter() - start, res)
+    elif args.command == "restructure":
+        by_gas_dir = restructured_dir / "by_gas"
+        by_gas_dir.mkdir(parents=True, exist_ok=True)
+        res = restructure_pollution_data(
+            find_pollution_data(work_dir),
+            by_gas_dir,
+            workers=args.workers,
+            incremental=args.incremental,
+            store_dir=args.store,
+            validate=args.validate,
+            selection=_selection(args),
+            policy=_policy(args, ut.DEFAULT_IGNORE),
+            keep_compressed=args.keep_compressed,
+            shard=args.shard,
+        )
+        if args.shard is not None:
+            coordinator = ShardCoordinator(restructured_dir / SHARDS_DIR_NAME, args.shard.count)
+            merged = coordinator.finish(args.shard, res)
+            if merged is not None:
+                try:
+                    if args.validate:
+                        with ut.atomic_write(restructured_dir / VALIDATION_REPORT_NAME, "w") as file:
+                            file.write(json.dumps(merged["errors"], indent=1))
+                except BaseException:
+                    coordinator.release()
+                    raise
+                coordinator.complete()
+            res = {**res, "shard": str(args.shard), "merged": merged}
+        _report(args, time.perf_counter() - start, res)
+    elif args.command == "summarize":
+        res = summarize_pollution_data(restructured_dir / "by_gas", incremental=args.incremental, selection=_selection(args))
+        _report(args, time.perf_counter() - start, res)
+    elif args.command == "plot":
+        figures_dir = restructured_dir / "figures"
+        figures_dir.mkdir(parents=True, exist_ok=True)
+        res = plot.plot_pollution_data(
+            restructured_dir / "by_gas",
+            figures_dir,
+            workers=args.workers,
+            incremental=args.incremental,
+            outputs=args.output or plot.DEFAULT_OUTPUTS,
+            parallel_thumbnails=args.parallel_thumbnails,
+            selection=_selection(args),
+            shard=args.shard,
+            trend=args.trend,
+            locks=None if args.lock is None else WorkDirLocks(restructured_dir, policy=args.lock, timeout=args.lock_timeout),
+        )
+        _report(args, time.perf_counter() - start, res)
+    elif args.command == "run":
+        display = args.format == "text"
+        analyze_pollution_data(
+            work_dir,
+            workers=args.workers,
+            incremental=args.incremental,
+            display=display,
+            store_dir=args.store,
+            outputs=args.output,
+            parallel_thumbnails=args.parallel_thumbnails,
+            validate=args.validate,
+            selection=_selection(args),
+            policy=_policy(args, ut.DEFAULT_IGNORE),
+            export=args.export,
+            archive=args.archive,
+            keep_compressed=args.keep_compressed,
+            shard=args.shard,
+            trend=args.trend,
+            lock=args.lock,
+            lock_timeout=args.lock_timeout,
+        )
+        _report(args, time.perf_counter() - start, None if display else {"diagnostics": ut.get_diagnostics(work_dir)})
+        if args.cleanup:
+            ut.delete_directories([restructured_dir])
+    elif args.command == "export":
+        from analytic_tools.export import export_pollution_data
+
+        res = export_pollution_data(
+            restructured_dir / "by_gas", restructured_dir, format=args.export or "auto", selection=_selection(args)
+        )
+        _report(args, time.perf_counter() - start, res)
+    elif args.command == "trends":
+        trends = fit_pollution_trends(
+            restructured_dir / "by_gas", degree=args.degree, forecast=args.forecast or (), selection=_selection(args)
+        )
+        with ut.atomic_write(restructured_dir / TRENDS_NAME, "w") as file:
+            file.write(json.dumps(trends, indent=1))
+        series = sum(len(sources) for sources in trends["per gas"].values())
+        _report(args, time.perf_counter() - start, {"series": series, "written": str(restructured_dir / TRENDS_NAME)})
+    elif args.command == "verify":
+        from analytic_tools.verify import verify_restructured
+
+        res = verify_restructured(
+            work_dir / "pollution_data", restructured_dir / "by_gas", workers=args.workers, algorithm=args.algorithm
+        )
+        _report(args, time.perf_counter() - start, res)
+        return int(bool(res["mismatched"] or res["missing"] or res["unexpected"]))
+    elif args.command == "diff":
+        from analytic_tools.diff import diff_snapshots
+
+        res = diff_snapshots(
+            args.against / "pollution_data",
+            work_dir / "pollution_data",
+            workers=args.workers,
+            algorithm=args.algorithm,
+            tolerance=args.tolerance,
+            selection=_selection(args),
+        )
+        _report(args, time.perf_counter() - start, res)
+        return int(any(res["files"][key] for key in ("added", "removed", "changed")))
+    elif args.command == "watch":
+        from analytic_tools.watch import watch_pollution_data
+
+        analyze_pollution_data(work_dir, workers=args.workers, incremental=True, display=False)
+        _report(args, time.perf_counter() - start)
+
+        def on_update(gas_dirs: list[str]) -> None:
+            if args.format == "json":
+                print(json.dumps({"command": args.command, "updated": gas_dirs}), flush=True)
+            else:
+                print(f"Updated {', '.join(gas_dirs)}", flush=True)
+
+        try:
+            watch_pollution_data(
+                work_dir, debounce=args.debounce, interval=args.interval, polling=args.polling, on_update=on_update
+            )
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+def _options_parser(workers: int = 1) -> argparse.ArgumentParser:
+    """The options of every command, with workers as the default number of parallel workers"""
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("-j", "--workers", type=int, default=workers, help=f"number of parallel workers, default to {workers}")
+    options.add_argument("-i", "--incremental", action="store_true", help="reuse the copies and plots that are up to date")
+    options.add_argument("-f", "--format", choices=["text", "json"], default="text", help="output format")
+    options.add_argument("--limit-rate", type=parse_rate, default=None, help="read and write at most RATE bytes per second, e.g. 20M")
+    options.add_argument("--limit-files", type=_parse_positive, default=None, help="open at most N files and directories per second")
+    options.add_argument("--low-priority", action="store_true", help="run with the lowest CPU (nice) and I/O (ionice idle) priority")
+    options.add_argument(
+        "--progress",
+        choices=["auto", "tty", "log", "off"],
+        default="auto",
+        help="report files, bytes, rate and ETA on stderr, on one line (tty) or as log lines (log). Default to tty on a terminal",
+    )
+    return options
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Command line interface running either a single stage of the pipeline or all of them.
+
+    Commands:
+        - diagnose : Count the files and subdirectories of a directory tree
+        - tree : Display a directory tree
+        - restructure : Copy the gas .csv files of work_dir/pollution_data to pollution_data_restructured/by_gas
+        - summarize : Write the summary statistics of each gas to pollution_data_restructured/by_gas/gas_[gas_formula]/summary.json
+        - plot : Plot the contents of pollution_data_restructured/by_gas to pollution_data_restructured/figures
+        - run : Do all of the above, like analyze_pollution_data
+        - verify : Check that every copy in pollution_data_restructured/by_gas is identical to its source
+        - batch : Run the whole pipeline on many working directories in parallel and summarize the outcome
+        - export : Write pollution_data_restructured/by_gas to one long-format table (gas, source, year, value)
+        - trends : Fit a polynomial trend to every series at once and write them to pollution_data_restructured/trends.json
+        - watch : Bring pollution_data_restructured up to date, then keep updating it as files change in pollution_data/by_src
+
+    Parameters:
+        - argv (List[str] or None) : Command line arguments, default to sys.argv[1:]
+
+    Returns:
+        - (int) : Exit status
+    """
+    options = _options_parser()
+    common = argparse.ArgumentParser(add_help=False, parents=[options])
+    common.add_argument("work_dir", nargs="?", default=".", type=Path, help="working directory, default to the current one")
+    # Hashing is bound by I/O rather than CPU, so verify and diff run four workers unless told otherwise
+    hashing = argparse.ArgumentParser(add_help=False, parents=[_options_parser(workers=4)])
+    hashing.add_argument("work_dir", nargs="?", default=".", type=Path, help="working directory, default to the current one")
+
+    parser = argparse.ArgumentParser(prog="analyze-pollution-data", description=__doc__)
+    restructuring = argparse.ArgumentParser(add_help=False)
+    restructuring.add_argument("--validate", action="store_true", help="validate the gas .csv files and leave out the invalid ones")
+    restructuring.add_argument("--store", type=Path, default=None, help="deduplicate the restructured files in this content-addressed store")
+    restructuring.add_argument(
+        "--keep-compressed", action="store_true", help="keep .csv.gz and .csv.zst files compressed in by_gas instead of decompressing them"
+    )
+    traversal = argparse.ArgumentParser(add_help=False)
+    traversal.add_argument("--ignore", action="append", help="leave out the files and directories matching this pattern (repeatable)")
+    traversal.add_argument("--max-depth", type=int, default=None, help="number of levels of subdirectories to descend into")
+    traversal.add_argument("--one-file-system", action="store_true", help="do not descend into other file systems")
+    traversal.add_argument("--follow-symlinks", action="store_true", help="descend into symbolic links to directories")
+    selecting = argparse.ArgumentParser(add_help=False)
+    selecting.add_argument("--gas", action="append", help="only process the gases matching this pattern, e.g. CO2 or N*O (repeatable)")
+    selecting.add_argument("--source", action="append", help="only process the sources matching this pattern, e.g. oil_* (repeatable)")
+    selecting.add_argument("--exclude-gas", action="append", help="leave out the gases matching this pattern (repeatable)")
+    selecting.add_argument("--exclude-source", action="append", help="leave out the sources matching this pattern (repeatable)")
+    selecting.add_argument("--years", type=_parse_years, default=None, help="only copy the rows of these years, e.g. 2000-2010")
+    exporting = argparse.ArgumentParser(add_help=False)
+    exporting.add_argument(
+        "--export",
+        choices=["auto", "columnar", "parquet"],
+        default=None,
+        help="export by_gas to one long-format table, as parquet (requires pyarrow) or the dependency-free columnar layout",
+    )
+    archiving = argparse.ArgumentParser(add_help=False)
+    archiving.add_argument(
+        "--archive",
+        type=Path,
+        default=None,
+        help="write the restructured tree to this .zip or .tar[.gz|.bz2|.xz] archive instead of pollution_data_restructured",
+    )
+    sharding = argparse.ArgumentParser(add_help=False)
+    sharding.add_argument(
+        "--shard",
+        type=_parse_shard,
+        default=None,
+        metavar="INDEX/COUNT",
+        help="only do this shard of the work, e.g. 0/4, with the other shards run by processes sharing work_dir",
+    )
+    locking = argparse.ArgumentParser(add_help=False)
+    locking.add_argument(
+        "--lock",
+        choices=LOCK_POLICIES,
+        default=None,
+        help="lock work_dir against concurrent runs, and wait for them (reusing their outputs) or skip the work they hold",
+    )
+    locking.add_argument("--lock-timeout", type=float, default=None, metavar="SECONDS", help="give up waiting for a lock after this long")
+    figures = argparse.ArgumentParser(add_help=False)
+    figures.add_argument(
+        "--output",
+        action="append",
+        type=plot.parse_output_spec,
+        help="save every plot as FORMAT[:DPI[:WIDTHxHEIGHT]][:thumb], e.g. svg or png:50:4x3.2:thumb (repeatable)",
+    )
+    figures.add_argument("--parallel-thumbnails", action="store_true", help="downscale the thumbnails in parallel")
+    figures.add_argument("--trend", type=int, default=None, metavar="DEGREE", help="draw a least squares polynomial trend over each series")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("diagnose", parents=[common, traversal], help="count files and subdirectories of work_dir")
+    tree_parser = commands.add_parser("tree", parents=[common], help="display the directory tree of work_dir")
+    tree_parser.add_argument("--maxfiles", type=int, default=3, help="maximum number of files displayed per directory")
+    restructure_parser = commands.add_parser("restructure", parents=[common, restructuring, selecting, traversal, archiving, sharding], help="copy the gas .csv files into pollution_data_restructured/by_gas")
+    restructure_parser.add_argument(
+        "--object-store",
+        default=None,
+        metavar="URL",
+        help="restructure inside this S3-compatible bucket, e.g. http://localhost:9000/bucket, where work_dir is a prefix",
+    )
+    commands.add_parser("summarize", parents=[common, selecting], help="write summary.json with the statistics of each gas")
+    commands.add_parser("plot", parents=[common, figures, selecting, sharding, locking], help="plot pollution_data_restructured/by_gas into pollution_data_restructured/figures")
+    run_parser = commands.add_parser("run", parents=[common, restructuring, figures, selecting, traversal, exporting, archiving, sharding, locking], help="restructure, plot and display diagnostics")
+    run_parser.add_argument("--cleanup", action="store_true", help="offer to delete pollution_data_restructured afterwards")
+    commands.add_parser("export", parents=[common, selecting, exporting], help="export by_gas to one long-format table")
+    trends_parser = commands.add_parser("trends", parents=[common, selecting], help="fit a trend to every series and write trends.json")
+    trends_parser.add_argument("--degree", type=int, default=1, help="degree of the polynomial trends, default to linear")
+    trends_parser.add_argument("--forecast", type=int, action="append", help="project the trends to this year (repeatable)")
+    verify_parser = commands.add_parser("verify", parents=[hashing], help="check the copies in by_gas against their sources")
+    verify_parser.add_argument("--algorithm", default="blake2b", help="hash algorithm, e.g. blake2b, sha256 or xxh64")
+    diff_parser = commands.add_parser("diff", parents=[hashing, selecting], help="show what changed in pollution_data since an earlier snapshot")
+    diff_parser.add_argument("--against", type=Path, required=True, metavar="OLD_WORK_DIR", help="working directory of the earlier snapshot")
+    diff_parser.add_argument("--tolerance", type=float, default=0.0, help="largest change of a value that is ignored, default to none")
+    diff_parser.add_argument("--algorithm", default="blake2b", help="hash algorithm, e.g. blake2b, sha256 or xxh64")
+    batch_parser = commands.add_parser("batch", parents=[options, restructuring], help="run the pipeline on many working directories")
+    batch_parser.add_argument("work_dirs", nargs="+", help="working directories, or glob patterns matching them")
+    watch_parser = commands.add_parser("watch", parents=[common], help="keep pollution_data_restructured up to date while files change")
+    watch_parser.add_argument("--debounce", type=float, default=1.0, help="seconds without changes before updating")
+    watch_parser.add_argument("--interval", type=float, default=1.0, help="seconds between two scans when polling")
+    watch_parser.add_argument("--polling", action="store_true", help="poll for changes instead of using inotify")
+
+    argv = list(argv if argv is not None else sys.argv[1:])
+    if not argv or (argv[0] not in commands.choices and argv[0] not in ("-h", "--help")):
+        # Keep the old behaviour of `python analyze_pollution_data.py [WORK_DIR] [OPTIONS]`
+        argv = ["run", *argv]
+    args = parser.parse_args(argv)
+
+    if getattr(args, "shard", None) is not None and (getattr(args, "archive", None) or getattr(args, "object_store", None)):
+        parser.error("--shard cannot be combined with --archive or --object-store")
+    if getattr(args, "object_store", None) and getattr(args, "store", None) is not None:
+        parser.error("--store cannot be combined with --object-store")
+
+    # Set before any work starts, so that they also apply to the worker processes (forked ones inherit them,
+    # and batch passes them on to the ones it spawns)
+    set_io_limits(args.limit_rate, args.limit_files)
+    if args.low_priority:
+        lower_priority()
+
+    with report_progress(*_progress_renderers(args)):
+        return _run_command(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
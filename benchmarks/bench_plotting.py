@@ -0,0 +1,91 @@
+"""Benchmark of the time it takes to render the plot of one gas, as function of the number of sources.
+
+Compares create_plot, which draws all the series as one LineCollection in a reused figure, with the
+pyplot approach of one plt.plot call per series in a new figure.
+
+Run from the repository root with:
+
+    python benchmarks/bench_plotting.py [repeats]
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1].resolve()))
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from analytic_tools.plotting import create_plot, label_from_filename
+
+SERIES_COUNTS = [5, 100, 1000]
+
+
+def make_gas_dir(parent: Path, n_series: int) -> Path:
+    """Create a gas_CO2 directory with n_series random series for the years 1990-2022"""
+    gas_dir = parent / f"n{n_series}" / "gas_CO2"
+    gas_dir.mkdir(parents=True)
+    years = np.arange(1990, 2023)
+    rng = np.random.default_rng(n_series)
+    for i in range(n_series):
+        values = np.cumsum(rng.normal(size=years.size)) + 100
+        np.savetxt(
+            gas_dir / f"src_source{i}_CO2.csv",
+            np.column_stack([years, values]),
+            delimiter=",",
+            header="aar,value",
+            comments="",
+            fmt=["%d", "%.3f"],
+        )
+    return gas_dir
+
+
+def create_plot_pyplot(src_dir: Path, dest_dir: Path) -> None:
+    """Reference implementation, with one plt.plot call per series"""
+    plt.figure(1, figsize=(10, 8))
+    plt.title("Air pollution of CO2 as function of year")
+    for file in sorted(src_dir.iterdir()):
+        data = np.loadtxt(file, delimiter=",", skiprows=1)
+        plt.plot(data[:, 0], data[:, 1], label=label_from_filename(file.name))
+    plt.legend()
+    plt.xlabel("Year")
+    plt.ylabel("1000 tonn CO2-equivalents AR5")
+    plt.savefig(dest_dir / (src_dir.name + ".png"), dpi=200)
+    plt.close()
+
+
+def best_time(function, *args, repeats: int) -> float:
+    """Smallest wall time of repeats calls to function"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        # Warm up the font cache and the reused figure
+        warm_up = make_gas_dir(tmp / "warm_up", 5)
+        create_plot(warm_up, warm_up.parent)
+        create_plot_pyplot(warm_up, warm_up.parent)
+
+        print(f"{'series':>8} {'create_plot [s]':>16} {'pyplot [s]':>12}")
+        for n_series in SERIES_COUNTS:
+            gas_dir = make_gas_dir(tmp, n_series)
+            collection = best_time(create_plot, gas_dir, gas_dir.parent, repeats=repeats)
+            pyplot = best_time(create_plot_pyplot, gas_dir, gas_dir.parent, repeats=repeats)
+            print(f"{n_series:>8} {collection:>16.3f} {pyplot:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Test script for the functions in analytic_tools/analysis.py
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from analytic_tools.analysis import (
+    fit_pollution_trends,
+    fit_trends,
+    load_gas_series,
+    summarize_gas,
+    summarize_pollution_data,
+)
+
+
+@pytest.fixture
+def by_gas(tmp_path: Path) -> Path:
+    """A by_gas directory with one gas and two sources, where one source misses a year"""
+    gas_dir = tmp_path / "by_gas" / "gas_CO2"
+    gas_dir.mkdir(parents=True)
+    (gas_dir / "src_road_traffic_CO2.csv").write_text("aar,value\n1990,1\n1991,3\n1992,5\n")
+    (gas_dir / "src_industry_CO2.csv").write_text("aar,value\n1990,3\n1992,5\n")
+    return tmp_path / "by_gas"
+
+
+def test_load_gas_series(by_gas: Path):
+    """Test that the series of a gas are aligned on the union of their years"""
+    sources, years, values = load_gas_series(by_gas / "gas_CO2")
+    assert sources == ["industry", "road_traffic"]
+    np.testing.assert_array_equal(years, [1990, 1991, 1992])
+    np.testing.assert_array_equal(values, [[3, np.nan, 5], [1, 3, 5]])
+
+
+def test_summarize_gas(by_gas: Path):
+    """Test the summary statistics against values computed by hand"""
+    summary = summarize_gas(*load_gas_series(by_gas / "gas_CO2"))
+
+    assert summary["years"] == [1990, 1991, 1992]
+    assert summary["total"] == [4, 3, 10]
+    assert summary["cumulative total"] == [4, 7, 17]
+
+    road = summary["per source"]["road_traffic"]
+    assert (road["min"], road["max"], road["mean"], road["sum"]) == (1, 5, 3, 9)
+    assert road["cumulative"] == [1, 4, 9]
+    assert road["trend slope"] == pytest.approx(2)
+    assert road["share"] == pytest.approx([0.25, 1, 0.5])
+
+    industry = summary["per source"]["industry"]
+    assert industry["mean"] == 4
+    assert industry["trend slope"] == pytest.approx(1)
+    assert industry["cumulative"] == [3, None, 8]
+    assert industry["share"][1] is None
+
+
+def test_summarize_pollution_data(by_gas: Path):
+    """Test that summary.json is written to each gas directory, and skipped when it is up to date"""
+    assert summarize_pollution_data(by_gas) == {"summarized": 1, "skipped": 0}
+    summary = json.loads((by_gas / "gas_CO2" / "summary.json").read_text())
+    assert summary["gas"] == "CO2"
+    assert summary["sources"] == ["industry", "road_traffic"]
+
+    assert summarize_pollution_data(by_gas, incremental=True) == {"summarized": 0, "skipped": 1}
+
+    # A removed source is no longer summarized, although every remaining file is older than the summary
+    (by_gas / "gas_CO2" / "src_industry_CO2.csv").unlink()
+    assert summarize_pollution_data(by_gas, incremental=True) == {"summarized": 1, "skipped": 0}
+    assert json.loads((by_gas / "gas_CO2" / "summary.json").read_text())["sources"] == ["road_traffic"]
+
+
+def test_fit_trends():
+    """Test the batched fit against one np.polyfit per series, with series missing different years"""
+    rng = np.random.default_rng(0)
+    years = np.arange(1990, 2021, dtype=float)
+    values = rng.normal(size=(6, years.size)).cumsum(axis=1) + 100
+    values[1, :5] = np.nan
+    values[2, [3, 10, 20]] = np.nan
+    values[3, 10:] = np.nan
+    values[4, 2:] = np.nan  # Too few years for a quadratic trend
+    values[5] = values[0] * 2
+
+    fit = fit_trends(years, values, degree=2, forecast=[2025, 2030])
+    for row in [0, 1, 2, 3, 5]:
+        reported = ~np.isnan(values[row])
+        coefficients = np.polyfit(years[reported], values[row, reported], 2)
+        np.testing.assert_allclose(fit["fitted"][row], np.polyval(coefficients, years), rtol=1e-9)
+        np.testing.assert_allclose(fit["projections"][row], np.polyval(coefficients, [2025, 2030]), rtol=1e-9)
+        last = years[reported][-1]
+        assert fit["slope"][row] == pytest.approx(np.polyval(np.polyder(coefficients), last))
+        residuals = values[row, reported] - np.polyval(coefficients, years[reported])
+        assert fit["rmse"][row] == pytest.approx(np.sqrt(np.mean(residuals**2)))
+    np.testing.assert_array_equal(np.isnan(fit["residuals"][:4]), np.isnan(values[:4]))
+    assert np.isnan(fit["slope"][4]) and np.isnan(fit["projections"][4]).all() and np.isnan(fit["residuals"][4]).all()
+
+
+def test_fit_pollution_trends(by_gas: Path):
+    """Test that linear trends have the slopes of the summary statistics, and are projected to the forecast years"""
+    trends = fit_pollution_trends(by_gas, forecast=[1993])
+    assert trends["years"] == [1990, 1991, 1992]
+    road = trends["per gas"]["CO2"]["road_traffic"]
+    assert road["slope"] == pytest.approx(2)
+    assert road["projections"] == pytest.approx([7])
+    assert road["residuals"] == pytest.approx([0, 0, 0], abs=1e-9)
+    industry = trends["per gas"]["CO2"]["industry"]
+    assert industry["slope"] == pytest.approx(summarize_gas(*load_gas_series(by_gas / "gas_CO2"))["per source"]["industry"]["trend slope"])
+    assert industry["residuals"][1] is None
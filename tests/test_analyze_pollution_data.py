@@ -1,11 +1,19 @@
+import gzip
+import json
+import shutil
 from pathlib import Path
 
 import pytest
 from analyze_pollution_data import (
     analyze_pollution_data,
     analyze_pollution_data_tmp,
+    batch_analyze_pollution_data,
+    format_batch_summary,
+    main,
     restructure_pollution_data,
 )
+from analytic_tools.throttle import set_io_limits
+from analytic_tools.utilities import DEFAULT_IGNORE, Selection, TraversalPolicy, find_gas_csv_files
 
 
 @pytest.mark.task31
@@ -144,3 +152,307 @@ def test_analyze_pollution_data_tmp(tmp_workdir: Path):
     for p in actual_figures:
         # Figures must only contain correctly named directories
         assert p in possible_files, f"{p} is an invalid file in figures"
+
+
+def test_restructure_pollution_data_incremental(tmp_workdir: Path):
+    """Test that a second, incremental restructuring reuses the copies made by the first one
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True, exist_ok=True)
+
+    first = restructure_pollution_data(pollution_data, by_gas, workers=4)
+    assert first["copied"] > 0 and first["skipped"] == 0
+
+    second = restructure_pollution_data(pollution_data, by_gas, incremental=True)
+    assert second == {"copied": 0, "skipped": first["copied"]}
+
+    # A modified source file must be copied again
+    src = pollution_data / "by_src" / "src_agriculture" / "CO2.csv"
+    src.write_text(src.read_text() + "2023,1\n")
+    third = restructure_pollution_data(pollution_data, by_gas, incremental=True)
+    assert third == {"copied": 1, "skipped": first["copied"] - 1}
+
+
+@pytest.mark.parametrize("command", ["diagnose", "tree", "restructure"])
+def test_main_json_output(tmp_workdir: Path, capsys, command: str):
+    """Test that the single stage commands of the command line interface report their result as json
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+        - command (str): the command to run
+    Returns:
+        - None
+    """
+    assert main([command, str(tmp_workdir), "--format", "json"]) == 0
+    res = json.loads(capsys.readouterr().out)
+    assert res["command"] == command
+    assert res["elapsed"] >= 0
+
+
+def test_main_without_command(tmp_workdir: Path, capsys):
+    """Test that the command line interface runs the whole pipeline when no command is given, as it did before the commands"""
+    assert main([str(tmp_workdir), "--format", "json"]) == 0
+    assert json.loads(capsys.readouterr().out)["command"] == "run"
+    assert len(list((tmp_workdir / "pollution_data_restructured" / "by_gas").rglob("*.csv"))) == 15
+
+
+def test_batch_analyze_pollution_data(tmp_workdir: Path):
+    """Test that batch_analyze_pollution_data analyzes every dataset and captures the failures
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    snapshots = tmp_workdir / "snapshots"
+    for name in ["region_a", "region_b"]:
+        shutil.copytree(tmp_workdir / "pollution_data", snapshots / name / "pollution_data")
+    # A snapshot without pollution_data must fail without affecting the others
+    (snapshots / "region_c").mkdir()
+
+    results = batch_analyze_pollution_data(str(snapshots / "region_*"), workers=2)
+
+    assert [Path(res["work_dir"]).name for res in results] == ["region_a", "region_b", "region_c"]
+    assert [res["status"] for res in results] == ["ok", "ok", "failed"]
+    assert results[0]["diagnostics"] == results[1]["diagnostics"]
+    assert "NotADirectoryError" in results[2]["error"]
+    assert (snapshots / "region_b" / "pollution_data_restructured" / "figures" / "gas_CO2.png").exists()
+
+    table = format_batch_summary(results).splitlines()
+    assert len(table) == 2 + len(results)
+    assert "failed" in table[-1]
+
+
+def test_batch_io_limits(tmp_workdir: Path, capsys):
+    """Test that the I/O limits of the batch command apply in its worker processes, which are spawned rather than forked"""
+    snapshots = tmp_workdir / "snapshots"
+    shutil.copytree(tmp_workdir / "pollution_data", snapshots / "region_a" / "pollution_data")
+    try:
+        assert main(["batch", str(snapshots / "region_*"), "--limit-rate", "1G", "--limit-files", "100000", "-f", "json"]) == 0
+    finally:
+        set_io_limits()
+    throttle = json.loads(capsys.readouterr().out)["results"][0]["throttle"]
+    assert throttle["bytes"] > 0 and throttle["files"] > 0
+
+    assert batch_analyze_pollution_data([snapshots / "region_a"], incremental=True)[0]["throttle"] is None
+
+
+def test_restructure_pollution_data_store(tmp_workdir: Path):
+    """Test that restructuring into a content-addressed store keeps one copy of each distinct content
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    store = tmp_workdir / "store"
+    by_src = pollution_data / "by_src"
+    # Make two sources report identical CO2 series
+    shutil.copy(by_src / "src_agriculture" / "CO2.csv", by_src / "src_industry" / "CO2.csv")
+
+    by_gas = tmp_workdir / "a" / "by_gas"
+    by_gas.mkdir(parents=True)
+    res = restructure_pollution_data(pollution_data, by_gas, store_dir=store)
+    size = (by_src / "src_industry" / "CO2.csv").stat().st_size
+    assert res["copied"] == 15
+    assert res["stored"] == 14
+    assert res["bytes saved"] == size
+    assert len([path for path in store.rglob("*.csv")]) == 14
+    copy = by_gas / "gas_CO2" / "src_industry_CO2.csv"
+    assert copy.read_bytes() == (by_src / "src_industry" / "CO2.csv").read_bytes()
+
+    # The copy of industry links to the contents stored from agriculture, which are older, and is up to date all the same
+    assert copy.stat().st_mtime_ns < (by_src / "src_industry" / "CO2.csv").stat().st_mtime_ns
+    for _ in range(2):
+        assert restructure_pollution_data(pollution_data, by_gas, store_dir=store, incremental=True) == {
+            "copied": 0,
+            "skipped": 15,
+            "stored": 0,
+            "bytes stored": 0,
+            "bytes saved": 0,
+        }
+    # A copy replaced without the store is made again
+    copy.unlink()
+    shutil.copy(by_src / "src_industry" / "CO2.csv", copy)
+    assert restructure_pollution_data(pollution_data, by_gas, store_dir=store, incremental=True)["copied"] == 1
+    assert copy.samefile(by_gas / "gas_CO2" / "src_agriculture_CO2.csv")
+
+    # A second snapshot with the same contents is stored for free
+    other_by_gas = tmp_workdir / "b" / "by_gas"
+    other_by_gas.mkdir(parents=True)
+    res = restructure_pollution_data(pollution_data, other_by_gas, store_dir=store, workers=4)
+    assert res["stored"] == 0
+    assert res["bytes stored"] == 0
+
+    # Restructuring without the store must not write into the stored files
+    stored_before = sorted(path.read_bytes() for path in store.rglob("*.csv"))
+    (by_src / "src_industry" / "CO2.csv").write_text("aar,value\n1990,1\n")
+    restructure_pollution_data(pollution_data, by_gas)
+    assert sorted(path.read_bytes() for path in store.rglob("*.csv")) == stored_before
+
+
+def test_restructure_pollution_data_validate(tmp_workdir: Path):
+    """Test that invalid gas .csv files are reported and left out when validating
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True, exist_ok=True)
+    broken = pollution_data / "by_src" / "src_industry" / "N2O.csv"
+    broken.write_text(broken.read_text().replace("2005,", "2005,x"))
+
+    res = restructure_pollution_data(pollution_data, by_gas, validate=True, workers=2)
+    assert res["copied"] == 14
+    assert res["invalid"] == 1
+    assert list(res["errors"]) == [str(Path("by_src", "src_industry", "N2O.csv"))]
+    assert "not numeric" in res["errors"][str(Path("by_src", "src_industry", "N2O.csv"))][0]
+    assert not (by_gas / "gas_N2O" / "src_industry_N2O.csv").exists()
+    assert [path.name for path in (by_gas / "gas_N2O").iterdir() if path.name.startswith(".")] == []
+
+    # The same applies to files going through a content-addressed store
+    res = restructure_pollution_data(pollution_data, by_gas, validate=True, store_dir=tmp_workdir / "store")
+    assert res["invalid"] == 1
+    assert res["stored"] == 14
+
+
+def test_restructure_pollution_data_selection(tmp_workdir: Path):
+    """Test that only the selected gases, sources and years are restructured and plotted
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True, exist_ok=True)
+
+    selection = Selection(gases=("CO2", "CH4"), exclude_sources=("road_*",), years=(2000, 2010))
+    res = restructure_pollution_data(pollution_data, by_gas, validate=True, selection=selection)
+    assert res["copied"] == 8
+    assert res["invalid"] == 0
+    assert sorted(path.name for path in by_gas.iterdir()) == ["gas_CH4", "gas_CO2"]
+    assert not (by_gas / "gas_CO2" / "src_road_traffic_CO2.csv").exists()
+    lines = (by_gas / "gas_CO2" / "src_industry_CO2.csv").read_text().splitlines()
+    assert lines[0].startswith("aar")
+    assert [int(line.split(",")[0]) for line in lines[1:]] == list(range(2000, 2011))
+
+    # Year-filtered copies are smaller than their source, but are still reused by incremental runs
+    res = restructure_pollution_data(pollution_data, by_gas, incremental=True, selection=selection)
+    assert res == {"copied": 0, "skipped": 8}
+
+    assert main(["plot", str(tmp_workdir), "--gas", "CO2"]) == 0
+    assert [path.name for path in (tmp_workdir / "pollution_data_restructured" / "figures").iterdir()] == ["gas_CO2.png"]
+
+
+def test_restructure_pollution_data_ignores_subtrees(tmp_workdir: Path):
+    """Test that the directories in DEFAULT_IGNORE, and those ignored by a policy, are not searched for gas .csv files
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True, exist_ok=True)
+    for stale in [".git", "__pycache__", "pollution_data_restructured", "backup_2020"]:
+        shutil.copytree(pollution_data / "by_src" / "src_industry", pollution_data / stale / "src_stale")
+
+    res = restructure_pollution_data(pollution_data, by_gas, policy=TraversalPolicy(ignore=(*DEFAULT_IGNORE, "backup_*")))
+    assert res["copied"] == 15
+    assert not (by_gas / "gas_CO2" / "src_stale_CO2.csv").exists()
+
+    res = restructure_pollution_data(pollution_data, by_gas)
+    assert res["copied"] == 18
+
+
+def test_restructure_pollution_data_compressed(tmp_workdir: Path):
+    """Test that .csv.gz files are restructured into plain .csv copies, or kept compressed with keep_compressed,
+    and that the summaries, plots and verification read both
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    from analytic_tools.verify import verify_restructured
+
+    pollution_data = tmp_workdir / "pollution_data"
+    originals = {}
+    for path in find_gas_csv_files(pollution_data):
+        originals[f"gas_{path.stem}/{path.parent.name}_{path.name}"] = path.read_bytes()
+        path.with_name(path.name + ".gz").write_bytes(gzip.compress(path.read_bytes()))
+        path.unlink()
+
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True)
+    res = restructure_pollution_data(pollution_data, by_gas, validate=True)
+    assert res["copied"] == 15 and res["invalid"] == 0
+    assert {path.relative_to(by_gas).as_posix(): path.read_bytes() for path in by_gas.rglob("*.csv")} == originals
+    assert restructure_pollution_data(pollution_data, by_gas, incremental=True) == {"copied": 0, "skipped": 15}
+    assert verify_restructured(pollution_data, by_gas)["mismatched"] == []
+
+    shutil.rmtree(tmp_workdir / "pollution_data_restructured")
+    analyze_pollution_data(tmp_workdir, display=False, keep_compressed=True)
+    copies = sorted(path.name for path in (by_gas / "gas_CO2").iterdir())
+    assert "src_industry_CO2.csv.gz" in copies and "src_industry_CO2.csv" not in copies
+    assert gzip.decompress((by_gas / "gas_CO2" / "src_industry_CO2.csv.gz").read_bytes()) == originals[
+        "gas_CO2/src_industry_CO2.csv"
+    ]
+    summary = json.loads((by_gas / "gas_CO2" / "summary.json").read_text())
+    assert len(summary["sources"]) == 5 and len(summary["years"]) == 33
+    assert (tmp_workdir / "pollution_data_restructured" / "figures" / "gas_CO2.png").exists()
+    assert verify_restructured(pollution_data, by_gas)["mismatched"] == []
+
+
+def test_restructure_pollution_data_variants(tmp_workdir: Path):
+    """Test that a file stored both plain and compressed is restructured once, from its plain variant, so that its
+    source counts once in the summaries, plots and verification, and that copies of the other variants are removed
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    from analytic_tools.verify import verify_restructured
+
+    pollution_data = tmp_workdir / "pollution_data"
+    src = pollution_data / "by_src" / "src_industry" / "CO2.csv"
+    lines = src.read_text().splitlines()
+    year, value = lines[1].split(",")
+    src.with_name("CO2.csv.gz").write_bytes(gzip.compress(f"{lines[0]}\n{year},{float(value) + 1}\n".encode()))
+    assert src.with_name("CO2.csv.gz") not in find_gas_csv_files(pollution_data)
+
+    analyze_pollution_data(tmp_workdir, workers=2, display=False, keep_compressed=True)
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    copies = sorted(path.name for path in (by_gas / "gas_CO2").glob("src_industry_*"))
+    assert copies == ["src_industry_CO2.csv"]
+    assert (by_gas / "gas_CO2" / "src_industry_CO2.csv").read_bytes() == src.read_bytes()
+    summary = json.loads((by_gas / "gas_CO2" / "summary.json").read_text())
+    assert sorted(summary["sources"]) == sorted(set(summary["sources"])) == sorted(summary["per source"])
+    assert (tmp_workdir / "pollution_data_restructured" / "figures" / "gas_CO2.png").exists()
+    report = verify_restructured(pollution_data, by_gas)
+    assert (report["mismatched"], report["missing"], report["unexpected"]) == ([], [], [])
+
+    # The copy of a variant left by an earlier run is removed, also when every copy is up to date
+    (by_gas / "gas_CO2" / "src_industry_CO2.csv.zst").write_bytes(b"stale")
+    assert restructure_pollution_data(pollution_data, by_gas, incremental=True) == {"copied": 0, "skipped": 15}
+    assert not (by_gas / "gas_CO2" / "src_industry_CO2.csv.zst").exists()
+
+    # Without its plain variant, the compressed one is used, and replaces the plain copy
+    src.unlink()
+    assert restructure_pollution_data(pollution_data, by_gas, incremental=True, keep_compressed=True)["copied"] == 1
+    copies = sorted(path.name for path in (by_gas / "gas_CO2").glob("src_industry_*"))
+    assert copies == ["src_industry_CO2.csv.gz"]
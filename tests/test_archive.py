@@ -0,0 +1,168 @@
+"""Test script for reading pollution_data from archives, in analytic_tools/archive.py
+"""
+import gzip
+import shutil
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from analyze_pollution_data import analyze_pollution_data, restructure_pollution_data
+from analytic_tools.archive import ArchiveSink, build_archive_tree, is_archive
+from analytic_tools.utilities import Selection, get_diagnostics
+
+
+def _make_archive(pollution_data: Path, archive: Path) -> Path:
+    """Bundle the pollution_data directory as the archive pointed to by archive, with pollution_data as its root"""
+    if archive.suffix == ".zip":
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for path in sorted(pollution_data.rglob("*")):
+                zip_file.write(path, Path("pollution_data", path.relative_to(pollution_data)).as_posix())
+    else:
+        with tarfile.open(archive, "w:gz") as tar_file:
+            tar_file.add(pollution_data, arcname="pollution_data")
+    return archive
+
+
+@pytest.fixture(params=["pollution_data.tar.gz", "pollution_data.zip"])
+def archive(tmp_workdir: Path, request) -> Path:
+    """An archive of the pollution_data directory of tmp_workdir, next to it"""
+    return _make_archive(tmp_workdir / "pollution_data", tmp_workdir / request.param)
+
+
+def test_archive_diagnostics(tmp_workdir: Path, archive: Path):
+    """Test that the diagnostics of an archive, computed from its member list, match those of the directory"""
+    assert is_archive(archive)
+    expected = get_diagnostics(tmp_workdir / "pollution_data")
+    # The archive has the pollution_data directory itself as its root
+    expected["subdirectories"] += 1
+    assert get_diagnostics(archive) == expected
+
+    tree = build_archive_tree(archive)
+    assert tree.name == "pollution_data"
+    assert tree.bytes == sum(path.stat().st_size for path in (tmp_workdir / "pollution_data").rglob("*") if path.is_file())
+
+
+def test_restructure_archive(tmp_workdir: Path, archive: Path):
+    """Test that restructuring an archive gives the same files as restructuring the directory"""
+    from_dir = tmp_workdir / "from_dir"
+    from_archive = tmp_workdir / "from_archive"
+    from_dir.mkdir()
+    from_archive.mkdir()
+
+    assert restructure_pollution_data(tmp_workdir / "pollution_data", from_dir)["copied"] == 15
+    assert restructure_pollution_data(archive, from_archive, validate=True) == {
+        "copied": 15,
+        "skipped": 0,
+        "invalid": 0,
+        "errors": {},
+    }
+    expected = {path.relative_to(from_dir): path.read_bytes() for path in from_dir.rglob("*.csv")}
+    assert {path.relative_to(from_archive): path.read_bytes() for path in from_archive.rglob("*.csv")} == expected
+    assert not list(from_archive.rglob(".*"))
+
+    assert restructure_pollution_data(archive, from_archive, incremental=True) == {"copied": 0, "skipped": 15}
+
+    shutil.rmtree(from_archive)
+    from_archive.mkdir()
+    res = restructure_pollution_data(archive, from_archive, selection=Selection(gases=("CO2",), sources=("industry",)))
+    assert res["copied"] == 1
+    assert [path.name for path in from_archive.rglob("*.csv")] == ["src_industry_CO2.csv"]
+
+
+def test_restructure_archive_variants(tmp_path: Path):
+    """Test that of a file stored both plain and compressed in an archive, the plain variant is copied, whichever comes first"""
+    plain = b"aar,x\n2000,1\n"
+    for order in (["CO2.csv.gz", "CO2.csv"], ["CO2.csv", "CO2.csv.gz"]):
+        archive = tmp_path / "pollution_data.zip"
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for name in order:
+                contents = gzip.compress(b"aar,x\n2000,2\n") if name.endswith(".gz") else plain
+                zip_file.writestr(f"pollution_data/by_src/src_a/{name}", contents)
+        dest_dir = tmp_path / "by_gas"
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        dest_dir.mkdir()
+        assert restructure_pollution_data(archive, dest_dir, keep_compressed=True) == {"copied": 1, "skipped": 0}
+        assert [path.name for path in (dest_dir / "gas_CO2").iterdir()] == ["src_a_CO2.csv"]
+        assert (dest_dir / "gas_CO2" / "src_a_CO2.csv").read_bytes() == plain
+
+    # A member already written to an archive cannot be replaced by the preferred variant coming after it
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("pollution_data/by_src/src_a/CO2.csv.gz", gzip.compress(plain))
+        zip_file.writestr("pollution_data/by_src/src_a/CO2.csv", plain)
+    with pytest.raises(ValueError, match="variant"):
+        with ArchiveSink(tmp_path / "restructured.zip") as sink:
+            restructure_pollution_data(archive, "by_gas", sink=sink)
+    assert not (tmp_path / "restructured.zip").exists()
+
+
+def test_analyze_pollution_data_archive(tmp_workdir: Path):
+    """Test that analyze_pollution_data reads pollution_data.tar.gz when there is no pollution_data directory"""
+    _make_archive(tmp_workdir / "pollution_data", tmp_workdir / "pollution_data.tar.gz")
+    shutil.rmtree(tmp_workdir / "pollution_data")
+    analyze_pollution_data(tmp_workdir, display=False)
+    figures = tmp_workdir / "pollution_data_restructured" / "figures"
+    assert sorted(path.name for path in figures.iterdir()) == ["gas_CH4.png", "gas_CO2.png", "gas_N2O.png"]
+
+
+@pytest.mark.parametrize("name", ["out.zip", "out.tar.gz", "out.tar"])
+def test_archive_sink(tmp_path: Path, name: str):
+    """Test that ArchiveSink writes the added files and entries, and leaves nothing behind when aborted"""
+    file = tmp_path / "file.csv"
+    file.write_text("year,value\n2000,1.5\n")
+    with ArchiveSink(tmp_path / name) as sink:
+        sink.add_file("a/file.csv", file)
+        with sink.open("a/entry.txt") as entry:
+            entry.write(b"kept")
+        with sink.open("a/discarded.txt") as entry:
+            entry.write(b"dropped")
+            entry.discard()
+
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(tmp_path / name) as zip_file:
+            members = {member: zip_file.read(member) for member in zip_file.namelist()}
+    else:
+        with tarfile.open(tmp_path / name) as tar_file:
+            members = {member.name: tar_file.extractfile(member).read() for member in tar_file.getmembers()}
+    assert members == {"a/file.csv": file.read_bytes(), "a/entry.txt": b"kept"}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["file.csv", name]
+
+    with pytest.raises(RuntimeError):
+        with ArchiveSink(tmp_path / "aborted.zip") as sink:
+            sink.add_file("file.csv", file)
+            raise RuntimeError
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["file.csv", name]
+
+
+def test_analyze_pollution_data_to_archive(tmp_workdir: Path):
+    """Test that analyze_pollution_data writes the restructured tree to one archive, without creating pollution_data_restructured"""
+    archive = tmp_workdir / "restructured.zip"
+    analyze_pollution_data(tmp_workdir, display=False, validate=True, archive=archive)
+    assert not (tmp_workdir / "pollution_data_restructured").exists()
+
+    with zipfile.ZipFile(archive) as zip_file:
+        names = set(zip_file.namelist())
+        assert zip_file.read("by_gas/gas_CO2/src_industry_CO2.csv") == (
+            tmp_workdir / "pollution_data" / "by_src" / "src_industry" / "CO2.csv"
+        ).read_bytes()
+    assert len([name for name in names if name.endswith(".csv")]) == 15
+    assert {"by_gas/gas_CO2/summary.json", "figures/gas_CO2.png", "validation_report.json"} <= names
+
+    with pytest.raises(ValueError):
+        analyze_pollution_data(tmp_workdir, display=False, export="columnar", archive=archive)
+
+
+def test_restructure_archive_store(tmp_workdir: Path, archive: Path):
+    """Test that the copies of an archive are deduplicated in a store, twice over, leaving no temporary file behind"""
+    from analytic_tools.archive import restructure_archive
+
+    by_gas = tmp_workdir / "by_gas"
+    by_gas.mkdir()
+    store = tmp_workdir / "store"
+    first = restructure_archive(archive, by_gas, store_dir=store)
+    second = restructure_archive(archive, by_gas, store_dir=store)
+    assert first["copied"] == second["copied"] == 15 and second["stored"] == 0
+    assert restructure_archive(archive, by_gas, store_dir=store, incremental=True)["skipped"] == 15
+    assert len(list(by_gas.rglob("*.csv"))) == 15
+    assert [*by_gas.rglob(".*"), *store.rglob(".*")] == []
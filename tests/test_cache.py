@@ -0,0 +1,79 @@
+"""Test script for the cache of parsed series in analytic_tools/cache.py
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from analytic_tools.cache import SeriesCache
+
+
+def _write_csv(path: Path, n_rows: int, offset: int = 0) -> None:
+    """Write a .csv file with a header and n_rows rows of two columns"""
+    path.write_text("aar,value\n" + "".join(f"{1990 + i},{i + offset}\n" for i in range(n_rows)))
+
+
+def test_series_cache_hits_and_invalidation(tmp_path: Path):
+    """Test that an unchanged file is parsed once, and parsed again after it changes
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory unique to the test invocation
+    Returns:
+        - None
+    """
+    cache = SeriesCache()
+    path = tmp_path / "src_industry_CO2.csv"
+    _write_csv(path, 3)
+
+    first = cache.load(path)
+    np.testing.assert_array_equal(first, [[1990, 0], [1991, 1], [1992, 2]])
+    assert cache.load(str(path)) is first
+    with pytest.raises(ValueError):
+        first[0, 1] = 5  # The cached arrays are shared, so they are read-only
+
+    _write_csv(path, 3, offset=10)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    second = cache.load(path)
+    assert second[0, 1] == 10
+
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+        "invalidations": 1,
+        "entries": 1,
+        "bytes": second.nbytes,
+    }
+
+
+def test_series_cache_memory_budget(tmp_path: Path):
+    """Test that the least recently used arrays are evicted when the memory budget is exceeded
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory unique to the test invocation
+    Returns:
+        - None
+    """
+    paths = [tmp_path / f"src_{i}_CO2.csv" for i in range(3)]
+    for path in paths:
+        _write_csv(path, 10)
+    nbytes = 10 * 2 * 8
+    cache = SeriesCache(max_bytes=2 * nbytes)
+
+    cache.load(paths[0])
+    cache.load(paths[1])
+    cache.load(paths[0])  # paths[1] is now the least recently used
+    cache.load(paths[2])
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 2 * nbytes
+    cache.load(paths[0])
+    assert cache.stats()["hits"] == 2
+    cache.load(paths[1])
+    assert cache.stats()["misses"] == 4
+
+    cache.clear()
+    assert cache.stats() == dict.fromkeys(["hits", "misses", "evictions", "invalidations", "entries", "bytes"], 0)
@@ -0,0 +1,115 @@
+"""Test script for the comparison of two snapshots of pollution_data, in analytic_tools/diff.py
+"""
+import gzip
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import analytic_tools.diff
+from analyze_pollution_data import main
+from analytic_tools.diff import build_manifest, compare_series, diff_snapshots, manifest_path, merge_join
+
+
+def _snapshots(tmp_workdir: Path) -> tuple[Path, Path]:
+    """Copy pollution_data to a later snapshot, keeping the modification times, and change it"""
+    old_dir = tmp_workdir / "pollution_data"
+    new_dir = tmp_workdir / "today" / "pollution_data"
+    shutil.copytree(old_dir, new_dir)
+    by_src = new_dir / "by_src"
+
+    # A changed value, a new year, a removed source, a new source and a new gas
+    ch4 = by_src / "src_agriculture" / "CH4.csv"
+    lines = ch4.read_text().splitlines()
+    year, value = lines[1].split(",")
+    lines[1] = f"{year},{float(value) + 5}"
+    lines.append(f"{int(lines[-1].split(',')[0]) + 1},1")
+    ch4.write_text("\n".join(lines) + "\n")
+    shutil.rmtree(by_src / "src_road_traffic")
+    (by_src / "src_volcanoes").mkdir()
+    (by_src / "src_volcanoes" / "SF6.csv").write_text("aar,Utslipp\n2020,1\n")
+    return old_dir, new_dir
+
+
+def test_merge_join():
+    """Test the pairing of two sorted manifests by key"""
+    old = [["a"], ["b"], ["d"]]
+    new = [["b"], ["c"], ["d"], ["e"]]
+    added, removed, common = merge_join(old, new)
+    assert [entry[0] for entry in added] == ["c", "e"]
+    assert [entry[0] for entry in removed] == ["a"]
+    assert [(o[0], n[0]) for o, n in common] == [("b", "b"), ("d", "d")]
+
+
+def test_compare_series():
+    """Test that the added, removed and changed years of every pair are found over the union of their years"""
+    old = [np.array([[2000, 1.0], [2001, 2.0], [2002, 3.0]]), np.array([[2000, 1.0]])]
+    new = [np.array([[2001, 2.5], [2002, 3.0], [2003, 4.0]]), np.array([[2000, 1.0 + 1e-9]])]
+    first, second = compare_series(old, new, tolerance=1e-6)
+    assert first == {"added years": [2003], "removed years": [2000], "changed years": [2001], "max change": 0.5}
+    assert second == {"added years": [], "removed years": [], "changed years": [], "max change": None}
+
+
+def test_diff_snapshots(tmp_workdir: Path):
+    """Test the report of two snapshots, and that the unchanged files are neither hashed nor read"""
+    old_dir, new_dir = _snapshots(tmp_workdir)
+    res = diff_snapshots(old_dir, new_dir)
+
+    assert res["sources"] == {"added": ["volcanoes"], "removed": ["road_traffic"]}
+    assert res["gases"] == {"added": ["SF6"], "removed": []}
+    assert res["files"]["added"] == ["by_src/src_volcanoes/SF6.csv"]
+    assert res["files"]["removed"] == [f"by_src/src_road_traffic/{gas}.csv" for gas in ["CH4", "CO2", "N2O"]]
+    assert res["files"]["changed"] == ["by_src/src_agriculture/CH4.csv"] and res["files"]["unchanged"] == 11
+    series = res["series"]["by_src/src_agriculture/CH4.csv"]
+    assert len(series["added years"]) == 1 and len(series["changed years"]) == 1 and series["max change"] == 5
+    assert (res["hashed"], res["read"]) == (0, 2)
+    # The manifests are kept with the outputs of the pipeline, out of the snapshot and its working directory
+    assert manifest_path(new_dir) == new_dir.parent / "pollution_data_restructured" / "pollution_data.manifest.json"
+    assert manifest_path(new_dir).exists() and manifest_path(old_dir).exists()
+
+    # A copy of the same contents with a new modification time is hashed once, then recognised from the manifest
+    other_dir = tmp_workdir / "copy" / "pollution_data"
+    shutil.copytree(old_dir, other_dir, copy_function=shutil.copyfile)
+    res = diff_snapshots(old_dir, other_dir)
+    assert res["files"] == {"added": [], "removed": [], "changed": [], "unchanged": 15} and res["read"] == 0
+    assert res["hashed"] == 30
+    assert diff_snapshots(old_dir, other_dir)["hashed"] == 0
+
+    # A recompressed file has the same contents
+    path = other_dir / "by_src" / "src_agriculture" / "CH4.csv"
+    path.with_name("CH4.csv.gz").write_bytes(gzip.compress(b"aar,Utslipp\n2020,1\n"))
+    # Of both variants, only the plain one is described, as it is the one restructured
+    keys = [entry[0] for entry in build_manifest(other_dir)["entries"]]
+    assert len(keys) == len(set(keys)) == 15
+    res = diff_snapshots(old_dir, other_dir)
+    assert res["files"]["changed"] == [] and res["files"]["unchanged"] == 15
+    path.with_name("CH4.csv.gz").write_bytes(gzip.compress(path.read_bytes()))
+    path.unlink()
+    assert build_manifest(other_dir)["entries"][0][:2] == ["by_src/src_agriculture/CH4.csv", "by_src/src_agriculture/CH4.csv.gz"]
+    res = diff_snapshots(old_dir, other_dir)
+    assert res["files"]["changed"] == [] and res["hashed"] == 1
+
+
+def test_diff_command_line(tmp_workdir: Path, capsys):
+    """Test the diff command, which exits with 1 when the snapshots differ"""
+    _, new_dir = _snapshots(tmp_workdir)
+    assert main(["diff", str(new_dir.parent), "--against", str(tmp_workdir), "-f", "json"]) == 1
+    res = json.loads(capsys.readouterr().out)
+    assert res["files"]["changed"] == ["by_src/src_agriculture/CH4.csv"]
+    assert main(["diff", str(tmp_workdir), "--against", str(tmp_workdir), "-f", "json"]) == 0
+
+
+@pytest.mark.parametrize("options, workers", [([], 4), (["-j", "1"], 1)])
+def test_diff_command_line_workers(tmp_workdir: Path, monkeypatch, options: list[str], workers: int):
+    """Test that the diff command hashes with four workers by default, and with as many as asked for otherwise"""
+    calls = []
+
+    def diff(*args, **kwargs):
+        calls.append(kwargs["workers"])
+        return diff_snapshots(*args, **kwargs)
+
+    monkeypatch.setattr(analytic_tools.diff, "diff_snapshots", diff)
+    assert main(["diff", str(tmp_workdir), "--against", str(tmp_workdir), "-f", "json", *options]) == 0
+    assert calls == [workers]
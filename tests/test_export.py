@@ -0,0 +1,82 @@
+"""Test script for the functions in analytic_tools/export.py
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from analytic_tools.export import ColumnarWriter, export_pollution_data, has_pyarrow, read_columnar
+from analyze_pollution_data import analyze_pollution_data, main
+
+
+@pytest.fixture
+def by_gas(tmp_path: Path) -> Path:
+    """A by_gas directory with two gases, where one source misses a year"""
+    co2_dir = tmp_path / "by_gas" / "gas_CO2"
+    co2_dir.mkdir(parents=True)
+    (co2_dir / "src_road_traffic_CO2.csv").write_text("aar,value\n1990,1\n1991,3\n1992,5\n")
+    (co2_dir / "src_industry_CO2.csv").write_text("aar,value\n1990,3\n1992,5\n")
+    ch4_dir = tmp_path / "by_gas" / "gas_CH4"
+    ch4_dir.mkdir()
+    (ch4_dir / "src_industry_CH4.csv").write_text("aar,value\n1990,0.5\n")
+    return tmp_path / "by_gas"
+
+
+def test_export_columnar(by_gas: Path, tmp_path: Path):
+    """Test that the columnar export holds one row per reported (gas, source, year)"""
+    res = export_pollution_data(by_gas, tmp_path, format="columnar")
+    assert res == {"path": str(tmp_path / "pollution_data.pdcol"), "format": "columnar", "gases": 2, "rows": 6}
+
+    table = read_columnar(res["path"])
+    rows = sorted(zip(table["gas"], table["source"], table["year"].tolist(), table["value"].tolist()))
+    assert rows == [
+        ("CH4", "industry", 1990, 0.5),
+        ("CO2", "industry", 1990, 3.0),
+        ("CO2", "industry", 1992, 5.0),
+        ("CO2", "road_traffic", 1990, 1.0),
+        ("CO2", "road_traffic", 1991, 3.0),
+        ("CO2", "road_traffic", 1992, 5.0),
+    ]
+    assert not any(path.name.startswith(".") for path in tmp_path.iterdir())
+
+
+def test_columnar_writer_empty(tmp_path: Path):
+    """Test that a table without row groups can be read back"""
+    with ColumnarWriter(tmp_path / "empty.pdcol"):
+        pass
+    table = read_columnar(tmp_path / "empty.pdcol")
+    assert all(column.size == 0 for column in table.values())
+
+
+def test_export_format_errors(by_gas: Path, tmp_path: Path):
+    """Test that unknown formats are rejected, and parquet without pyarrow"""
+    with pytest.raises(ValueError):
+        export_pollution_data(by_gas, tmp_path, format="feather")
+    if not has_pyarrow():
+        with pytest.raises(ImportError):
+            export_pollution_data(by_gas, tmp_path, format="parquet")
+
+
+def test_export_parquet(by_gas: Path, tmp_path: Path):
+    """Test that the parquet export has the same rows as the columnar one"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    res = export_pollution_data(by_gas, tmp_path, format="parquet")
+    table = pq.read_table(res["path"]).to_pydict()
+    columnar = read_columnar(export_pollution_data(by_gas, tmp_path, format="columnar")["path"])
+    assert table["year"] == columnar["year"].tolist()
+    assert table["value"] == columnar["value"].tolist()
+
+
+def test_analyze_pollution_data_export(tmp_workdir: Path, capsys):
+    """Test the export stage of analyze_pollution_data and the export command"""
+    analyze_pollution_data(tmp_workdir, display=False, export="columnar")
+    restructured = tmp_workdir / "pollution_data_restructured"
+    table = read_columnar(restructured / "pollution_data.pdcol")
+    assert sorted(set(table["gas"])) == ["CH4", "CO2", "N2O"]
+    assert table["year"].size == 15 * 33
+
+    assert main(["export", str(tmp_workdir), "--export", "columnar", "--gas", "CO2", "--format", "json"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert (out["gases"], out["rows"]) == (1, 5 * 33)
+    np.testing.assert_array_equal(np.unique(read_columnar(out["path"])["gas"]), ["CO2"])
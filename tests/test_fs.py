@@ -0,0 +1,291 @@
+"""Test script for the filesystem backends, in analytic_tools/fs.py, against an in-process fake object store
+"""
+import email.utils
+import hashlib
+import threading
+import time
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from analyze_pollution_data import main, restructure_pollution_data
+from analytic_tools.fs import LocalFileSystem, ObjectStoreFileSystem
+from analytic_tools.utilities import Selection
+
+_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class FakeObjectStore(ThreadingHTTPServer):
+    """An in-memory object store with one bucket, serving the subset of the S3 REST API used by ObjectStoreFileSystem"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeObjectStoreHandler)
+        self.objects = {}
+        self.uploads = {}
+        self.connections = 0
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/bucket"
+
+
+def _xml(tag, children):
+    """Serialize an S3 response, children being (tag, text) pairs or (tag, list of pairs) for nested elements"""
+    root = ET.Element(tag, xmlns=_NAMESPACE)
+
+    def add(parent, items):
+        for name, value in items:
+            element = ET.SubElement(parent, name)
+            if isinstance(value, list):
+                add(element, value)
+            else:
+                element.text = str(value)
+
+    add(root, children)
+    return ET.tostring(root)
+
+
+class _FakeObjectStoreHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        bucket, _, key = urllib.parse.unquote(url.path).lstrip("/").partition("/")
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        with self.server.lock:
+            self.server.requests.append((self.command, key, query, dict(self.headers)))
+        return key, query
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _list(self, query):
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter")
+        entries = {}
+        for key, (data, mtime) in self.server.objects.items():
+            if not key.startswith(prefix):
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest.split(delimiter, 1)[0] + delimiter
+                entries[common] = ("CommonPrefixes", [("Prefix", common)])
+            else:
+                modified = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(mtime))
+                entries[key] = ("Contents", [("Key", key), ("LastModified", modified), ("Size", len(data))])
+        names = [name for name in sorted(entries) if name > query.get("continuation-token", "")]
+        page = names[: int(query.get("max-keys", 1000))]
+        truncated = len(page) < len(names)
+        children = [entries[name] for name in page] + [("IsTruncated", "true" if truncated else "false")]
+        if truncated:
+            children.append(("NextContinuationToken", page[-1]))
+        self._send(200, _xml("ListBucketResult", children))
+
+    def do_GET(self):
+        key, query = self._parse()
+        if not key:
+            return self._list(query)
+        self.do_HEAD(key)
+
+    def do_HEAD(self, key=None):
+        if key is None:
+            key, _ = self._parse()
+        if key not in self.server.objects:
+            return self._send(404)
+        data, mtime = self.server.objects[key]
+        self._send(200, data, [("Last-Modified", email.utils.formatdate(mtime, usegmt=True))])
+
+    def do_PUT(self):
+        key, query = self._parse()
+        data = self._body()
+        source = self.headers.get("x-amz-copy-source")
+        if source:
+            src_key = urllib.parse.unquote(source).lstrip("/").partition("/")[2]
+            if src_key not in self.server.objects:
+                return self._send(404)
+            data = self.server.objects[src_key][0]
+            byte_range = self.headers.get("x-amz-copy-source-range")
+            if byte_range:
+                first, last = byte_range[len("bytes="):].split("-")
+                data = data[int(first) : int(last) + 1]
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if "uploadId" in query:
+            with self.server.lock:
+                self.server.uploads[query["uploadId"]][int(query["partNumber"])] = (etag, data)
+            if source:
+                return self._send(200, _xml("CopyPartResult", [("ETag", etag)]))
+            return self._send(200, headers=[("ETag", etag)])
+        with self.server.lock:
+            self.server.objects[key] = (data, time.time())
+        self._send(200, _xml("CopyObjectResult", [("ETag", etag)]) if source else b"", [("ETag", etag)])
+
+    def do_POST(self):
+        key, query = self._parse()
+        body = self._body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.uploads[upload_id] = {}
+            return self._send(200, _xml("InitiateMultipartUploadResult", [("Key", key), ("UploadId", upload_id)]))
+        with self.server.lock:
+            parts = self.server.uploads.pop(query["uploadId"])
+        data = b""
+        for number, part in enumerate(ET.fromstring(body), start=1):
+            etag, part_data = parts[int(part.find("PartNumber").text)]
+            assert int(part.find("PartNumber").text) == number and part.find("ETag").text == etag
+            data += part_data
+        with self.server.lock:
+            self.server.objects[key] = (data, time.time())
+        self._send(200, _xml("CompleteMultipartUploadResult", [("Key", key)]))
+
+    def do_DELETE(self):
+        key, query = self._parse()
+        with self.server.lock:
+            if "uploadId" in query:
+                self.server.uploads.pop(query["uploadId"], None)
+            else:
+                self.server.objects.pop(key, None)
+        self._send(204)
+
+
+@pytest.fixture
+def object_store():
+    """A fake object store served by a thread of the test process"""
+    server = FakeObjectStore()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _upload(fs, local_dir: Path, prefix: str):
+    """Write the files of the tree under local_dir to prefix in fs"""
+    for path in sorted(local_dir.rglob("*")):
+        if path.is_file():
+            with fs.open(f"{prefix}/{path.relative_to(local_dir).as_posix()}", "wb") as file:
+                file.write(path.read_bytes())
+
+
+def test_object_store_file_system(object_store):
+    """Test the operations of ObjectStoreFileSystem, with paged listings, multipart uploads and copies and pooled connections"""
+    with ObjectStoreFileSystem(object_store.url + "/root", page_size=2, part_size=10, workers=3, max_connections=2) as fs:
+        large = bytes(range(256)) * 4
+        with fs.open("data/large.bin", "wb") as file:
+            file.write(large[:500])
+            file.write(large[500:])
+        for i in range(5):
+            with fs.open(f"data/small_{i}.txt", "wb") as file:
+                file.write(f"file {i}".encode())
+        with fs.open("data/sub/nested.txt", "wb") as file:
+            file.write(b"nested")
+        assert object_store.objects["root/data/large.bin"][0] == large
+
+        with fs.open("data/large.bin") as file:
+            assert file.read() == large
+        info = fs.stat("data/large.bin")
+        assert (info.size, info.is_dir) == (len(large), False)
+        assert fs.stat("data/sub").is_dir
+        with pytest.raises(FileNotFoundError):
+            fs.stat("data/missing.txt")
+
+        # Seven entries, listed two at a time
+        before = len(object_store.requests)
+        names = [(info.name, info.is_dir) for info in fs.list("data")]
+        assert names == [("large.bin", False), *[(f"small_{i}.txt", False) for i in range(5)], ("sub", True)]
+        assert len(object_store.requests) - before == 4
+        assert [(dirpath, dirnames) for dirpath, dirnames, _ in fs.walk("data")] == [("data", ["sub"]), ("data/sub", [])]
+
+        fs.copy("data/small_0.txt", "copy/small.txt")
+        fs.copy("data/large.bin", "copy/large.bin")
+        assert object_store.objects["root/copy/small.txt"][0] == b"file 0"
+        assert object_store.objects["root/copy/large.bin"][0] == large
+        part_copies = [request for request in object_store.requests if "x-amz-copy-source-range" in request[3]]
+        assert len(part_copies) == 103
+
+        # A write interrupted by an error publishes nothing, and its multipart upload is aborted
+        for size in (5, 25):
+            with pytest.raises(RuntimeError):
+                with fs.open("data/failed.bin", "wb") as file:
+                    file.write(large[:size])
+                    raise RuntimeError("interrupted")
+            assert not fs.exists("data/failed.bin")
+        assert not object_store.uploads
+
+        fs.delete("data")
+        assert not fs.exists("data") and fs.exists("copy/small.txt")
+        assert not object_store.uploads
+    # Every request went through at most two kept-alive connections
+    assert object_store.connections <= 2
+
+
+def test_restructure_object_store(tmp_workdir: Path, object_store):
+    """Test that restructuring inside an object store gives the same files as on the local disk"""
+    expected_dir = tmp_workdir / "expected"
+    expected_dir.mkdir()
+    restructure_pollution_data(tmp_workdir / "pollution_data", expected_dir)
+    expected = {path.relative_to(expected_dir).as_posix(): path.read_bytes() for path in expected_dir.rglob("*.csv")}
+
+    with ObjectStoreFileSystem(object_store.url) as fs:
+        _upload(fs, tmp_workdir / "pollution_data", "snapshot/pollution_data")
+        res = restructure_pollution_data("snapshot/pollution_data", "snapshot/by_gas", workers=4, fs=fs)
+        assert res == {"copied": 15, "skipped": 0}
+        copies = {key[len("snapshot/by_gas/"):]: data for key, (data, _) in object_store.objects.items() if "by_gas" in key}
+        assert copies == expected
+        # Plain copies are made on the server side, without reading the objects
+        assert not any(method == "GET" and "by_src" in key for method, key, _, _ in object_store.requests)
+
+        res = restructure_pollution_data("snapshot/pollution_data", "snapshot/by_gas", incremental=True, fs=fs)
+        assert res == {"copied": 0, "skipped": 15}
+
+    selection = ["--gas", "CO2", "--years", "2000-2010", "--validate", "-f", "json"]
+    assert main(["restructure", "snapshot", "--object-store", object_store.url, *selection]) == 0
+    lines = object_store.objects["snapshot/pollution_data_restructured/by_gas/gas_CO2/src_industry_CO2.csv"][0].splitlines()
+    assert [int(line.split(b",")[0]) for line in lines[1:]] == list(range(2000, 2011))
+    # The content-addressed store is on the local disk, and cannot hold the copies of an object store
+    with pytest.raises(SystemExit):
+        main(["restructure", "snapshot", "--object-store", object_store.url, "--store", str(tmp_workdir / "store")])
+
+
+def test_restructure_local_file_system(tmp_workdir: Path):
+    """Test that restructuring through LocalFileSystem gives the same files as restructure_pollution_data"""
+    expected_dir = tmp_workdir / "expected"
+    expected_dir.mkdir()
+    selection = Selection(exclude_gases=("N2O",))
+    restructure_pollution_data(tmp_workdir / "pollution_data", expected_dir, selection=selection)
+
+    fs = LocalFileSystem(tmp_workdir)
+    res = restructure_pollution_data("pollution_data", "restructured", validate=True, selection=selection, fs=fs)
+    assert res == {"copied": 10, "skipped": 0, "invalid": 0, "errors": {}}
+    actual_dir = tmp_workdir / "restructured"
+    assert {path.relative_to(actual_dir): path.read_bytes() for path in actual_dir.rglob("*.csv")} == {
+        path.relative_to(expected_dir): path.read_bytes() for path in expected_dir.rglob("*.csv")
+    }
+    assert [info.name for info in fs.list("restructured")] == ["gas_CH4", "gas_CO2"]
+    fs.delete("restructured")
+    assert not fs.exists("restructured")
@@ -0,0 +1,64 @@
+"""Regression tests making sure that importing the package and the main script stays cheap,
+i.e. that matplotlib and numpy are only imported once they are actually needed
+"""
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+repo_dir = Path(__file__).parents[1].resolve()
+
+HEAVY_MODULES = ["matplotlib", "numpy"]
+
+
+def _loaded_modules(module: str) -> set[str]:
+    """Import module in a fresh interpreter and return the names of all modules loaded afterwards
+
+    Parameters:
+        - module (str) : Name of the module to import
+
+    Returns:
+        - (set[str]) : Names of the modules found in sys.modules after the import
+    """
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(out.stdout.split())
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "analytic_tools",
+        "analytic_tools.utilities",
+        "analytic_tools.plotting",
+        "analytic_tools.export",
+        "analytic_tools.throttle",
+        "analytic_tools.fs",
+        "analytic_tools.shard",
+        "analytic_tools.progress",
+        "analytic_tools.locking",
+        "analytic_tools.diff",
+        "analyze_pollution_data",
+    ],
+)
+def test_import_does_not_load_heavy_modules(module):
+    """Check that importing module does not pull in matplotlib or numpy
+
+    Parameters:
+        - module (str) : Name of the module to import
+
+    Returns:
+        None
+    """
+    loaded = _loaded_modules(module)
+    for heavy in HEAVY_MODULES:
+        assert heavy not in loaded, f"Importing {module} also imported {heavy}"
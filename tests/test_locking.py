@@ -0,0 +1,98 @@
+"""Test script for the locking of simultaneous runs on the same work_dir, in analytic_tools/locking.py
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from analyze_pollution_data import analyze_pollution_data
+from analytic_tools.locking import LOCKS_DIR_NAME, FileLock, WorkDirLocks, has_fcntl
+from analytic_tools.utilities import atomic_write
+
+SCRIPT = Path(__file__).parents[1] / "analyze_pollution_data.py"
+
+pytestmark = pytest.mark.skipif(not has_fcntl(), reason="fcntl locks are not available on this platform")
+
+
+def test_file_lock(tmp_path: Path):
+    """Test that a lock is held by one FileLock at a time, and that a lock left by a dead process is broken"""
+    path = tmp_path / "run.lock"
+    with FileLock(path) as first:
+        assert first.locked and first.holder()["pid"] == os.getpid()
+        # flock locks belong to an open file, so a second FileLock of the same process is refused too
+        second = FileLock(path, poll_interval=0.01)
+        assert not second.acquire(blocking=False)
+        assert not second.acquire(timeout=0.05) and second.waited
+    assert first.holder() is None
+    assert second.acquire(blocking=False) and not second.waited
+    second.release()
+
+    # The holder named in the file no longer exists, while its lock is still held (e.g. by a lost NFS lock)
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    stuck = FileLock(path)
+    stuck.acquire()
+    path.write_text(json.dumps({"host": socket.gethostname(), "pid": int(dead.stdout), "time": 0}))
+    with FileLock(path) as third:
+        assert third.locked and third.holder()["pid"] == os.getpid()
+    stuck.release()
+
+
+def test_work_dir_locks(tmp_workdir: Path):
+    """Test the skip and wait policies of a run finding work_dir locked by another run"""
+    restructured_dir = tmp_workdir / "pollution_data_restructured"
+    with WorkDirLocks(restructured_dir).run() as acquired:
+        assert acquired
+        with WorkDirLocks(restructured_dir, policy="skip").run() as acquired:
+            assert not acquired
+        with WorkDirLocks(restructured_dir, policy="skip").gas("gas_CO2") as acquired:
+            assert acquired
+
+        analyze_pollution_data(tmp_workdir, display=False, lock="skip")
+        assert not (restructured_dir / "by_gas").exists()
+        with pytest.raises(TimeoutError):
+            analyze_pollution_data(tmp_workdir, display=False, lock="wait", lock_timeout=0.2)
+    assert (restructured_dir / LOCKS_DIR_NAME / "run.lock").exists()
+
+    with pytest.raises(ValueError):
+        WorkDirLocks(restructured_dir, policy="ignore")
+
+
+def test_atomic_write(tmp_path: Path):
+    """Test that a failed write leaves the previous contents, and no temporary file, behind"""
+    path = tmp_path / "summary.json"
+    with atomic_write(path, "w") as file:
+        file.write("new")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, "w") as file:
+            file.write("partial")
+            raise RuntimeError("interrupted")
+    assert path.read_text() == "new"
+    assert [child.name for child in tmp_path.iterdir()] == ["summary.json"]
+
+
+def test_concurrent_runs(tmp_workdir: Path):
+    """Test the command line interface with two runs started at once on the same work_dir, the second one
+    waiting for the first and reusing its copies and plots"""
+    processes = [
+        subprocess.Popen(
+            [sys.executable, str(SCRIPT), "run", str(tmp_workdir), "--lock", "wait", "-j", "2", "-f", "json"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for _ in range(2)
+    ]
+    for process in processes:
+        _, stderr = process.communicate(timeout=300)
+        assert process.returncode == 0, stderr.decode()
+
+    restructured_dir = tmp_workdir / "pollution_data_restructured"
+    assert len(list((restructured_dir / "by_gas").rglob("*.csv"))) == 15
+    assert len(list((restructured_dir / "by_gas").rglob("summary.json"))) == 3
+    assert len(list((restructured_dir / "figures").glob("*.png"))) == 3
+    # Every temporary file was renamed into place
+    leftovers = [path for path in restructured_dir.rglob(".*") if path.parent.name != LOCKS_DIR_NAME and path.name != LOCKS_DIR_NAME]
+    assert leftovers == []
@@ -0,0 +1,120 @@
+"""Test script for the functions in analytic_tools/plotting.py
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from analytic_tools.plotting import (
+    MAX_LEGEND_ENTRIES,
+    GasFigure,
+    OutputSpec,
+    create_plot,
+    parse_output_spec,
+    plot_pollution_data,
+)
+
+
+def _write_gas_dir(parent: Path, gas: str, n_series: int) -> Path:
+    """Create a gas_[gas] directory with n_series small series"""
+    gas_dir = parent / f"gas_{gas}"
+    gas_dir.mkdir()
+    for i in range(n_series):
+        (gas_dir / f"src_source_{i}_{gas}.csv").write_text(f"aar,value\n1990,{i}\n1991,{i + 1}\n1992,{2 * i}\n")
+    return gas_dir
+
+
+def test_create_plot_reuses_figure(tmp_path: Path):
+    """Test that one GasFigure can draw several gases in a row, replacing the data, title and legend
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory unique to the test invocation
+    Returns:
+        - None
+    """
+    figure = GasFigure()
+    many = _write_gas_dir(tmp_path, "CO2", MAX_LEGEND_ENTRIES + 1)
+    few = _write_gas_dir(tmp_path, "CH4", 3)
+
+    create_plot(many, tmp_path, figure=figure)
+    assert len(figure.lines.get_segments()) == MAX_LEGEND_ENTRIES + 1
+    assert figure.axes.get_legend() is None
+    assert figure.axes.get_ylim()[1] >= 2 * MAX_LEGEND_ENTRIES
+
+    create_plot(few, tmp_path, figure=figure)
+    assert len(figure.lines.get_segments()) == 3
+    assert [text.get_text() for text in figure.axes.get_legend().get_texts()] == ["source 0 ", "source 1 ", "source 2 "]
+    assert "three different sources" in figure.axes.get_title()
+    # The limits follow the new data instead of growing with every gas
+    assert figure.axes.get_ylim()[1] < 2 * MAX_LEGEND_ENTRIES
+    np.testing.assert_array_equal(figure.lines.get_segments()[2], [[1990, 2], [1991, 3], [1992, 4]])
+
+    assert (tmp_path / "gas_CO2.png").stat().st_size > 0
+    assert (tmp_path / "gas_CH4.png").stat().st_size > 0
+
+
+def test_create_plot_trend(tmp_path: Path):
+    """Test that the trend lines are drawn over the years of their series, and removed when the next plot has none"""
+    figure = GasFigure()
+    gas_dir = _write_gas_dir(tmp_path, "CO2", 3)
+    (gas_dir / "src_source_3_CO2.csv").write_text("aar,value\n1991,4\n1992,6\n")
+
+    create_plot(gas_dir, tmp_path, figure=figure, trend=1)
+    trends = figure.trend_lines.get_segments()
+    assert len(trends) == 4
+    np.testing.assert_allclose(trends[1], [[1990, 7 / 6], [1991, 10 / 6], [1992, 13 / 6]])
+    np.testing.assert_allclose(trends[3], [[1991, 4], [1992, 6]])
+
+    create_plot(gas_dir, tmp_path, figure=figure)
+    assert len(figure.trend_lines.get_segments()) == 0
+
+
+def test_plot_pollution_data_outputs(tmp_path: Path):
+    """Test that every output spec is saved from a single drawing, with thumbnails at the requested size
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory unique to the test invocation
+    Returns:
+        - None
+    """
+    from PIL import Image
+
+    by_gas = tmp_path / "by_gas"
+    figures = tmp_path / "figures"
+    by_gas.mkdir()
+    figures.mkdir()
+    _write_gas_dir(by_gas, "CO2", 3)
+    _write_gas_dir(by_gas, "N2O", 2)
+
+    outputs = [OutputSpec(), OutputSpec("svg"), parse_output_spec("png:40:4x4:thumb"), parse_output_spec("jpg:20:thumb")]
+    res = plot_pollution_data(by_gas, figures, outputs=outputs, parallel_thumbnails=True)
+    assert res == {"plotted": 2, "skipped": 0}
+
+    for gas in ["CO2", "N2O"]:
+        assert (figures / f"gas_{gas}.svg").read_text().lstrip().startswith("<?xml")
+        assert Image.open(figures / f"gas_{gas}.png").size == (2000, 1600)
+        # The 10x8 inch figure fitted within 4x4 inches at dpi=40
+        assert Image.open(figures / f"gas_{gas}_thumb.png").size == (160, 128)
+        assert Image.open(figures / f"gas_{gas}_thumb.jpg").size == (200, 160)
+
+    res = plot_pollution_data(by_gas, figures, outputs=outputs, incremental=True)
+    assert res == {"plotted": 0, "skipped": 2}
+
+
+@pytest.mark.parametrize("text", ["", "png:x", "png:100:4", "svg:100:thumb", "png:1:2:3:4"])
+def test_parse_output_spec_exceptions(text: str):
+    """Test the error handling of parse_output_spec
+
+    Parameters:
+        - text (str): the invalid spec
+    Returns:
+        - None
+    """
+    with pytest.raises(ValueError):
+        parse_output_spec(text)
+
+
+def test_plot_pollution_data_duplicate_outputs(tmp_path: Path):
+    """Test that outputs saved to the same file are rejected"""
+    with pytest.raises(ValueError):
+        plot_pollution_data(tmp_path, tmp_path, outputs=[OutputSpec("png"), OutputSpec("png", dpi=50)])
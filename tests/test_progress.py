@@ -0,0 +1,149 @@
+"""Test script for the live progress reporting, in analytic_tools/progress.py
+"""
+import io
+import threading
+from pathlib import Path
+
+import pytest
+
+from analyze_pollution_data import main, restructure_pollution_data
+from analytic_tools.progress import LogRenderer, Progress, ProgressReporter, Snapshot, TtyRenderer, report_progress
+from analytic_tools.utilities import find_gas_csv_files
+
+
+class FakeClock:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _snapshot(**fields) -> Snapshot:
+    defaults = {"stage": "restructure", "files": 0, "bytes": 0, "dirs": 0, "elapsed": 0.0, "files_per_second": 0.0, "bytes_per_second": 0.0}
+    return Snapshot(**{**defaults, **fields})
+
+
+def test_progress_counts_threads():
+    """Test that the counts of many threads, each in a slot of its own, are all in the snapshot"""
+    progress = Progress()
+    progress.add(files=1)
+    assert progress.snapshot().files == 0
+
+    progress.enabled = True
+    progress.stage("copy")
+
+    def count():
+        for _ in range(1000):
+            progress.add(files=1, bytes=10)
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = progress.snapshot()
+    assert (snapshot.files, snapshot.bytes) == (8000, 80000)
+
+    # A new stage counts from zero again
+    progress.stage("plot", files=3)
+    progress.add(files=1)
+    assert (progress.snapshot().stage, progress.snapshot().files) == ("plot", 1)
+
+    # The slots of the threads that ended are dropped, keeping their counts
+    for _ in range(3):
+        thread = threading.Thread(target=count)
+        thread.start()
+        thread.join()
+    assert progress.snapshot().files == 3001
+    assert len(progress._slots) <= 2
+
+
+def test_progress_rates_and_eta():
+    """Test the smoothed rates and the estimated time left, from the bytes if their total is known"""
+    clock = FakeClock()
+    progress = Progress(smoothing=0.5, clock=clock)
+    progress.enabled = True
+    progress.stage("restructure", files=100, bytes=1000)
+
+    progress.add(files=10, bytes=100)
+    clock.now += 1
+    snapshot = progress.snapshot()
+    assert (snapshot.files_per_second, snapshot.bytes_per_second) == (10, 100)
+    assert snapshot.eta == pytest.approx(9)
+
+    progress.add(files=30, bytes=300)
+    clock.now += 1
+    snapshot = progress.snapshot()
+    # Half of the latest rate and half of the previous one
+    assert (snapshot.files_per_second, snapshot.bytes_per_second) == (20, 200)
+    assert snapshot.eta == pytest.approx(3)
+    assert snapshot.line() == "restructure: 40/100 files, 400 B/1000 B, 200 B/s, 20 files/s, ETA 0:03"
+
+    progress.stage("plot", files=4)
+    progress.add(files=1)
+    clock.now += 2
+    assert progress.snapshot().eta == pytest.approx(6)
+
+
+def test_renderers():
+    """Test that the terminal renderer rewrites its line and keeps one per stage, and that the log renderer is rate limited"""
+    stream = io.StringIO()
+    tty = TtyRenderer(stream)
+    tty(_snapshot(files=1))
+    tty(_snapshot(files=2))
+    tty(_snapshot(stage="plot", files=1))
+    tty.close()
+    lines = stream.getvalue().split("\n")
+    assert len(lines) == 3 and lines[0].count("\r") == 2 and lines[0].endswith("restructure: 2 files, 0 B, 0 B/s, 0 files/s")
+    assert lines[1].endswith("plot: 1 files, 0 B, 0 B/s, 0 files/s") and lines[2] == ""
+
+    stream = io.StringIO()
+    log = LogRenderer(stream=stream, interval=10)
+    for elapsed in [0, 1, 5, 10.5, 12]:
+        log(_snapshot(elapsed=elapsed))
+    log(_snapshot(stage="plot", elapsed=0.1))
+    log(_snapshot(stage="plot", elapsed=0.2, done=True))
+    lines = stream.getvalue().splitlines()
+    assert [line.split(":")[0] for line in lines] == ["restructure", "restructure", "plot", "plot"]
+    assert lines[-1].endswith("done in 0:00")
+
+
+def test_report_progress_restructure(tmp_workdir: Path):
+    """Test that the copies of restructure_pollution_data are reported, with their totals known up front"""
+    snapshots = []
+    by_gas_dir = tmp_workdir / "by_gas"
+    by_gas_dir.mkdir()
+    with report_progress(snapshots.append, interval=0.01) as progress:
+        assert progress.enabled
+        restructure_pollution_data(tmp_workdir / "pollution_data", by_gas_dir, workers=4)
+    assert not progress.enabled
+
+    last = snapshots[-1]
+    sizes = sum(path.stat().st_size for path in find_gas_csv_files(tmp_workdir / "pollution_data"))
+    assert last.done and last.stage == "restructure"
+    assert (last.files, last.total_files, last.bytes, last.total_bytes) == (15, 15, sizes, sizes)
+
+    # Without callbacks, nothing is counted
+    with report_progress() as progress:
+        assert not progress.enabled
+
+
+def test_progress_command_line(tmp_workdir: Path, capsys):
+    """Test that --progress log reports every stage of run on stderr, leaving stdout to the report"""
+    assert main(["run", str(tmp_workdir), "--progress", "log", "-f", "json"]) == 0
+    captured = capsys.readouterr()
+    stages = {line.split(":")[0] for line in captured.err.splitlines()}
+    assert {"scan", "restructure", "summarize", "plot", "diagnose"} <= stages
+    assert any(line.startswith("plot: 3/3 files") and "done in" in line for line in captured.err.splitlines())
+    assert captured.out.startswith('{"command": "run"')
+
+
+def test_progress_reporter_closes_callbacks():
+    """Test that the reporter sends a last snapshot and closes the callbacks that can be closed"""
+    stream = io.StringIO()
+    with ProgressReporter([TtyRenderer(stream)], interval=60, source=Progress()):
+        pass
+    assert stream.getvalue().endswith("done in 0:00\n")
@@ -0,0 +1,126 @@
+"""Test script for the sharding of the pipeline over several processes, in analytic_tools/shard.py
+"""
+import json
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from analyze_pollution_data import restructure_pollution_data
+from analytic_tools.plotting import plot_pollution_data
+from analytic_tools.shard import SHARDS_DIR_NAME, Shard, ShardCoordinator, parse_shard, shard_of
+
+SCRIPT = Path(__file__).parents[1] / "analyze_pollution_data.py"
+
+
+def test_parse_shard():
+    """Test the parsing of shards and that every key belongs to exactly one of them"""
+    assert parse_shard("1/4") == Shard(1, 4)
+    assert str(Shard(1, 4)) == "1/4"
+    for text in ["4/4", "-1/2", "1", "a/b", "0/0"]:
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+    keys = [f"by_src/src_{i}" for i in range(100)]
+    shards = [Shard(i, 3) for i in range(3)]
+    assert all(sum(shard.owns(key) for shard in shards) == 1 for key in keys)
+    assert [shard_of(key, 3) for key in keys] == [shard_of(key, 3) for key in keys]
+    assert all(any(shard.owns(key) for key in keys) for shard in shards)
+
+
+def test_shard_coordinator(tmp_path: Path):
+    """Test that only the shard finishing last merges the manifests, once, and that a failed merge is retried"""
+    coordinator = ShardCoordinator(tmp_path / SHARDS_DIR_NAME, 3)
+    assert coordinator.finish(Shard(2, 3), {"copied": 2, "errors": {"a": ["bad"]}}) is None
+    assert coordinator.finish(Shard(0, 3), {"copied": 1, "errors": {}}) is None
+    assert coordinator.pending() == [1]
+
+    merged = coordinator.finish(Shard(1, 3), {"copied": 4, "errors": {"b": ["worse"]}})
+    assert merged == {"copied": 7, "errors": {"a": ["bad"], "b": ["worse"]}, "shards": 3}
+    assert json.loads(coordinator.merged_path.read_text()) == merged
+    # The lock is held until the merging worker is done
+    assert coordinator.finish(Shard(1, 3), {"copied": 4}) is None
+
+    # Without complete, e.g. after a failure, the next shard to finish merges again
+    coordinator.release()
+    assert coordinator.finish(Shard(0, 3), {"copied": 1, "errors": {}})["copied"] == 7
+    coordinator.complete()
+    assert coordinator.pending() == [0, 1, 2] and not coordinator.lock_path.exists()
+
+    # A lock left behind by a process that no longer exists is taken over
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    coordinator.lock_path.write_text(json.dumps({"host": socket.gethostname(), "pid": int(dead.stdout)}))
+    assert coordinator.acquire()
+    with pytest.raises(ValueError):
+        coordinator.finish(Shard(0, 2), {})
+
+
+def test_sharded_restructure_and_plot(tmp_workdir: Path):
+    """Test that the shards of the restructuring and the plotting together do the work of one unsharded run"""
+    expected_dir = tmp_workdir / "expected"
+    expected_dir.mkdir()
+    restructure_pollution_data(tmp_workdir / "pollution_data", expected_dir)
+
+    by_gas_dir = tmp_workdir / "by_gas"
+    by_gas_dir.mkdir()
+    copied = [restructure_pollution_data(tmp_workdir / "pollution_data", by_gas_dir, shard=Shard(i, 3))["copied"] for i in range(3)]
+    assert sum(copied) == 15
+    assert sorted(path.relative_to(by_gas_dir) for path in by_gas_dir.rglob("*.csv")) == sorted(
+        path.relative_to(expected_dir) for path in expected_dir.rglob("*.csv")
+    )
+
+    fig_dir = tmp_workdir / "figures"
+    fig_dir.mkdir()
+    plotted = [plot_pollution_data(by_gas_dir, fig_dir, shard=Shard(i, 2))["plotted"] for i in range(2)]
+    assert sum(plotted) == 3
+    assert len(list(fig_dir.glob("*.png"))) == 3
+
+
+def test_sharded_run_in_processes(tmp_workdir: Path):
+    """Test the command line interface with three processes running the shards of one work_dir at the same time"""
+    processes = [
+        subprocess.Popen(
+            [sys.executable, str(SCRIPT), "run", str(tmp_workdir), "--shard", f"{i}/3", "--validate", "-f", "json"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for i in range(3)
+    ]
+    for process in processes:
+        _, stderr = process.communicate(timeout=300)
+        assert process.returncode == 0, stderr.decode()
+
+    restructured_dir = tmp_workdir / "pollution_data_restructured"
+    assert len(list((restructured_dir / "by_gas").rglob("*.csv"))) == 15
+    assert len(list((restructured_dir / "by_gas").rglob("summary.json"))) == 3
+    assert len(list((restructured_dir / "figures").glob("*.png"))) == 3
+    assert json.loads((restructured_dir / "validation_report.json").read_text()) == {}
+
+    shards_dir = restructured_dir / SHARDS_DIR_NAME
+    merged = json.loads((shards_dir / "restructure.json").read_text())
+    assert merged == {"copied": 15, "skipped": 0, "invalid": 0, "errors": {}, "shards": 3}
+    # Only the merged manifest is left once the run is complete
+    assert [path.name for path in shards_dir.iterdir()] == ["restructure.json"]
+
+
+def test_failed_merge_is_retried(tmp_workdir: Path, monkeypatch):
+    """Test that the merge lock is released when the steps after the merge fail, so that rerunning a shard retries them"""
+    import analyze_pollution_data
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("summary failed")
+
+    shards = [Shard(i, 2) for i in range(2)]
+    analyze_pollution_data.analyze_pollution_data(tmp_workdir, display=False, shard=shards[0])
+    with monkeypatch.context() as patch:
+        patch.setattr(analyze_pollution_data, "summarize_pollution_data", fail)
+        with pytest.raises(RuntimeError):
+            analyze_pollution_data.analyze_pollution_data(tmp_workdir, display=False, shard=shards[1])
+
+    coordinator = ShardCoordinator(tmp_workdir / "pollution_data_restructured" / SHARDS_DIR_NAME, 2)
+    assert not coordinator.lock_path.exists() and coordinator.pending() == []
+    analyze_pollution_data.analyze_pollution_data(tmp_workdir, display=False, shard=shards[0])
+    assert len(list((tmp_workdir / "pollution_data_restructured" / "figures").glob("*.png"))) == 3
+    assert coordinator.pending() == [0, 1]
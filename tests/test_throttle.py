@@ -0,0 +1,86 @@
+"""Test script for the I/O throttling and priority control, in analytic_tools/throttle.py
+"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+from analytic_tools.throttle import TokenBucket, io_throttle, parse_rate, set_io_limits
+from analytic_tools.utilities import copy_file_chunked, find_gas_csv_files
+
+
+class FakeClock:
+    """A clock that only moves forward when sleep is called"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def limits():
+    """Set limits on the process-wide throttle for one test, and remove them afterwards"""
+    yield set_io_limits
+    set_io_limits()
+
+
+def test_token_bucket():
+    """Test that a token bucket allows a burst, then waits in proportion to the tokens taken, also beyond its size"""
+    clock = FakeClock()
+    bucket = TokenBucket(100, burst=50, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(50) == 0
+    assert bucket.acquire(10) == pytest.approx(0.1)
+    # More than the bucket holds is a debt that is waited for
+    assert bucket.acquire(200) == pytest.approx(2.0)
+    assert clock.now == pytest.approx(2.1)
+
+    # Idle time refills the bucket, up to its burst
+    clock.now += 10
+    assert bucket.acquire(50) == 0
+    assert bucket.acquire(1) > 0
+
+    assert TokenBucket(None).acquire(10**9) == 0
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+@pytest.mark.parametrize("text, rate", [("100", 100), ("512K", 512 * 1024), ("20M", 20 * 1024**2), ("1gb", 1024**3)])
+def test_parse_rate(text, rate):
+    """Test the parsing of rates given on the command line"""
+    assert parse_rate(text) == rate
+
+
+def test_io_limits(tmp_path, limits):
+    """Test that copies and scans are accounted for and slowed down once limits are set"""
+    src = tmp_path / "CO2.csv"
+    src.write_bytes(b"x" * 4096)
+
+    copy_file_chunked(src, tmp_path / "unlimited.csv")
+    assert io_throttle.stats() == {"bytes": 0, "files": 0, "waited": 0.0}
+
+    limits(bytes_per_second=4096, files_per_second=1000)
+    copy_file_chunked(src, tmp_path / "first.csv", chunk_size=1024)
+    copy_file_chunked(src, tmp_path / "second.csv", chunk_size=1024)
+    stats = io_throttle.stats()
+    assert stats["bytes"] == 2 * 4096 and stats["files"] == 2
+    # The first copy used up the burst of one second, the second one had to wait for it to refill
+    assert stats["waited"] > 0.5
+
+    limits(files_per_second=1000)
+    find_gas_csv_files(tmp_path)
+    assert io_throttle.stats()["files"] == 1
+
+
+def test_lower_priority():
+    """Test that lower_priority raises the niceness of the process, in a separate process to leave pytest as it is"""
+    code = "import json; from analytic_tools.throttle import lower_priority; print(json.dumps(lower_priority(niceness=15)))"
+    res = json.loads(subprocess.run([sys.executable, "-c", code], capture_output=True, check=True, text=True).stdout)
+    if res["nice"] is None:
+        pytest.skip("os.setpriority is not available on this platform")
+    assert res["nice"] >= 15
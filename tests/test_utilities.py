@@ -3,6 +3,9 @@
 """
 
 # Include the necessary packages here
+import hashlib
+import os
+import shutil
 from pathlib import Path
 
 import pytest
@@ -12,10 +15,33 @@ from typing import Dict
 
 # This should work if analytic_tools has been installed properly in your environment
 from analytic_tools.utilities import (
+    GasCsvValidator,
+    add_copy_outcome,
+    copy_gas_stream,
+    is_restructured_source,
+    new_restructure_report,
+    preferred_variants,
+    stale_variants,
+    build_rollup_tree,
+    display_directory_tree,
+    Selection,
+    TraversalPolicy,
+    YearFilter,
+    copy_file_chunked,
+    find_gas_csv_files,
     get_dest_dir_from_csv_file,
+    gas_formula,
     get_diagnostics,
+    has_zstd,
+    hash_file,
     is_gas_csv,
+    is_up_to_date,
     merge_parent_and_basename,
+    open_csv,
+    restructured_name,
+    store_file,
+    validate_gas_csv,
+    walk,
 )
 
 
@@ -248,3 +274,330 @@ def test_merge_parent_and_basename_exceptions(exception, path):
     # Remove if you implement this task
     with pytest.raises(exception):
         merge_parent_and_basename(path)
+
+
+def test_is_up_to_date(tmp_path):
+    """Test functionality of is_up_to_date from utilities module
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    src = tmp_path / "CO2.csv"
+    dest = tmp_path / "src_test_CO2.csv"
+    src.write_text("aar,value\n1990,1\n")
+
+    assert not is_up_to_date(dest, [src])
+
+    shutil.copy2(src, dest)
+    assert is_up_to_date(dest, [src], same_size=True)
+
+    # Same modification time, but different size
+    src.write_text("aar,value\n1990,10\n")
+    os.utime(src, ns=(dest.stat().st_atime_ns, dest.stat().st_mtime_ns))
+    assert is_up_to_date(dest, [src])
+    assert not is_up_to_date(dest, [src], same_size=True)
+
+    with pytest.raises(TypeError):
+        is_up_to_date(5, [src])
+
+
+def test_hash_file_and_store_file(tmp_path):
+    """Test that hash_file reads in chunks without changing the digest, and that store_file keeps one copy per content
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    data = os.urandom(10_000)
+    src = tmp_path / "CO2.csv"
+    src.write_bytes(data)
+
+    assert hash_file(src, chunk_size=7) == hashlib.blake2b(data).hexdigest()
+    assert hash_file(src, algorithm="sha256") == hashlib.sha256(data).hexdigest()
+
+    stored, is_new = store_file(src, tmp_path / "store")
+    assert is_new
+    assert stored.name == hashlib.blake2b(data).hexdigest() + ".csv"
+    assert stored.read_bytes() == data
+
+    assert store_file(src, tmp_path / "store") == (stored, False)
+    assert [path.name for path in (tmp_path / "store").rglob("*") if path.is_file()] == [stored.name]
+
+    # The contents are addressed with any algorithm of new_hasher, including the optional xxhash ones
+    try:
+        import xxhash
+    except ImportError:
+        with pytest.raises(ImportError):
+            store_file(src, tmp_path / "xxh_store", algorithm="xxh64")
+    else:
+        stored, _ = store_file(src, tmp_path / "xxh_store", algorithm="xxh64")
+        assert stored.name == xxhash.xxh64(data).hexdigest() + ".csv"
+
+
+def _valid_csv(years=range(1990, 2023)) -> str:
+    """Contents of a valid gas .csv file reporting years"""
+    return 'aar,"Utslipp til luft (1 000 tonn CO2-ekvivalenter, AR5)"\n' + "".join(f"{year},{year - 1989}\n" for year in years)
+
+
+@pytest.mark.parametrize(
+    "contents, error",
+    [
+        ("", "empty"),
+        ("year,value\n" + _valid_csv().split("\n", 1)[1], "header"),
+        (_valid_csv(range(1990, 2022)), "1 missing years: 2022"),
+        (_valid_csv() + "2023,1\n", "outside"),
+        (_valid_csv() + "2000,1\n", "more than once"),
+        (_valid_csv().replace("2000,11", "2000,eleven"), "not numeric"),
+        (_valid_csv().replace("2000,11", "twothousand,11"), "not an integer"),
+        (_valid_csv().replace("2000,11", "2000,11,12"), "2 columns"),
+    ],
+    ids=["empty", "header", "missing", "outside", "duplicate", "value", "year", "columns"],
+)
+def test_validate_gas_csv_errors(tmp_path, contents, error):
+    """Test that validate_gas_csv reports each kind of malformed contents
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        contents (str): contents of the file to validate
+        error (str): part of the expected error message
+
+    Returns:
+        None
+    """
+    path = tmp_path / "CO2.csv"
+    path.write_text(contents)
+    errors = validate_gas_csv(path)
+    # A malformed row may also leave its year missing, which is reported after it
+    assert errors and error in errors[0], errors
+
+
+def test_gas_csv_validator_chunks():
+    """Test that GasCsvValidator gives the same result however the file is split into chunks
+
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+    data = _valid_csv().encode()
+    for chunk_size in [1, 7, len(data)]:
+        validator = GasCsvValidator()
+        for i in range(0, len(data), chunk_size):
+            validator.update(data[i : i + chunk_size])
+        assert validator.finish() == []
+
+
+def test_find_gas_csv_files_selection():
+    """Test that find_gas_csv_files only returns the selected gases and sources
+
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+    pollution_dir = Path(__file__).parent.parent / "pollution_data"
+    assert len(find_gas_csv_files(pollution_dir)) == 15
+
+    selection = Selection(gases=("C*",), exclude_sources=("oil_*", "air*"))
+    found = find_gas_csv_files(pollution_dir, selection)
+    assert sorted((path.parent.name, path.name) for path in found) == [
+        (source, gas) for source in ["src_agriculture", "src_industry", "src_road_traffic"] for gas in ["CH4.csv", "CO2.csv"]
+    ]
+    assert Selection(sources=("industry",)).match_source("src_industry")
+    assert not Selection(sources=("industry",)).match_source("src_oil_and_gass")
+
+
+def test_copy_file_chunked_year_filter(tmp_path):
+    """Test that a YearFilter keeps the header and the selected years however the file is split into chunks,
+    and that the consumers see the filtered contents
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    src = tmp_path / "CO2.csv"
+    src.write_text(_valid_csv())
+    expected = _valid_csv(range(2000, 2011)).encode()
+    for chunk_size in [1, 7, 1024]:
+        hasher = hashlib.sha256()
+        dest = tmp_path / f"copy_{chunk_size}.csv"
+        size = copy_file_chunked(src, dest, [hasher], chunk_size=chunk_size, transform=YearFilter(2000, 2010))
+        assert dest.read_bytes() == expected
+        assert size == len(expected)
+        assert hasher.hexdigest() == hashlib.sha256(expected).hexdigest()
+
+    validator = GasCsvValidator(first_year=2000, last_year=2010)
+    validator.update(expected)
+    assert validator.finish() == []
+
+
+@pytest.mark.parametrize("compression", [".gz", ".zst"])
+def test_compressed_gas_csv(tmp_path, compression):
+    """Test that compressed gas .csv files are classified as gas files and decompressed in chunks when copied,
+    validated and hashed
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        compression (str): suffix of the compressed files
+
+    Returns:
+        None
+    """
+    if compression == ".zst" and not has_zstd():
+        pytest.skip("reading .zst files requires the zstandard package")
+    assert is_gas_csv(f"CO2.csv{compression}")
+    assert not is_gas_csv(f"CO.csv{compression}")
+    with pytest.raises(ValueError):
+        is_gas_csv(f"CO2.txt{compression}")
+    assert gas_formula(f"by_src/src_industry/N2O.csv{compression}") == "N2O"
+    assert restructured_name(f"by_src/src_industry/N2O.csv{compression}") == "src_industry_N2O.csv"
+    assert restructured_name(f"by_src/src_industry/N2O.csv{compression}", True) == f"src_industry_N2O.csv{compression}"
+
+    plain = tmp_path / "src_industry" / "CO2.csv"
+    plain.parent.mkdir()
+    plain.write_text(_valid_csv())
+    src = plain.with_name(plain.name + compression)
+    with open_csv(src, "wb") as file:
+        file.write(plain.read_bytes())
+    assert src.read_bytes() != plain.read_bytes()
+
+    hasher = hashlib.sha256()
+    dest = tmp_path / "copy.csv"
+    assert copy_file_chunked(src, dest, [hasher], chunk_size=7, compression="") == plain.stat().st_size
+    assert dest.read_bytes() == plain.read_bytes()
+    assert hasher.hexdigest() == hashlib.sha256(plain.read_bytes()).hexdigest()
+    assert validate_gas_csv(src) == []
+    assert hash_file(src, decompress=True) == hash_file(plain)
+
+    # The copy keeps the compression of its source by default
+    recompressed = tmp_path / f"copy.csv{compression}"
+    copy_file_chunked(src, recompressed, transform=YearFilter(2000, 2010))
+    with open_csv(recompressed) as file:
+        assert file.read() == _valid_csv(range(2000, 2011)).encode()
+
+    stored, is_new = store_file(src, tmp_path / "store", compression="")
+    assert is_new and stored.name.endswith(".csv")
+    assert stored.read_bytes() == plain.read_bytes()
+    assert store_file(plain, tmp_path / "store")[0] == stored
+
+
+def test_walk_policy(tmp_path):
+    """Test that walk leaves out ignored names, stops at max_depth and survives symbolic link loops
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+
+    Returns:
+        None
+    """
+    (tmp_path / "a" / "b" / "c").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "c" / "deep.csv").write_text("")
+    (tmp_path / ".git" / "objects").mkdir(parents=True)
+    (tmp_path / ".git" / "objects" / "CO2.csv").write_text("")
+    (tmp_path / "a" / "loop").symlink_to(tmp_path, target_is_directory=True)
+
+    def walked(policy):
+        return sorted(os.path.relpath(dirpath, tmp_path) for dirpath, _, _ in walk(tmp_path, policy))
+
+    assert walked(None) == [".", ".git", os.path.join(".git", "objects"), "a", os.path.join("a", "b"), os.path.join("a", "b", "c")]
+    assert walked(TraversalPolicy(ignore=(".git",), max_depth=1)) == [".", "a"]
+    # The link back to the root is listed, but the root is not walked twice
+    assert walked(TraversalPolicy(ignore=(".*",), follow_symlinks=True)) == [
+        ".", "a", os.path.join("a", "b"), os.path.join("a", "b", "c")
+    ]
+    assert get_diagnostics(tmp_path, TraversalPolicy(ignore=(".git",)))["subdirectories"] == 4
+    assert get_diagnostics(tmp_path, TraversalPolicy(ignore=(".git",), max_depth=1))["files"] == 0
+
+
+def test_build_rollup_tree(tmp_path, capsys):
+    """Test that every node of the rollup tree holds the totals of its subtree, and that the
+    diagnostics and the displayed tree are served from it
+
+    Parameters:
+        tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        capsys (pytest fixture): captures the output printed
+
+    Returns:
+        None
+    """
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "c").mkdir()
+    (tmp_path / "README.md").write_text("12345")
+    (tmp_path / "a" / "CO2.csv").write_text("123")
+    (tmp_path / "a" / "b" / "CO2_1.npy").write_text("1")
+    (tmp_path / "a" / "b" / "notes.txt").write_text("12")
+
+    tree = build_rollup_tree(tmp_path)
+    assert [child.name for child in tree.children] == ["a", "c"]
+    a = tree.children[0]
+    assert (a.file_count, a.dir_count, a.bytes) == (3, 1, 6)
+    assert (tree.file_count, tree.dir_count, tree.bytes) == (4, 3, 11)
+    assert tree.diagnostics() == get_diagnostics(tmp_path)
+    assert tree.diagnostics() == {
+        "files": 4,
+        "subdirectories": 3,
+        ".csv files": 1,
+        ".txt files": 1,
+        ".npy files": 1,
+        ".md files": 1,
+        "other files": 0,
+    }
+    with pytest.raises(AttributeError):
+        tree.extra = 1
+
+    display_directory_tree(tmp_path, maxfiles=1, tree=tree)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1:] == [
+        f"- {tmp_path.name}/ (4 files)",
+        "    - README.md",
+        "    - a/ (3 files)",
+        "        - CO2.csv",
+        "        - b/ (2 files)",
+        "            - CO2_1.npy",
+        "            - ...",
+        "    - c/ (0 files)",
+    ]
+
+
+def test_restructure_steps(tmp_path):
+    """Test the per-file steps shared by the restructuring of directories, archives and file system backends"""
+    import io
+
+    assert is_restructured_source(("by_src", "src_agriculture", "CO2.csv.gz"))
+    assert not is_restructured_source(("CO2.csv",)) and not is_restructured_source(("src_a", "CO2_x.csv"))
+    selection = Selection(gases=("CO2",), exclude_sources=("agriculture",))
+    assert is_restructured_source(("src_industry", "CO2.csv"), selection)
+    assert not is_restructured_source(("src_agriculture", "CO2.csv"), selection)
+    assert not is_restructured_source(("src_industry", "CH4.csv"), selection)
+
+    dest = tmp_path / "copy.csv"
+    rows = "".join(f"{year},{year - 1989}\n" for year in range(1990, 2022))
+    assert copy_gas_stream(io.BytesIO(("aar,x\n" + rows).encode()), dest, validate=True, years=(2000, 2001)) == []
+    assert dest.read_text() == "aar,x\n2000,11\n2001,12\n"
+    errors = copy_gas_stream(io.BytesIO(b"year,x\n"), dest, validate=True)
+    assert errors and "header" in errors[0]
+
+    res = new_restructure_report(store=True, validate=True)
+    add_copy_outcome(res, "a.csv", [], 10, True)
+    add_copy_outcome(res, "b.csv", [], 10, False)
+    add_copy_outcome(res, "c.csv", ["bad"])
+    assert res == {"copied": 2, "skipped": 0, "stored": 1, "bytes stored": 10, "bytes saved": 10, "invalid": 1, "errors": {"c.csv": ["bad"]}}
+
+
+def test_preferred_variants():
+    """Test that one variant of a file stored plain and compressed is kept, the plain one first, then by compression"""
+    paths = ["a/src_x/CO2.csv.zst", "a/src_x/CO2.csv.gz", "a/src_y/CO2.csv.zst", "a/src_y/CO2.csv", "a/src_y/CH4.csv.gz"]
+    assert preferred_variants(paths) == ["a/src_x/CO2.csv.gz", "a/src_y/CO2.csv", "a/src_y/CH4.csv.gz"]
+    assert preferred_variants([Path(path) for path in paths])[0] == Path("a/src_x/CO2.csv.gz")
+
+    names = ["src_x_CO2.csv", "src_x_CO2.csv.zst", "src_y_CO2.csv.gz", "summary.json"]
+    assert stale_variants(names, {"src_x_CO2.csv", "src_y_CO2.csv.gz"}) == ["src_x_CO2.csv.zst"]
@@ -0,0 +1,95 @@
+"""Test script for the integrity verification in analytic_tools/verify.py
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+import analytic_tools.verify
+from analyze_pollution_data import main, restructure_pollution_data
+from analytic_tools.verify import MANIFEST_NAME, verify_restructured
+
+
+@pytest.fixture
+def restructured(tmp_workdir: Path) -> tuple[Path, Path]:
+    """Restructure the pollution_data of tmp_workdir and return the paths to pollution_data and by_gas"""
+    pollution_data = tmp_workdir / "pollution_data"
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    by_gas.mkdir(parents=True)
+    restructure_pollution_data(pollution_data, by_gas)
+    return pollution_data, by_gas
+
+
+def test_verify_restructured(restructured):
+    """Test that a fresh restructuring verifies, and that the second verification reuses the manifest
+
+    Parameters:
+        - restructured (tuple): paths to pollution_data and by_gas
+    Returns:
+        - None
+    """
+    pollution_data, by_gas = restructured
+
+    report = verify_restructured(pollution_data, by_gas)
+    assert report == {"checked": 15, "reused": 0, "mismatched": [], "missing": [], "unexpected": []}
+    assert (by_gas.parent / MANIFEST_NAME).exists()
+
+    report = verify_restructured(pollution_data, by_gas, workers=2)
+    assert report["checked"] == 0
+    assert report["reused"] == 15
+
+
+def test_verify_restructured_problems(restructured):
+    """Test that changed, missing and unexpected copies are reported
+
+    Parameters:
+        - restructured (tuple): paths to pollution_data and by_gas
+    Returns:
+        - None
+    """
+    pollution_data, by_gas = restructured
+    verify_restructured(pollution_data, by_gas)
+
+    # Same size, different contents
+    changed = by_gas / "gas_CO2" / "src_industry_CO2.csv"
+    data = bytearray(changed.read_bytes())
+    data[-2] = ord("0") if data[-2] != ord("0") else ord("1")
+    changed.write_bytes(bytes(data))
+    (by_gas / "gas_N2O" / "src_airtraffic_N2O.csv").unlink()
+    (by_gas / "gas_CH4" / "src_unknown_CH4.csv").write_text("aar,value\n")
+
+    report = verify_restructured(pollution_data, by_gas)
+    assert report["checked"] == 1
+    assert report["mismatched"] == ["gas_CO2/src_industry_CO2.csv"]
+    assert report["missing"] == ["gas_N2O/src_airtraffic_N2O.csv"]
+    assert report["unexpected"] == ["gas_CH4/src_unknown_CH4.csv"]
+
+    # The mismatch is remembered even when nothing is hashed again
+    report = verify_restructured(pollution_data, by_gas)
+    assert report["checked"] == 0
+    assert report["mismatched"] == ["gas_CO2/src_industry_CO2.csv"]
+
+
+@pytest.mark.parametrize("options, workers", [([], 4), (["-j", "1"], 1), (["-j", "8"], 8)])
+def test_verify_command_line_workers(restructured, monkeypatch, options: list[str], workers: int):
+    """Test that the verify command hashes with four workers by default, and with as many as asked for otherwise
+
+    Parameters:
+        - restructured (tuple): paths to pollution_data and by_gas
+        - options (List[str]): the options given to the command
+        - workers (int): the number of workers expected
+    Returns:
+        - None
+    """
+    calls = []
+
+    def verify(*args, **kwargs):
+        calls.append(kwargs["workers"])
+        return verify_restructured(*args, **kwargs)
+
+    monkeypatch.setattr(analytic_tools.verify, "verify_restructured", verify)
+    pollution_data, _ = restructured
+    assert main(["verify", str(pollution_data.parent), "-f", "json", *options]) == 0
+    assert calls == [workers]
+    assert [path.name for path in pollution_data.parent.joinpath("pollution_data_restructured").glob(".*")] == []
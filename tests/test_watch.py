@@ -0,0 +1,169 @@
+"""Test script for the watch mode in analytic_tools/watch.py
+"""
+import gzip
+import os
+import select
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from analyze_pollution_data import analyze_pollution_data
+from analytic_tools.watch import IN_Q_OVERFLOW, InotifyWatcher, PollingWatcher, apply_changes, watch_pollution_data
+
+
+def _drop_file(by_src: Path, source: str, gas: str) -> Path:
+    """Write a small [gas].csv file to by_src/src_[source], like the upstream export would"""
+    src_dir = by_src / f"src_{source}"
+    src_dir.mkdir(exist_ok=True)
+    path = src_dir / f"{gas}.csv"
+    path.write_text("aar,value\n1990,1\n1991,2\n")
+    return path
+
+
+def test_apply_changes(tmp_workdir: Path):
+    """Test that apply_changes copies new files, removes deleted ones and only plots the affected gases
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    analyze_pollution_data(tmp_workdir, display=False)
+    by_src = tmp_workdir / "pollution_data" / "by_src"
+    by_gas = tmp_workdir / "pollution_data_restructured" / "by_gas"
+    figures = tmp_workdir / "pollution_data_restructured" / "figures"
+    co2_plot_mtime = (figures / "gas_CO2.png").stat().st_mtime_ns
+
+    new_file = _drop_file(by_src, "shipping", "CH4")
+    assert apply_changes({new_file}, by_gas, figures) == ["gas_CH4"]
+    assert (by_gas / "gas_CH4" / "src_shipping_CH4.csv").exists()
+    assert (figures / "gas_CO2.png").stat().st_mtime_ns == co2_plot_mtime
+
+    # A compressed variant of a plain file leaves the copy of the plain one in place
+    (by_gas / "gas_CH4" / "src_shipping_CH4.csv.gz").write_bytes(b"stale")
+    compressed = new_file.with_name("CH4.csv.gz")
+    compressed.write_bytes(gzip.compress(b"aar,value\n1990,5\n"))
+    apply_changes({compressed}, by_gas, figures)
+    assert [path.name for path in (by_gas / "gas_CH4").glob("src_shipping_*")] == ["src_shipping_CH4.csv"]
+    assert (by_gas / "gas_CH4" / "src_shipping_CH4.csv").read_bytes() == new_file.read_bytes()
+    compressed.unlink()
+
+    # The only H2 file is removed again, together with its directory and plot
+    h2_file = _drop_file(by_src, "shipping", "H2")
+    apply_changes({h2_file}, by_gas, figures)
+    assert (figures / "gas_H2.png").exists()
+    h2_file.unlink()
+    assert apply_changes({h2_file}, by_gas, figures) == ["gas_H2"]
+    assert not (by_gas / "gas_H2").exists()
+    assert not (figures / "gas_H2.png").exists()
+
+
+@pytest.mark.parametrize("watcher_class", [PollingWatcher, InotifyWatcher])
+def test_watcher_detects_changes(tmp_path: Path, watcher_class):
+    """Test that both watchers report created gas .csv files and ignore other files
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory unique to the test invocation
+        - watcher_class (type): the watcher to test
+    Returns:
+        - None
+    """
+    if watcher_class is InotifyWatcher and not sys.platform.startswith("linux"):
+        pytest.skip("inotify is only available on Linux")
+
+    by_src = tmp_path / "by_src"
+    (by_src / "src_industry").mkdir(parents=True)
+    watcher = watcher_class(by_src) if watcher_class is InotifyWatcher else watcher_class(by_src, interval=0.01)
+    try:
+        created = _drop_file(by_src, "industry", "CO2")
+        (by_src / "src_industry" / "CO2_abc.csv").write_text("")
+        new_source = _drop_file(by_src, "shipping", "N2O")
+
+        changed: set = set()
+        deadline = time.monotonic() + 5
+        while {created, new_source} - changed and time.monotonic() < deadline:
+            changed |= watcher.poll(timeout=0.05)
+        # Files written to a brand new source directory may be picked up before it is watched
+        assert created in changed
+        assert all(path.name in ("CO2.csv", "N2O.csv") for path in changed)
+    finally:
+        watcher.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only available on Linux")
+def test_inotify_watcher_overflow(tmp_path: Path):
+    """Test that the inotify watcher scans the source directories again when the kernel dropped events,
+    and reports every file created, modified or deleted since its previous scan
+
+    Parameters:
+        - tmp_path (pathlib.Path): temporary directory unique to the test invocation
+    Returns:
+        - None
+    """
+    by_src = tmp_path / "by_src"
+    by_src.mkdir()
+    kept = _drop_file(by_src, "industry", "CO2")
+    modified = _drop_file(by_src, "industry", "CH4")
+    deleted = _drop_file(by_src, "industry", "N2O")
+    watcher = InotifyWatcher(by_src)
+    try:
+        modified.write_text("aar,value\n1990,3\n")
+        deleted.unlink()
+        created = _drop_file(by_src, "shipping", "SF6")
+        # Drop the events, as the kernel does when its queue is full, and report the overflow instead
+        while select.select([watcher._fd], [], [], 0.05)[0]:
+            os.read(watcher._fd, 64 * 1024)
+        watcher._handle_event(-1, IN_Q_OVERFLOW, b"")
+        assert watcher.poll(timeout=0) == {modified, deleted, created}
+        assert kept.exists()
+
+        # The source directory created while events were dropped is watched from then on
+        path = _drop_file(by_src, "shipping", "CO2")
+        changed: set = set()
+        deadline = time.monotonic() + 5
+        while path not in changed and time.monotonic() < deadline:
+            changed |= watcher.poll(timeout=0.05)
+        assert path in changed
+
+        # Another overflow only reports the changes since the last ones reported, which were already applied
+        time.sleep(0.05)
+        while select.select([watcher._fd], [], [], 0.05)[0]:
+            os.read(watcher._fd, 64 * 1024)
+        watcher._handle_event(-1, IN_Q_OVERFLOW, b"")
+        assert watcher.poll(timeout=0) == set()
+    finally:
+        watcher.close()
+
+
+def test_watch_pollution_data(tmp_workdir: Path):
+    """Test that watch_pollution_data updates the restructured tree after a file is dropped into by_src
+
+    Parameters:
+        - tmp_workdir (pathlib.Path): path to temporary directory with pollution_data in it
+    Returns:
+        - None
+    """
+    analyze_pollution_data(tmp_workdir, display=False)
+    updates = []
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch_pollution_data,
+        args=(tmp_workdir,),
+        kwargs={"debounce": 0.1, "interval": 0.05, "on_update": updates.append, "stop": stop},
+    )
+    thread.start()
+    try:
+        time.sleep(0.2)
+        _drop_file(tmp_workdir / "pollution_data" / "by_src", "road_traffic", "SF6")
+        deadline = time.monotonic() + 10
+        while not updates and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert updates == [["gas_SF6"]]
+    assert (tmp_workdir / "pollution_data_restructured" / "figures" / "gas_SF6.png").exists()